@@ -0,0 +1,27 @@
+/* Clientside callbacks of the time period controls, registered in pages/home.py and
+   pages/compare.py. Dates are 'YYYY-MM-DD' strings as sent by the date picker. */
+
+// date of an iso string minus a number of months, clamped to the end of the month
+// like python's date - relativedelta(months=months)
+function monthsBefore(isoDate, months) {
+    const [year, month, day] = isoDate.split('-').map(Number);
+    const monthIndex = year * 12 + month - 1 - months;
+    const newYear = Math.floor(monthIndex / 12);
+    const newMonth = monthIndex % 12 + 1;
+    const monthDays = new Date(Date.UTC(newYear, newMonth, 0)).getUTCDate();
+    const pad = (value, width) => String(value).padStart(width, '0');
+    return `${pad(newYear, 4)}-${pad(newMonth, 2)}-${pad(Math.min(day, monthDays), 2)}`;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    time_period: {
+        // start date, end date and disabled state of the date picker for a radiobutton,
+        // same as common_elements.time_period_dates with the bounds of the dataset
+        preset_dates: function(radioValue, bounds) {
+            if (radioValue > 0) {
+                return [monthsBefore(bounds.last_day, radioValue), bounds.last_day, true];
+            }
+            return [bounds.first_day, bounds.last_day, radioValue === 0];
+        }
+    }
+});
@@ -0,0 +1,5 @@
+""" Performance benchmarks of the chart functions and page callbacks on synthetic data.
+
+    python -m benchmarks.run --rows 10000 100000 1000000
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
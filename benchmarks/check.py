@@ -0,0 +1,285 @@
+""" Checks the aggregates of the query backends on a synthetic dataset.
+
+Random selections of the user controls are aggregated three ways:
+* pandas: by the backend of the dataset (QUERY_BACKEND) and by the pandas calls the
+  charts made on the filtered dataframe before the cube, e.g. value_counts and
+  groupby with nunique for the distinct urls,
+* backends: by every other query backend, which must return the same summaries
+  and frames as the backend of the dataset,
+* delta: by a dataset updated with a scrape batch by Dataset.with_delta, against the
+  pandas calls on its dataframe and against the dataset loaded again with the batch,
+  whose indexes must be the same.
+Mismatches are printed and make the exit status 1:
+
+    python -m benchmarks.check --rows 100000 --selections 200 """
+import argparse
+import copy
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.run import DATA_DIR
+from benchmarks.synthetic_data import write_csv
+
+CHECKS = ['pandas', 'backends', 'delta']
+# pies counting distinct urls: column and unique_only
+URL_COUNTS = [('district', False), ('cloud_skills', True), ('viz_tools', True)]
+
+
+def random_selections(data, n, seed):
+    ''' selections of every row and of none, then selections of random seniority levels,
+     professions and date ranges, some of them a few days long and some starting or ending
+     outside of the dataset '''
+    from pages.functions.load_data import TYPE_COLUMNS
+    from pages.functions.selection import Selection
+
+    rng = random.Random(seed)
+    job_types = [value for value in data.job_types if isinstance(value, str)]
+    first, last = data.first_day.toordinal(), data.last_day.toordinal()
+    yield Selection([], [], str(data.first_day.date()), str(data.last_day.date()), data)
+    yield Selection([], [], str(date.fromordinal(first - 10)), str(date.fromordinal(first - 1)),
+                    data)
+    for _ in range(n - 2):
+        start = rng.randint(first - 5, last)
+        end = start + rng.choice([rng.randint(0, 14), rng.randint(0, last - start + 5)])
+        yield Selection(rng.sample(job_types, rng.randint(0, 2)),
+                        rng.sample(TYPE_COLUMNS, rng.randint(0, 2)),
+                        str(date.fromordinal(start)), str(date.fromordinal(end)), data)
+
+
+def selected_frame(df, sel):
+    ''' rows of the selection filtered with pandas masks '''
+    mask = df['first_online'].between(pd.Timestamp(sel.start_day), pd.Timestamp(sel.end_day))
+    if sel.job_types:
+        mask &= df['job_type'].isin(sel.job_types)
+    if sel.all_types:
+        mask &= (df[sel.all_types] > 0).any(axis=1)
+    return df[mask]
+
+
+def as_day(value):
+    ''' day of a timestamp as datetime64[D], NaT for a missing one (an empty selection) '''
+    return np.datetime64('NaT', 'D') if pd.isna(value) else np.datetime64(value.date(), 'D')
+
+
+def as_dict(series):
+    ''' non-zero values of a series by index, to compare results of any dtype '''
+    return {key: int(value) for key, value in series.items() if value}
+
+
+def same(expected, actual):
+    ''' equality of two results: frames, series, dictionaries or arrays, floats up to
+     rounding and NaN or NaT equal to themselves '''
+    if isinstance(expected, (pd.DataFrame, pd.Series)):
+        return isinstance(actual, type(expected)) and expected.equals(actual)
+    if isinstance(expected, dict):
+        return expected == actual
+    expected, actual = np.asarray(expected), np.asarray(actual)
+    if expected.shape != actual.shape:
+        return False
+    if expected.dtype.kind == 'f':
+        return np.allclose(expected, actual, equal_nan=True)
+    return np.array_equal(expected, actual, equal_nan=expected.dtype.kind == 'M')
+
+
+def failed_checks(checks):
+    ''' names of the (name, expected, actual) checks whose results are not the same '''
+    return [name for name, expected, actual in checks if not same(expected, actual)]
+
+
+def pandas_checks(sel, df):
+    ''' aggregates of the selection against the pandas calls of the pages '''
+    selected = selected_frame(df, sel)
+    unique = selected[selected['is_unique_text'] > 0]
+    summary = sel.summary
+    yield 'rows', [len(selected) - len(unique), len(unique)], summary.parts['rows']
+    yield 'last_day', as_day(selected['first_online'].max()), as_day(sel.last_day())
+    yield ('mean_experience', selected['min_experience'].mean(), summary.mean_experience())
+    for column in summary.cube.categories:
+        if f"rows_{column}" in summary.parts:
+            yield (f"counts[{column}]", as_dict(selected[column].value_counts()),
+                   as_dict(summary.counts(column)))
+    skills = summary.cube.skills
+    for mention, value in (('advantage', 1), ('mandatory', 2)):
+        yield (f"skills[{mention}]", as_dict(unique[skills].eq(value).sum()),
+               as_dict(summary.skills()[mention]))
+    yield ('value_counts[company]',
+           as_dict(unique[unique['is_direct'] > 0]['company'].value_counts()),
+           as_dict(sel.value_counts('company', 'is_unique_text', 'is_direct')))
+    mentions = unique[skills].to_numpy(dtype='int8') > 0
+    yield ('cooccurrence', mentions.astype('int64').T @ mentions,
+           sel.cooccurrence().to_numpy())
+
+    # distinct urls
+    for column, unique_only in URL_COUNTS:
+        frame = unique if unique_only else selected
+        yield (f"urls[{column}]",
+               as_dict(frame.groupby(column, observed=True)['url'].nunique()),
+               as_dict(summary.counts(column, unique_only, distinct_urls=True)))
+    yield 'urls', selected['url'].nunique(), summary.urls()
+    yield ('weekly', as_dict(unique.groupby('week_num')['url'].nunique()),
+           as_dict(sel.weekly()['jobs_count']))
+    for unique_only in (True, False):
+        frame = unique if unique_only else selected
+        yield (f"time_series[month_num,{unique_only}]",
+               as_dict(frame.groupby('month_num')['url'].nunique()),
+               as_dict(sel.time_series('month_num', unique_only)['jobs_count']))
+
+
+def results(sel):
+    ''' every aggregate of a selection by name '''
+    summary = sel.summary
+    values = {f"summary.{name}": parts for name, parts in summary.parts.items()}
+    values['summary.max_day'] = summary.max_day
+    values['urls'] = summary.urls()
+    for column, unique_only in URL_COUNTS:
+        values[f"urls[{column}]"] = summary.counts(column, unique_only, distinct_urls=True)
+    first_days = [sel.start_day + 30, sel.end_day - 6, np.datetime64('NaT', 'D')]
+    for first_day, period in zip(first_days, sel.periods(first_days)):
+        values.update({f"periods[{first_day}].{name}": parts
+                       for name, parts in period.parts.items()})
+        values[f"periods[{first_day}].max_day"] = period.max_day
+    values['weekly'] = sel.weekly()
+    for bucket_column in ('week_num', 'month_num'):
+        for unique_only in (True, False):
+            values[f"time_series[{bucket_column},{unique_only}]"] = sel.time_series(
+                bucket_column, unique_only)
+    values['value_counts[company]'] = sel.value_counts('company', 'is_unique_text', 'is_direct')
+    for mention in ('any', 'advantage', 'mandatory'):
+        values[f"cooccurrence[{mention}]"] = sel.cooccurrence(mention)
+    return values
+
+
+def result_checks(sel, other, prefix):
+    ''' results of the selection against the ones of the same controls on another dataset '''
+    from pages.functions.selection import Selection
+
+    expected = results(sel)
+    actual = results(Selection(sel.job_types, sel.all_types, sel.start_day, sel.end_day,
+                               other))
+    for name, value in expected.items():
+        yield f"{prefix}:{name}", value, actual.get(name)
+
+
+def backend_datasets(data):
+    ''' copies of the dataset queried by each other backend, the stored ones write their
+     copy of the version in the snapshot folder '''
+    from pages.functions.query_backend import BACKENDS, duckdb
+
+    others = {}
+    for name, backend in BACKENDS.items():
+        if isinstance(data.backend, backend) or (name == 'duckdb' and duckdb is None):
+            continue
+        if backend.in_memory and data.cube is None:
+            # the in-memory indexes are not built for a stored backend
+            continue
+        other = copy.copy(data)
+        other.backend = backend(other)
+        others[name] = other
+    return others
+
+
+def write_batch(csv_path, path, seed):
+    ''' scrape batch upserting a sample of the csv rows with a new seniority level and recent
+     days, and adding rows with new urls in a new district '''
+    rng = np.random.default_rng(seed)
+    df = pd.read_csv(csv_path, parse_dates=['first_online'])
+    n_rows = max(len(df) // 100, 10)
+    batch = pd.concat([df.sample(n_rows, random_state=seed),
+                       df.sample(n_rows, random_state=seed + 1)], ignore_index=True)
+    batch.loc[n_rows:, 'url'] = [f"https://example.com/new/{i}" for i in range(n_rows)]
+    batch['job_type'] = rng.choice(['Senior', 'Architect'], len(batch))
+    batch.loc[n_rows:, 'district'] = 'Eilat'
+    days = np.datetime64(df['first_online'].max(), 'D') - rng.integers(0, 60, len(batch))
+    batch['first_online'] = pd.DatetimeIndex(days.astype('datetime64[ns]')).strftime('%Y-%m-%d')
+    batch.to_csv(path, index=False)
+
+
+def delta_datasets(csv_path, seed):
+    ''' the dataset updated with a batch by with_delta and loaded again with it, both with
+     the snapshots of a temporary folder '''
+    from pages.functions import dataset
+    from pages.functions.load_data import load_dataset, write_delta
+
+    snapshot_dir = tempfile.mkdtemp(prefix='check-')
+    base = dataset.Dataset(load_dataset(csv_path, snapshot_dir, shared=False))
+    batch_path = os.path.join(snapshot_dir, 'batch.csv')
+    write_batch(csv_path, batch_path, seed)
+    name = write_delta(batch_path, base.source_key, snapshot_dir)
+    return (base.with_delta(name), dataset.Dataset(load_dataset(csv_path, snapshot_dir,
+                                                                shared=False)),
+            snapshot_dir)
+
+
+def index_checks(updated, loaded):
+    ''' filter index and cube arrays of the updated dataset against the loaded one '''
+    if updated.cube is None:
+        return
+    for name in ('order', 'days'):
+        yield (f"filter_index.{name}", getattr(loaded.filter_index, name),
+               getattr(updated.filter_index, name))
+    for masks in ('job_type_masks', 'type_masks'):
+        expected, actual = getattr(loaded.filter_index, masks), getattr(updated.filter_index,
+                                                                        masks)
+        yield f"filter_index.{masks}", list(expected), list(actual)
+        for value, mask in expected.items():
+            yield f"filter_index.{masks}[{value}]", mask, actual.get(value)
+    for name, values in loaded.cube.columns.items():
+        yield f"cube.columns[{name}]", values, updated.cube.columns[name]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--selections', type=int, default=100)
+    parser.add_argument('--checks', nargs='+', choices=CHECKS, default=CHECKS)
+    args = parser.parse_args(argv)
+
+    from pages.functions import dataset
+    from pages.functions.load_data import load_dataset
+
+    csv_path = write_csv(args.rows, DATA_DIR, args.seed)
+    df = load_dataset(csv_path, os.path.join(os.path.dirname(csv_path), 'snapshots'),
+                      shared=False)
+    data = dataset.Dataset(df)
+    checked = failed = 0
+
+    def run(checks, sel=None):
+        nonlocal checked, failed
+        for name, expected, actual in checks:
+            checked += 1
+            if not same(expected, actual):
+                failed += 1
+                where = (f" of {sel.job_types} {sel.all_types} {sel.start_day} {sel.end_day}"
+                         if sel is not None else '')
+                print(f"{name}{where}: expected {expected}, got {actual}")
+
+    others = backend_datasets(data) if 'backends' in args.checks else {}
+    for sel in random_selections(data, args.selections, args.seed):
+        if 'pandas' in args.checks:
+            run(pandas_checks(sel, df), sel)
+        for name, other in others.items():
+            run(result_checks(sel, other, name), sel)
+
+    if 'delta' in args.checks:
+        updated, loaded, snapshot_dir = delta_datasets(csv_path, args.seed)
+        try:
+            run(index_checks(updated, loaded))
+            for sel in random_selections(updated, args.selections, args.seed):
+                run(pandas_checks(sel, updated.df), sel)
+                run(result_checks(sel, loaded, 'delta'), sel)
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+    print(f"{checked} checks of {args.selections} selections, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+""" Compares two result files of benchmarks/run.py and reports slower functions.
+
+    python -m benchmarks.compare old.json new.json --threshold 1.2
+
+The exit code is 1 when a median wall time grew by more than the threshold ratio. """
+import argparse
+import json
+import sys
+
+
+def load_records(path):
+    ''' records of a result file by (rows, case, function) '''
+    with open(path, encoding='utf-8') as results_file:
+        results = json.load(results_file)
+    return {(rec['rows'], rec['case'], rec['function']): rec for rec in results['records']}
+
+
+def compare(old, new, threshold):
+    ''' prints the ratios of the measures present in both runs, returns the regressed keys '''
+    regressions = []
+    print(f"{'rows':>9} {'case':<9} {'function':<36} {'old ms':>9} {'new ms':>9}"
+          f" {'ratio':>6} {'MB ratio':>8} {'json ratio':>10}")
+    for key in sorted(old.keys() & new.keys()):
+        old_rec, new_rec = old[key], new[key]
+        ratio = new_rec['wall_median_s'] / max(old_rec['wall_median_s'], 1e-9)
+        memory = 'peak_memory_mb' if new_rec['peak_memory_mb'] is not None else 'rss_growth_mb'
+        memory_ratio = ((new_rec[memory] or 0) / old_rec[memory]
+                        if old_rec.get(memory) else float('nan'))
+        json_ratio = (new_rec['json_bytes'] / old_rec['json_bytes']
+                      if new_rec['json_bytes'] and old_rec['json_bytes'] else float('nan'))
+        flag = ''
+        if ratio > threshold:
+            regressions.append(key)
+            flag = ' !!!'
+        print(f"{key[0]:>9,d} {key[1]:<9} {key[2]:<36} {old_rec['wall_median_s']*1000:9.1f}"
+              f" {new_rec['wall_median_s']*1000:9.1f} {ratio:6.2f} {memory_ratio:8.2f}"
+              f" {json_ratio:10.2f}{flag}")
+    for key in sorted(old.keys() ^ new.keys()):
+        print(f"only in {'old' if key in old else 'new'} run: {key}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='wall time ratio reported as a regression')
+    args = parser.parse_args(argv)
+    regressions = compare(load_records(args.old), load_records(args.new), args.threshold)
+    print(f"{len(regressions)} regressions above {args.threshold:.2f}x")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
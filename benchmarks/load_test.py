@@ -0,0 +1,460 @@
+""" Replays filter sessions of simulated users against the app served locally.
+
+    python -m benchmarks.load_test --users 20 --duration 60 \\
+        --config workers=1 --config "workers=1 FIGURE_CACHE_SIZE=0"
+
+Every configuration starts dash_app:server on a synthetic dataset (see run.py) with
+the given number of workers and environment variables, then each user opens the home
+page and keeps changing the filters like the browser does: the seniority dropdowns and
+profession checkboxes are toggled, the time period radiobuttons switched (the presets
+are turned into dates as in assets/time_period.js) and the user moves between / and
+/compare. Each change posts every server callback depending on it to
+/_dash-update-component at once, six at a time like a browser, and background
+callbacks are polled until their result is ready.
+The callbacks, their inputs and the page layouts are read from the server, so the
+sessions follow the pages without being listed here.
+Workers are run by gunicorn when it is installed; otherwise each worker is a threaded
+werkzeug server on its own port, and the users are spread over the ports.
+Throughput, error rate and the latency percentiles of every callback and user action
+are printed per configuration, compared side by side and saved as json in
+benchmarks/results. """
+import argparse
+import gzip
+import http.client
+import importlib.util
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from urllib.parse import urlencode
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from benchmarks.run import DATA_DIR, RESULTS_DIR, git_commit
+from benchmarks.synthetic_data import write_csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIGS = ['workers=1', 'workers=1 FIGURE_CACHE_SIZE=0']
+# concurrent requests of a browser to one host
+BROWSER_CONNECTIONS = 6
+# user actions and their weights, pages are switched less often than filters
+ACTIONS = {'toggle': 6, 'radio': 3, 'page': 1}
+PAGES = ['/', '/compare']
+ROUTER_OUTPUT = '_pages_content'
+PERCENTILES = [50, 95, 99]
+
+
+def parse_config(text):
+    ''' number of workers and environment variables of a configuration like
+     "workers=2 FIGURE_CACHE_SIZE=0" '''
+    env = dict(item.split('=', 1) for item in shlex.split(text))
+    return int(env.pop('workers', 1)), env
+
+
+class Server:
+    ''' the app served by subprocesses for one configuration '''
+
+    def __init__(self, config, data_dir, port, threads):
+        workers, env = parse_config(config)
+        env = dict(os.environ, PYTHONPATH=ROOT,
+                   DATA_SNAPSHOT_DIR=os.path.join(data_dir, 'snapshots'), **env)
+        if importlib.util.find_spec('gunicorn') is not None:
+            self.ports = [port]
+            commands = [[sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                         '--threads', str(threads), '--bind', f"127.0.0.1:{port}",
+                         '--log-level', 'warning', 'dash_app:server']]
+        else:
+            self.ports = list(range(port, port + workers))
+            commands = [[sys.executable, '-c',
+                         "import sys; from werkzeug.serving import run_simple; import dash_app; "
+                         "run_simple('127.0.0.1', int(sys.argv[1]), dash_app.server, "
+                         "threaded=True)", str(worker_port)]
+                        for worker_port in self.ports]
+        # the csv of the dataset is found in the working directory, the server logs
+        # every request so its output goes to a file
+        self.log_path = os.path.join(data_dir, 'load_test_server.log')
+        with open(self.log_path, 'wb') as log:
+            self.processes = [subprocess.Popen(command, cwd=data_dir, env=env,
+                                               stdout=log, stderr=subprocess.STDOUT)
+                              for command in commands]
+
+    def wait_ready(self, timeout):
+        ''' waits until every port serves the layout, the first start writes the snapshot '''
+        deadline = time.monotonic() + timeout
+        for port in self.ports:
+            while True:
+                for process in self.processes:
+                    if process.poll() is not None:
+                        with open(self.log_path, encoding='utf-8', errors='replace') as log:
+                            raise RuntimeError(f"server exited: {log.read()[-2000:]}")
+                try:
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                    connection.request('GET', '/_dash-layout')
+                    if connection.getresponse().status == 200:
+                        break
+                except OSError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"server not ready on port {port} after {timeout}s")
+                time.sleep(0.5)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class Recorder:
+    ''' latencies and errors by request or action name, shared by the user threads '''
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.requests = 0
+        self.response_bytes = 0
+        self.recording = False
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, ok=True, size=0, request=True):
+        if not self.recording:
+            return
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            self.errors[name] = self.errors.get(name, 0) + (not ok)
+            if request:
+                self.requests += 1
+                self.response_bytes += size
+
+    def summary(self, duration):
+        ''' throughput, error rate and latency percentiles in ms by name '''
+        names = {}
+        for name, values in sorted(self.latencies.items()):
+            percentiles = np.percentile(np.array(values) * 1000, PERCENTILES)
+            names[name] = {'count': len(values), 'errors': self.errors[name],
+                           **{f"p{p}_ms": value for p, value in zip(PERCENTILES, percentiles)}}
+        errors = sum(self.errors[name] for name in names if not name.startswith('action:'))
+        return {'duration_s': duration,
+                'requests': self.requests,
+                'requests_per_s': self.requests / duration,
+                'error_rate': errors / max(self.requests, 1),
+                'response_bytes': self.response_bytes,
+                'latencies': names}
+
+
+def split_outputs(output):
+    ''' (id, property) pairs of the output string of a callback '''
+    if output.startswith('..'):
+        return [tuple(item.rsplit('.', 1)) for item in output[2:-2].split('...')]
+    return [tuple(output.rsplit('.', 1))]
+
+
+def walk_layout(component, found):
+    ''' props of every component of a layout with a string id, by id '''
+    if isinstance(component, list):
+        for child in component:
+            walk_layout(child, found)
+    elif isinstance(component, dict):
+        props = component.get('props', {})
+        if isinstance(props.get('id'), str):
+            found[props['id']] = (component.get('type'), props)
+        for value in props.values():
+            if isinstance(value, (dict, list)):
+                walk_layout(value, found)
+
+
+class Client:
+    ''' http connections of a user to one server port, one per browser connection '''
+
+    def __init__(self, port, recorder, timeout):
+        self.port = port
+        self.recorder = recorder
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, name, method, path, body=None):
+        ''' decoded json response, None after an error '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(
+                '127.0.0.1', self.port, timeout=self.timeout)
+        headers = {'Accept-Encoding': 'gzip', 'Content-Type': 'application/json'}
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=json.dumps(body) if body else None,
+                               headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            self.recorder.add(name, time.perf_counter() - start, ok=False)
+            return None
+        self.recorder.add(name, time.perf_counter() - start, response.status in (200, 204),
+                          len(data))
+        if response.status != 200:
+            return None
+        if response.getheader('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return json.loads(data)
+
+
+class User(threading.Thread):
+    ''' a browser session moving between the pages and changing their filters '''
+
+    def __init__(self, client, recorder, rng, think, stop):
+        super().__init__(daemon=True)
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.think = think
+        self.stop_event = stop
+        self.pool = ThreadPoolExecutor(BROWSER_CONNECTIONS)
+        self.values = {}
+        self.components = {}
+        self.path = None
+
+    def run(self):
+        dependencies = self.client.request('GET /_dash-dependencies', 'GET', '/_dash-dependencies')
+        layout = self.client.request('GET /_dash-layout', 'GET', '/_dash-layout')
+        if dependencies is None or layout is None:
+            return
+        callbacks = [callback for callback in dependencies if 'MATCH' not in callback['output']]
+        self.server_callbacks = [callback for callback in callbacks
+                                 if not callback['clientside_function']]
+        # time period radiobuttons turned into dates in the browser: radio id ->
+        # (date picker id, bounds store id)
+        self.presets = {callback['inputs'][0]['id']:
+                        (split_outputs(callback['output'])[0][0], callback['state'][0]['id'])
+                        for callback in callbacks
+                        if callback['clientside_function']
+                        and callback['clientside_function']['function_name'] == 'preset_dates'}
+        walk_layout(layout, self.components)
+        self.layout_components = dict(self.components)
+        self.visit(PAGES[0])
+        while not self.stop_event.wait(self.rng.expovariate(1 / self.think) if self.think else 0):
+            action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+            start = time.perf_counter()
+            ok = getattr(self, action)()
+            self.recorder.add(f"action:{action}", time.perf_counter() - start, ok, request=False)
+        self.pool.shutdown()
+
+    def set_values(self, components):
+        for component_id, (_, props) in components.items():
+            for prop, value in props.items():
+                self.values[f"{component_id}.{prop}"] = value
+
+    def visit(self, path):
+        ''' page layout from the router callback, then the callbacks of its components '''
+        self.path = path
+        self.values.update({'_pages_location.pathname': path, '_pages_location.search': ''})
+        router = next(callback for callback in self.server_callbacks
+                      if split_outputs(callback['output'])[0][0] == ROUTER_OUTPUT)
+        response = self.post(router, ['_pages_location.pathname'])
+        if response is None:
+            return False
+        self.components = dict(self.layout_components)
+        walk_layout(response['response'][ROUTER_OUTPUT]['children'], self.components)
+        self.set_values(self.components)
+        initial = [callback for callback in self.server_callbacks
+                   if callback is not router and not callback['prevent_initial_call']]
+        return self.fire(initial, [])
+
+    def page(self):
+        return self.visit(self.rng.choice([path for path in PAGES if path != self.path]))
+
+    def toggle(self):
+        ''' adds or removes an option of a dropdown or checklist with several values '''
+        choices = [(component_id, props) for component_id, (_, props) in self.components.items()
+                   if isinstance(props.get('value'), list) and props.get('options')]
+        component_id, props = self.rng.choice(choices)
+        option = self.rng.choice(props['options'])
+        option = option['value'] if isinstance(option, dict) else option
+        value = list(self.values[f"{component_id}.value"])
+        value = [item for item in value if item != option] if option in value else value + [option]
+        return self.change({f"{component_id}.value": value})
+
+    def radio(self):
+        ''' switches a radiobutton, time periods set the dates of their date picker '''
+        choices = [component_id for component_id, (kind, props) in self.components.items()
+                   if kind == 'RadioItems' and props.get('options')]
+        component_id = self.rng.choice(choices)
+        value = self.rng.choice([option['value'] for option
+                                 in self.components[component_id][1]['options']
+                                 if option['value'] != self.values[f"{component_id}.value"]])
+        changes = {f"{component_id}.value": value}
+        if component_id in self.presets:
+            picker, bounds = self.presets[component_id]
+            changes.update(self.preset_dates(picker, value, self.values[f"{bounds}.data"]))
+        return self.change(changes)
+
+    def preset_dates(self, picker, value, bounds):
+        ''' date picker values of a time period, a custom period is picked at random '''
+        first_day = date.fromisoformat(bounds['first_day'])
+        last_day = date.fromisoformat(bounds['last_day'])
+        if value > 0:
+            first_day = last_day - relativedelta(months=value)
+        elif value < 0:
+            first_day = date.fromordinal(self.rng.randint(first_day.toordinal(),
+                                                          last_day.toordinal()))
+        return {f"{picker}.start_date": str(first_day), f"{picker}.end_date": str(last_day)}
+
+    def change(self, changes):
+        ''' sets property values and posts the server callbacks depending on them '''
+        changed = [prop for prop, value in changes.items() if self.values.get(prop) != value]
+        self.values.update(changes)
+        return self.fire([callback for callback in self.server_callbacks
+                          if any(f"{item['id']}.{item['property']}" in changed
+                                 for item in callback['inputs'])], changed)
+
+    def fire(self, callbacks, changed):
+        ''' posts the callbacks whose inputs are all on the page at once, True without errors '''
+        callbacks = [callback for callback in callbacks if all(
+            f"{item['id']}.{item['property']}" in self.values for item in callback['inputs'])]
+        responses = list(self.pool.map(lambda callback: self.post(callback, changed), callbacks))
+        return all(response is not None for response in responses)
+
+    def post(self, callback, changed):
+        ''' response of a server callback for the current property values '''
+        outputs = [{'id': component_id, 'property': prop}
+                   for component_id, prop in split_outputs(callback['output'])]
+
+        def values(items):
+            return [{**item, 'value': self.values.get(f"{item['id']}.{item['property']}")}
+                    for item in items]
+        body = {'output': callback['output'],
+                'outputs': outputs if callback['output'].startswith('..') else outputs[0],
+                'inputs': values(callback['inputs']),
+                'state': values(callback['state']),
+                'changedPropIds': [prop for prop in changed if any(
+                    f"{item['id']}.{item['property']}" == prop for item in callback['inputs'])]}
+        name = outputs[0]['id']
+        if not callback.get('background'):
+            return self.client.request(name, 'POST', '/_dash-update-component', body)
+        # background callbacks start a job, then the browser polls for its result
+        start = time.perf_counter()
+        job = self.client.request(f"{name}[start]", 'POST', '/_dash-update-component', body)
+        response = job
+        while job is not None and 'response' not in response:
+            time.sleep(callback['background']['interval'] / 1000)
+            query = urlencode({'cacheKey': job['cacheKey'], 'job': job['job']})
+            response = self.client.request(f"{name}[poll]", 'POST',
+                                           f"/_dash-update-component?{query}", body)
+            if response is None:
+                break
+        self.recorder.add(name, time.perf_counter() - start, response is not None,
+                          request=False)
+        return response
+
+
+def run_config(config, args, data_dir):
+    ''' summary of the sessions of all users against one configuration '''
+    server = Server(config, data_dir, args.port, args.threads)
+    try:
+        server.wait_ready(args.start_timeout)
+        recorder = Recorder()
+        stop = threading.Event()
+        rng = random.Random(args.seed)
+        users = [User(Client(server.ports[position % len(server.ports)], recorder,
+                             args.request_timeout),
+                      recorder, random.Random(rng.random()), args.think, stop)
+                 for position in range(args.users)]
+        for user in users:
+            user.start()
+        # the first page views and cold caches are not recorded
+        time.sleep(args.warmup)
+        recorder.recording = True
+        start = time.perf_counter()
+        time.sleep(args.duration)
+        recorder.recording = False
+        duration = time.perf_counter() - start
+        stop.set()
+        for user in users:
+            user.join(args.request_timeout)
+        return recorder.summary(duration)
+    finally:
+        server.stop()
+
+
+def print_summary(config, summary):
+    print(f"\n{config}: {summary['requests']:,d} requests, "
+          f"{summary['requests_per_s']:.1f} req/s, {summary['error_rate']:.2%} errors, "
+          f"{summary['response_bytes'] / max(summary['requests'], 1) / 1024:.1f} kB/response")
+    print(f"{'name':<28} {'count':>7} {'errors':>7}"
+          + ''.join(f" {f'p{p} ms':>9}" for p in PERCENTILES))
+    for name, stats in summary['latencies'].items():
+        print(f"{name:<28} {stats['count']:>7,d} {stats['errors']:>7,d}"
+              + ''.join(f" {stats[f'p{p}_ms']:9.1f}" for p in PERCENTILES))
+
+
+def print_comparison(summaries):
+    ''' throughput and p95 of every name in each configuration, side by side '''
+    configs = list(summaries)
+    print('\n' + f"{'p95 ms':<28}" + ''.join(f" {config[:24]:>24}" for config in configs))
+    print(f"{'requests/s':<28}" + ''.join(f" {summaries[config]['requests_per_s']:24.1f}"
+                                          for config in configs))
+    print(f"{'error rate':<28}" + ''.join(f" {summaries[config]['error_rate']:24.2%}"
+                                          for config in configs))
+    names = sorted({name for summary in summaries.values() for name in summary['latencies']})
+    for name in names:
+        print(f"{name:<28}" + ''.join(
+            f" {summaries[config]['latencies'][name]['p95_ms']:24.1f}"
+            if name in summaries[config]['latencies'] else f" {'-':>24}" for config in configs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--config', action='append',
+                        help='workers and environment variables of a server configuration, '
+                             f"repeated to compare several (default: {DEFAULT_CONFIGS})")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30, help='recorded seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds before recording')
+    parser.add_argument('--think', type=float, default=1.0,
+                        help='mean seconds between the actions of a user')
+    parser.add_argument('--threads', type=int, default=4, help='threads of a gunicorn worker')
+    parser.add_argument('--port', type=int, default=8060)
+    parser.add_argument('--start-timeout', type=float, default=600)
+    parser.add_argument('--request-timeout', type=float, default=60)
+    parser.add_argument('--output', help='json file, by default a new file in benchmarks/results')
+    args = parser.parse_args(argv)
+
+    data_dir = os.path.abspath(os.path.dirname(write_csv(args.rows, DATA_DIR, args.seed)))
+    started = datetime.now()
+    summaries = {}
+    for config in args.config or DEFAULT_CONFIGS:
+        summaries[config] = run_config(config, args, data_dir)
+        print_summary(config, summaries[config])
+    if len(summaries) > 1:
+        print_comparison(summaries)
+
+    commit = git_commit()
+    results = {'created': started.isoformat(timespec='seconds'),
+               'git_commit': commit,
+               'cpu_count': os.cpu_count(),
+               'rows': args.rows,
+               'users': args.users,
+               'think_s': args.think,
+               'configs': summaries}
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load-{started:%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as results_file:
+        json.dump(results, results_file, indent=1)
+    print(f"results saved to {output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+""" Times the chart functions and page callbacks on synthetic datasets of several sizes.
+
+Chart functions get a new Selection on every call, so their timings include the
+aggregation they need, and the callbacks are called without their figure cache and instrumentation.
+The import time of the app and the warm-up of the preset figures are measured as well,
+and so are the encoding and compression of the home callback outputs, as full figures
+and as the patches sent by the callbacks, and the callbacks answered by their figure cache.
+Each measure records the median and minimum wall time, the growth of the resident
+memory, the peak memory traced by tracemalloc during one more call and the size of
+the output serialized to json.
+Results are saved as json in benchmarks/results, see compare.py. """
+import argparse
+import functools
+import inspect
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly
+from dateutil.relativedelta import relativedelta
+from plotly.io.json import to_json_plotly
+
+from benchmarks.synthetic_data import write_csv
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+# generated csv files and their snapshots are kept between runs
+DATA_DIR = os.environ.get('BENCHMARK_DATA_DIR', 'benchmark_data')
+
+
+def rss_mb():
+    ''' resident memory of the process, None where /proc is not available '''
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+class RssSampler(threading.Thread):
+    ''' samples the resident memory while a call runs, to see native allocations
+     (csv parser, arrow) that tracemalloc does not trace '''
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss = self.peak_rss = rss_mb()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, rss_mb())
+
+    def stop(self):
+        ''' growth of the resident memory since the sampler was created, in MB '''
+        self.done.set()
+        self.join()
+        self.peak_rss = max(self.peak_rss, rss_mb())
+        return self.peak_rss - self.start_rss
+
+
+def measure(func, repeat, serialize=True, trace=True):
+    ''' wall times of repeat calls, their resident memory growth, the peak memory traced by
+     tracemalloc during one more call when trace is set and the json size of the output
+     when serialize is set. Loading stages are not traced, tracemalloc keeps a traceback
+     of every string parsed from the csv '''
+    times = []
+    sampler = RssSampler() if rss_mb() is not None else None
+    if sampler:
+        sampler.start()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        times.append(time.perf_counter() - start)
+    rss_growth = sampler.stop() if sampler else None
+    peak = None
+    if trace:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return {'wall_median_s': statistics.median(times),
+            'wall_min_s': min(times),
+            'peak_memory_mb': peak,
+            'rss_growth_mb': rss_growth,
+            'json_bytes': len(to_json_plotly(output)) if serialize else None}
+
+
+def cases(data):
+    ''' callback inputs of the benchmarked filter combinations '''
+    first_day = f"{data.first_day:%Y-%m-%d}"
+    last_day = f"{data.last_day:%Y-%m-%d}"
+    six_months = f"{data.last_day - relativedelta(months=6):%Y-%m-%d}"
+    return {'all': ([], [], first_day, last_day),
+            'filtered': (['Senior', 'Lead'], ['type_ds', 'type_de'], six_months, last_day)}
+
+
+def targets(data, job_types, all_types, start_date, end_date):
+    ''' benchmarked functions by name, called without arguments '''
+    # pages are imported after the app is created, see main
+    from pages import home, compare
+    from pages.functions import generate_charts as gen_charts
+    from pages.functions.selection import Selection, SelectionCache
+
+    def chart(func, **kwargs):
+        return lambda: func(Selection(job_types, all_types, start_date, end_date, data), **kwargs)
+
+    funcs = {}
+    for name, func in inspect.getmembers(gen_charts, inspect.isfunction):
+        if name.startswith('generate_') and list(inspect.signature(func).parameters)[:1] == ['sel']:
+            funcs[name] = chart(func)
+
+    def comparison_chart(func, recent, **kwargs):
+        def call():
+            periods = compare.compare_periods(
+                Selection(job_types, all_types, start_date, end_date, data), 6)
+            return func(periods['all'], periods[recent], **kwargs)
+        return call
+
+    funcs['compare_periods'] = lambda: compare.compare_periods(
+        Selection(job_types, all_types, start_date, end_date, data), 6)['all'].all('rows')
+    funcs['bar_chart_skills'] = comparison_chart(compare.bar_chart_skills, 'recent_unique')
+    for agg_column in compare.COMPARE_COLUMNS:
+        remove_nonunique = agg_column != 'district'
+        funcs[f"bar_chart_compare[{agg_column}]"] = comparison_chart(
+            compare.bar_chart_compare, 'recent_unique' if remove_nonunique else 'recent',
+            title=agg_column, agg_column=agg_column, remove_nonunique=remove_nonunique)
+
+    def home_callbacks(*names):
+        # callbacks one after another, sharing a new selection like a page update
+        home.selections = SelectionCache()
+        return [inspect.unwrap(home.chart_callbacks[name])(job_types, all_types,
+                                                           start_date, end_date,
+                                                           *home.chart_defaults[name])
+                for name in names]
+
+    for name in home.chart_callbacks:
+        funcs[f"home.{name}"] = functools.partial(home_callbacks, name)
+    funcs['home.all_callbacks'] = functools.partial(home_callbacks, *home.chart_callbacks)
+    funcs['compare.filter_df'] = lambda: inspect.unwrap(compare.filter_df)(
+        job_types, all_types, start_date, end_date, 6)
+    return funcs
+
+
+def encodings(job_types, all_types, start_date, end_date):
+    ''' functions returning the home callback outputs encoded as they are sent, by name.
+     Outputs used to be encoded from the figures, they are now decoded from the figure
+     cache and sent as patches. cache_hit is the whole hit path of the callbacks: cache
+     lookup, decoding, patches and the encoding of the response by Dash '''
+    from pages import home
+    from pages.functions import compression
+    from pages.functions.figure_cache import loads
+    from pages.functions.figure_patch import figure_patch, is_figure, patch_figures
+
+    args = {name: (job_types, all_types, start_date, end_date, *home.chart_defaults[name])
+            for name in home.chart_callbacks}
+    outputs = [output for name, callback in home.chart_callbacks.items()
+               for output in inspect.unwrap(callback)(*args[name])]
+    cached = to_json_plotly(outputs)
+
+    def patches():
+        return to_json_plotly([figure_patch(output) if is_figure(output) else output
+                               for output in loads(cached)])
+
+    callbacks = {name: patch_figures(callback) for name, callback in home.chart_callbacks.items()}
+
+    def cache_hit():
+        return to_json_plotly([output for name, callback in callbacks.items()
+                               for output in callback(*args[name])])
+    # the first call stores the outputs in the figure caches
+    cache_hit()
+
+    funcs = {'home.encode[figures,json]': lambda: to_json_plotly(outputs, engine='json'),
+             'home.encode[figures]': lambda: to_json_plotly(outputs),
+             'home.encode[patches]': patches,
+             'home.cache_hit': cache_hit,
+             'home.encode[patches,gzip]': lambda: compression.compress(patches().encode(), 'gzip')}
+    if compression.brotli is not None:
+        funcs['home.encode[patches,br]'] = lambda: compression.compress(patches().encode(), 'br')
+    return funcs
+
+
+def import_records(repeat):
+    ''' seconds to import the app in new interpreters, and the part of it spent creating
+     the app, which imports the pages '''
+    code = ("import time; start = time.perf_counter(); import dash_app; "
+            "print(time.perf_counter() - start, dash_app.pages_import_seconds)")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = [[float(value) for value in subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=root,
+        env=dict(os.environ, FIGURE_WARMUP='0')).stdout.split()] for _ in range(repeat)]
+    records = []
+    for name, values in [('import dash_app', [app for app, _ in times]),
+                         ('create app with pages', [pages for _, pages in times])]:
+        records.append({'rows': 0, 'case': 'import', 'function': name,
+                        'wall_median_s': statistics.median(values), 'wall_min_s': min(values),
+                        'peak_memory_mb': None, 'rss_growth_mb': None, 'json_bytes': None})
+        print(f"{0:>9,d} {'import':<9} {name:<36} {records[-1]['wall_median_s']*1000:10.1f} ms")
+    return records
+
+
+def run_size(n_rows, repeat, seed):
+    ''' records of the loading stages and of every function for one dataset size '''
+    from pages.functions import dataset, warmup
+    from pages.functions.figure_cache import clear_caches
+    from pages.functions.load_data import load_dataset
+
+    csv_path = write_csv(n_rows, DATA_DIR, seed)
+    snapshot_dir = os.path.join(os.path.dirname(csv_path), 'snapshots')
+    records = []
+
+    def record(case, name, result):
+        records.append({'rows': n_rows, 'case': case, 'function': name, **result})
+        memory = result['peak_memory_mb'] if result['peak_memory_mb'] is not None \
+            else result['rss_growth_mb'] or 0
+        print(f"{n_rows:>9,d} {case:<9} {name:<36} {result['wall_median_s']*1000:10.1f} ms"
+              f" {memory:9.1f} MB")
+
+    def load_csv():
+        for name in os.listdir(snapshot_dir) if os.path.isdir(snapshot_dir) else []:
+            # partitions, shared datasets and background results are folders
+            path = os.path.join(snapshot_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        return load_dataset(csv_path, snapshot_dir, shared=False)
+
+    record('load', 'load_dataset[csv]', measure(load_csv, 1, serialize=False, trace=False))
+    record('load', 'load_dataset[snapshot]', measure(
+        lambda: load_dataset(csv_path, snapshot_dir, shared=False), repeat, serialize=False, trace=False))
+    df = load_dataset(csv_path, snapshot_dir)
+    record('load', 'Dataset', measure(lambda: dataset.Dataset(df), repeat, serialize=False,
+                                     trace=False))
+
+    data = dataset.Dataset(df)
+    dataset.swap(data)
+
+    def warm_up(compute):
+        clear_caches()
+        if compute and os.path.exists(warmup.figures_path(data.version, snapshot_dir)):
+            os.remove(warmup.figures_path(data.version, snapshot_dir))
+        warmup.warm_up(data, snapshot_dir)
+    record('load', 'warm_up[compute]', measure(lambda: warm_up(True), 1, serialize=False,
+                                               trace=False))
+    record('load', 'warm_up[load]', measure(lambda: warm_up(False), repeat, serialize=False,
+                                            trace=False))
+    clear_caches()
+    for case, values in cases(data).items():
+        for name, func in targets(data, *values).items():
+            record(case, name, measure(func, repeat))
+        # json_bytes is the size of the response body
+        for name, func in encodings(*values).items():
+            record(case, name, {**measure(func, repeat, serialize=False, trace=False),
+                                'json_bytes': len(func())})
+    return records
+
+
+def git_commit():
+    ''' commit of the benchmarked code, None outside of a git checkout '''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file, by default a new file in benchmarks/results')
+    args = parser.parse_args(argv)
+
+    # the app registers the pages, which are imported by targets,
+    # figures are warmed up by run_size and not in the background
+    os.environ.setdefault('FIGURE_WARMUP', '0')
+    import dash_app  # pylint: disable=import-outside-toplevel,unused-import
+
+    started = datetime.now()
+    records = import_records(args.repeat)
+    for n_rows in args.rows:
+        records.extend(run_size(n_rows, args.repeat, args.seed))
+
+    from pages.functions.query_backend import QUERY_BACKEND
+
+    commit = git_commit()
+    results = {'created': started.isoformat(timespec='seconds'),
+               'git_commit': commit,
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'pandas': pd.__version__,
+               'plotly': plotly.__version__,
+               'platform': platform.platform(),
+               'cpu_count': os.cpu_count(),
+               'query_backend': QUERY_BACKEND,
+               'repeat': args.repeat,
+               'seed': args.seed,
+               'records': records}
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{started:%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as results_file:
+        json.dump(results, results_file, indent=1)
+    print(f"results saved to {output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+""" Synthetic vacancies with the schema of the scraped csv, see load_data.py """
+import os
+
+import numpy as np
+import pandas as pd
+
+from pages.functions.load_data import TYPE_COLUMNS
+
+FIRST_DAY = '2024-01-11'
+LAST_DAY = '2025-08-20'
+
+JOB_TYPES = ['Student', 'Junior', 'Mid-level', 'Senior', 'Lead']
+DISTRICTS = ['Tel Aviv', 'Central', 'Haifa', 'Jerusalem', 'Southern', 'Northern', 'Sharon']
+CLOUD_SKILLS = ['AWS', 'GCP', 'Azure', 'Multiple', 'No Cloud']
+VIZ_TOOLS = ['Tableau', 'MS Power BI', 'Looker', 'Multiple', 'No Viz Tools']
+LANGUAGES = ['English', 'Hebrew', 'English, Hebrew']
+EDUCATION = ['B.Sc.', 'M.Sc.', 'B.Sc., M.Sc.', 'Ph.D.', 'M.Sc., Ph.D.', 'MBA',
+             'No Degree Requirements']
+# skill columns, named like the ones of the scraped csv
+SKILLS = ['A/B Testing', 'AI', 'AWS', 'Apache Airflow', 'Apache Kafka', 'Apache Spark',
+          'Apache Hadoop', 'Azure', 'Big Data', 'Cloud', 'CI/CD', 'Computer Vision',
+          'Cybersecurity', 'Data Pipelines', 'Data Modeling', 'Data WareHousing',
+          'Data Visualization', 'Deep Learning', 'Docker', 'ETL', 'Financial Analysis', 'GCP',
+          'Generative AI', 'Kubernetes', 'Looker', 'Large Language Models', 'MS Excel',
+          'MS Power BI', 'Natural Language Processing', 'NoSQL', 'Machine Learning', 'Pandas',
+          'PyTorch', 'Snowflake', 'Software Engineering', 'SQL', 'Tableau', 'TensorFlow',
+          'Programing Language', 'Python', 'Java', 'Scala', 'R']
+# share of rows that repeat an earlier vacancy (same url, not a unique text)
+REPOST_SHARE = 0.05
+
+
+def skewed_choice(rng, values, n_rows, missing=0.0):
+    ''' values drawn with decreasing probabilities, some of them missing '''
+    weights = 1 / np.arange(1, len(values) + 1)
+    picked = rng.choice(np.array(values, dtype=object), n_rows, p=weights / weights.sum())
+    picked[rng.random(n_rows) < missing] = None
+    return picked
+
+
+def generate_dataset(n_rows, seed=0):
+    ''' dataframe with the columns of the scraped csv, dates as iso strings '''
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(FIRST_DAY, LAST_DAY, freq='D').to_numpy()
+    # more vacancies are scraped in recent months
+    first_online = np.sort(rng.choice(days, n_rows, p=np.linspace(1, 2, len(days))
+                                      / np.linspace(1, 2, len(days)).sum()))
+    last_online = first_online + rng.integers(0, 60, n_rows).astype('timedelta64[D]')
+
+    urls = np.array([f"https://il.indeed.com/viewjob?jk={i:016x}" for i in range(n_rows)],
+                    dtype=object)
+    reposts = np.flatnonzero(rng.random(n_rows) < REPOST_SHARE)
+    reposts = reposts[reposts > 0]
+    urls[reposts] = urls[rng.integers(0, reposts)]
+    is_unique_text = (rng.random(n_rows) < 0.9).astype('int8')
+    is_unique_text[reposts] = 0
+
+    df = pd.DataFrame({
+        'url': urls,
+        'first_online': pd.DatetimeIndex(first_online).strftime('%Y-%m-%d'),
+        'last_online': pd.DatetimeIndex(last_online).strftime('%Y-%m-%d'),
+        'job_type': skewed_choice(rng, JOB_TYPES[2:] + JOB_TYPES[:2], n_rows),
+        'district': skewed_choice(rng, DISTRICTS, n_rows, missing=0.05),
+        'company': skewed_choice(rng, [f"Company {i}" for i in range(max(n_rows // 50, 10))],
+                                 n_rows),
+        'is_direct': (rng.random(n_rows) < 0.3).astype('int8'),
+        'is_unique_text': is_unique_text,
+        'cloud_skills': skewed_choice(rng, CLOUD_SKILLS, n_rows),
+        'viz_tools': skewed_choice(rng, VIZ_TOOLS, n_rows),
+        'languages': skewed_choice(rng, LANGUAGES, n_rows, missing=0.3),
+        'education': skewed_choice(rng, EDUCATION, n_rows, missing=0.2),
+        'min_experience': np.where(rng.random(n_rows) < 0.2, np.nan,
+                                   rng.integers(0, 10, n_rows)),
+    })
+    for col in TYPE_COLUMNS:
+        df[col] = (rng.random(n_rows) < 0.3).astype('int8')
+    # 0 - not mentioned, 1 - advantage, 2 - mandatory, popular skills are mentioned more often
+    mention_rates = rng.uniform(0.02, 0.6, len(SKILLS))
+    for col, rate in zip(SKILLS, mention_rates):
+        mentioned = rng.random(n_rows) < rate
+        df[col] = np.where(mentioned, rng.integers(1, 3, n_rows), 0).astype('int8')
+    return df
+
+
+def write_csv(n_rows, folder, seed=0):
+    ''' writes the dataset as to_analysis_indeed.csv in its own folder, reusing an existing one '''
+    path = os.path.join(folder, f"rows-{n_rows}-seed-{seed}", 'to_analysis_indeed.csv')
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        generate_dataset(n_rows, seed).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return path
@@ -1,20 +1,65 @@
 """ Dash app definition, including header navigation bar """
+import logging
+import time
+
 import dash
 import dash_bootstrap_components as dbc
 import dash_bootstrap_templates
+import flask
+
+from pages.functions import compression, dataset, metrics, warmup
+from pages.functions.figure_cache import cache_stats, clear_caches
+
+# Loading timings and other diagnostics are logged
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # Define templates
 DBC_CSS = "https://cdn.jsdelivr.net/gh/AnnMarieW/dash-bootstrap-templates/dbc.min.css"
 dash_bootstrap_templates.load_figure_template('sandstone')
 
-# Dash app definition
+# Dash app definition, it imports the pages: keep their import cheap, it delays every worker boot
+start = time.perf_counter()
 app = dash.Dash(
     __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}],
     external_stylesheets=[dbc.themes.SANDSTONE, dbc.icons.FONT_AWESOME, DBC_CSS],
     use_pages=True
 )
+pages_import_seconds = time.perf_counter() - start
+logger.info("app created with its pages in %.3fs", pages_import_seconds)
 app.title = "Data Jobs in Israel 2024-2025"
 server = app.server
+# responses are compressed and static bundles cached by the browser, see compression.py
+compression.init_app(server)
+
+
+@server.route('/cache-stats')
+def figure_cache_stats():
+    ''' hit and miss counters of the figure caches '''
+    return flask.jsonify(cache_stats())
+
+
+@server.route('/metrics')
+def prometheus_metrics():
+    ''' callback, stage and chart histograms in the prometheus text format '''
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@server.route('/reload-dataset', methods=['POST'])
+def reload_dataset():
+    ''' loads a new csv version in the background, pages switch to it once it is built '''
+    started = dataset.reload_in_background()
+    return flask.jsonify({'version': dataset.current().version, 'reload_started': started}), 202
+
+
+# figures of the previous dataset version are dropped after a reload,
+# the csv is checked every DATA_RELOAD_INTERVAL seconds when it is set
+dataset.on_swap(clear_caches)
+dataset.start_watcher()
+# the default and preset figures of every version are read from disk or computed in
+# the background, starting with the dataset loaded now rather than on the first request
+dataset.on_swap(warmup.warm_up_in_background)
+warmup.warm_up_in_background()
 
 
 # Layout of Dash App
@@ -1,50 +1,73 @@
 """ This is the "comparisons" page of the dash application """
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from plotly import graph_objs as go
-import pandas as pd
 import dash_bootstrap_components as dbc
 
-from pages.functions.common_elements import df, important_skills, create_ban_card
-from pages.functions.common_elements import job_type_compare, data_professions_compare, time_period_compare
+from pages.functions.common_elements import create_ban_card, select_job_type
+from pages.functions.common_elements import select_data_professions, select_time_period
+from pages.functions.common_elements import time_period_options_compare
+from pages.functions.common_elements import preset_dates
+from pages.functions.cube import top_counts
+from pages.functions.dataset import current
+from pages.functions import background, metrics, warmup
+from pages.functions.figure_cache import FigureCache
+from pages.functions.figure_patch import patch_figures
+from pages.functions.selection import Selection
 
 # Define dash app page
 dash.register_page(__name__, path='/compare', title='Data Jobs in Israel 2024-2025')
+figure_cache = FigureCache('compare')
+comparison_period_options = [{'label':'Three months', 'value': 3},
+                             {'label':'Six months', 'value': 6}]
+# outputs of filter_df
+OUTPUTS = [("total-vacancies-comp", "children"), ("vacancies-compared", "children"),
+           ("vacancies-per-week", "children"), ("vacancies-per-week-compared", "children"),
+           ("bar-chart-comp", "figure"), ("cloud-comp", "figure"), ("viz-comp", "figure"),
+           ("districts-comp", "figure"), ("seniority-comp", "figure")]
 
-def bar_chart_skills(df_sel,
+# categorical columns compared between all and recent vacancies
+COMPARE_COLUMNS = ['cloud_skills', 'viz_tools', 'district', 'job_type']
+# cube measures used by the page, the others are not summed
+COMPARE_MEASURES = ['rows', 'skill_advantage', 'skill_mandatory'] + \
+    [f"rows_{column}" for column in COMPARE_COLUMNS]
+# vacancies published before this day are not counted in the averages per week
+ALL_EARLIEST = datetime.strptime('10-01-2024', '%d-%m-%Y').date()
+
+
+def compare_periods(sel, comparison_period, **first_days):
+    """ summaries of all selected vacancies ('all') and of the recent ones, aggregated
+     in one pass over the cube. Recent vacancies are those of the last comparison_period
+     months before the latest one, among all vacancies ('recent') or among those with a
+     unique text ('recent_unique'). Summaries since other first_days are returned by
+     their keyword """
+    first_days = {
+        'all': sel.start_day,
+        'recent': sel.last_day() - relativedelta(months=comparison_period),
+        'recent_unique': sel.last_day(unique_only=True) - relativedelta(months=comparison_period),
+        **first_days}
+    return dict(zip(first_days, sel.periods(list(first_days.values()), COMPARE_MEASURES)))
+
+
+@metrics.instrument_chart
+def bar_chart_skills(summary, recent,
                      text_all='All Vacancies',
-                     text_recent='Recent Vacancies',
-                     time_period=6):
+                     text_recent='Recent Vacancies'):
     """ bar chart to compare top 15 most commonly mentioned skills
      between different time periods """
-    def get_top_skills(df_sel_filtered):
-        skill_count = []
-        for skill in important_skills:
-            if skill in df_sel:
-                total_skills = len(df_sel_filtered.loc[df_sel_filtered[skill] > 0])
-                skill_count.append([skill, total_skills])
-            else:
-                print(skill + '!!!')
-
-        df_skill = pd.DataFrame(skill_count, columns=['skill', 'count'])
+    def get_top_skills(skills_all):
+        df_skill = skills_all['any'].rename('count').reset_index()
         df_skill = df_skill.sort_values('count')[-15:]
         return list(df_skill['skill'])
 
-    def generate_bar(df_to_agg, top_skills, legend):
-        skill_count = []
-        for skill in top_skills:
-            if skill in df_to_agg:
-                total_skills = len(df_to_agg.loc[df_to_agg[skill] > 0])
-                skill_count.append([skill, total_skills])
-            else:
-                print(skill + '!!!')
-
-        df_skill = pd.DataFrame(skill_count, columns=['skill', 'count'])
-        df_skill['percent'] = 100*df_skill['count'] / len(df_to_agg)
+    def generate_bar(summary, top_skills, legend):
+        skills = summary.skills().loc[top_skills, 'any']
+        df_skill = skills.rename('count').reset_index()
+        df_skill['percent'] = 100*df_skill['count'] / summary.unique('rows')
         g_bar = go.Bar(
             x=df_skill['percent'],
             y=df_skill['skill'] ,
@@ -59,23 +82,21 @@ def bar_chart_skills(df_sel,
         return g_bar
 
 
-    df_sel_filtered = df_sel.loc[df_sel['is_unique_text'] > 0].copy()
-    top_skills = get_top_skills(df_sel_filtered)
-    last_include = df_sel_filtered['first_online'].max() - relativedelta(months=time_period)
+    top_skills = get_top_skills(summary.skills())
     fig = go.Figure()
-    fig.add_trace(generate_bar(df_sel_filtered, top_skills, text_all))
-    fig.add_trace(generate_bar(df_sel_filtered.loc[df_sel_filtered['first_online'] >= last_include],
-                               top_skills, text_recent))
+    fig.add_trace(generate_bar(summary, top_skills, text_all))
+    fig.add_trace(generate_bar(recent, top_skills, text_recent))
     fig.update_layout(title="Top 15 Skills - Comparison")
     return fig
 
 
-def bar_chart_compare(df_sel, title, agg_column,
-                      remove_nonunique=True,
-                      time_period=6):
+@metrics.instrument_chart(detail='agg_column')
+def bar_chart_compare(summary, recent, title, agg_column,
+                      remove_nonunique=True):
     """ function used to visualize multiple comparisons between different time periods """
-    def generate_bar(df_to_agg, legend, agg_column):
-        df_to_agg = pd.DataFrame(df_to_agg[agg_column].value_counts()).reset_index()
+    def generate_bar(summary, legend, agg_column):
+        df_to_agg = top_counts(summary.counts(agg_column, unique_only=remove_nonunique))
+        df_to_agg = df_to_agg.reset_index()
         total_val = df_to_agg['count'].sum()
         df_to_agg['percent'] = 100*df_to_agg['count'] / total_val
         g_bar = go.Bar(
@@ -89,171 +110,167 @@ def bar_chart_compare(df_sel, title, agg_column,
             )
         return g_bar
 
-    if remove_nonunique:
-        df_sel_filtered = df_sel.loc[df_sel['is_unique_text'] > 0].copy()
-    else:
-        df_sel_filtered = df_sel.copy()
-    last_include = df_sel_filtered['first_online'].max() - relativedelta(months=time_period)
     fig = go.Figure()
-    fig.add_trace(generate_bar(df_sel_filtered, 'All Vacancies', agg_column))
-    fig.add_trace(generate_bar(df_sel_filtered.loc[df_sel_filtered['first_online'] >= last_include],
-                               'Recent Vacancies', agg_column))
+    fig.add_trace(generate_bar(summary, 'All Vacancies', agg_column))
+    fig.add_trace(generate_bar(recent, 'Recent Vacancies', agg_column))
     fig.update_layout(title=title)
     return fig
 
 
-layout = dbc.Row(
-    children = [
-        # Column for user controls
-        dbc.Col(html.Div(
-            children=[
-                html.Div([
-                    # user controls similar to those used on main page
-                    job_type_compare,
-                    data_professions_compare,
+def layout(**_):
+    """ page layout, built for every page load from the current dataset version """
+    data = current()
+    # outputs for all vacancies, the callback updates these figures with patches
+    figures = dict(zip([component_id for component_id, _ in OUTPUTS],
+                       filter_df([], [], str(data.first_day.date()), str(data.last_day.date()),
+                                 6)))
+    return dbc.Row(
+        children = [
+            # Column for user controls
+            dbc.Col(html.Div(
+                children=[
+                    html.Div([
+                        # user controls similar to those used on main page
+                        select_job_type("job-type-comp"),
+                        select_data_professions("all-types-comp"),
+                        html.Br(),
+                        select_time_period("time-period-all-radio", "time-period-all",
+                                           time_period_options_compare)
+                    ]),
+                    html.Br(),
+                    # select comparison period
+                    html.Div([
+                        dbc.Label("Select Comparison Period", html_for="comparison-period"),
+                        dbc.RadioItems(
+                            id="comparison-period",
+                            options=comparison_period_options,
+                            value=6,
+                        ),
+                    ]),
                     html.Br(),
-                    time_period_compare
+                    # print some stats
+                    html.P(f"Last Update: {data.last_day:%d %b %Y}"),
+                    html.P(f"Total Vacancies: {data.n_rows:,d}"),
+                    html.P(id='exp-text')
+                ], style={"padding-left" : "4px"},
+            ), style = {"position": "fixed", "background-color": "#f8f9fa",
+                        "top": "4rem", "bottom":0, "width":"20rem"}
+            ),
+            # Column for app graphs and plots
+            dbc.Col([
+                dbc.Row([
+                    create_ban_card("Vacancies Selected: ", "total-vacancies-comp"),
+                    create_ban_card("Recent Vacancies: ", "vacancies-compared"),
+                    create_ban_card("Av per week: ", "vacancies-per-week"),
+                    create_ban_card("Av per week recent: ", "vacancies-per-week-compared")
+                ], style = {"text-align": "center"}),
+                dbc.Row([dbc.Col([
+                    dcc.Graph(id="bar-chart-comp", figure=figures["bar-chart-comp"])
+                    ], width=11)
                 ]),
-                html.Br(),
-                # select comparison period
-                html.Div([
-                    dbc.Label("Select Comparison Period", html_for="comparison-period"),
-                    dbc.RadioItems(
-                        id="comparison-period",
-                        options=[{'label':'Three months', 'value': 3},
-                                 {'label':'Six months', 'value': 6}],
-                        value=6,
-                    ),
+                dbc.Row([dbc.Col([
+                        dcc.Graph(id="cloud-comp", figure=figures["cloud-comp"])
+                    ], width=6),
+                    dbc.Col([
+                        dcc.Graph(id="viz-comp", figure=figures["viz-comp"])
+                    ], width=6),
                 ]),
-                html.Br(),
-                # print some stats
-                html.P(f"Last Update: {df['first_online'].max():%d %b %Y}"),
-                html.P(f"Total Vacancies: {len(df):,d}"),
-                html.P(id='exp-text')
-            ], style={"padding-left" : "4px"},
-        ), style = {"position": "fixed", "background-color": "#f8f9fa",
-                    "top": "4rem", "bottom":0, "width":"20rem"}
-        ),
-        # Column for app graphs and plots
-        dbc.Col([
-            dbc.Row([
-                create_ban_card("Vacancies Selected: ", "total-vacancies-comp"),
-                create_ban_card("Recent Vacancies: ", "vacancies-compared"),
-                create_ban_card("Av per week: ", "vacancies-per-week"),
-                create_ban_card("Av per week recent: ", "vacancies-per-week-compared")
-            ], style = {"text-align": "center"}),
-            dbc.Row([dbc.Col([
-                dcc.Graph(id="bar-chart-comp")
-                ], width=11)
-            ]),
-            dbc.Row([dbc.Col([
-                    dcc.Graph(id="cloud-comp")
-                ], width=6),
-                dbc.Col([
-                    dcc.Graph(id="viz-comp")
-                ], width=6),
-            ]),
-            dbc.Row([
-                dbc.Col([
-                    dcc.Graph(id="districts-comp")
-                ], width=6),
-                dbc.Col([
-                    dcc.Graph(id="seniority-comp")
-                ], width=6),
-            ])
-        ], style = {"margin-left": "21rem"}),
-    ], className='dbc'
-)
+                dbc.Row([
+                    dbc.Col([
+                        dcc.Graph(id="districts-comp", figure=figures["districts-comp"])
+                    ], width=6),
+                    dbc.Col([
+                        dcc.Graph(id="seniority-comp", figure=figures["seniority-comp"])
+                    ], width=6),
+                ])
+            ], style = {"margin-left": "21rem"}),
+        ], className='dbc'
+    )
 
-@dash.callback(
+# presets are turned into dates in the browser, without a request to the server
+dash.clientside_callback(
+    ClientsideFunction(namespace='time_period', function_name='preset_dates'),
     Output("time-period-all", "start_date"),
     Output("time-period-all", "end_date"),
     Output("time-period-all", "disabled"),
     [
         Input("time-period-all-radio", "value"),
     ],
+    State("time-period-all-bounds", "data"),
 )
-def filter_df_radio(radio_value):
-    """ updates datepicker based on selected radiobutton """
-    if radio_value > 0:
-        last_include = df['first_online'].max() - relativedelta(months=radio_value)
-        return last_include.date(), df['first_online'].max().date(), True
-    if radio_value == 0:
-        return df['first_online'].min().date(), df['first_online'].max().date(), True
-    return df['first_online'].min().date(), df['first_online'].max().date(), False
-
-
-@dash.callback(
-    Output("total-vacancies-comp", "children"),
-    Output("vacancies-compared", "children"),
-    Output("vacancies-per-week", "children"),
-    Output("vacancies-per-week-compared", "children"),
-    Output("bar-chart-comp", "figure"),
-    Output("cloud-comp", "figure"),
-    Output("viz-comp", "figure"),
-    Output("districts-comp", "figure"),
-    Output("seniority-comp", "figure"),
-    [
-        Input("job-type-comp", "value"),
-        Input("all-types-comp", "value"),
-        Input("time-period-all", "start_date"),
-        Input("time-period-all", "end_date"),
-        Input("comparison-period", "value")
-    ],
-)
+
+
+@figure_cache.memoize(lambda: current().version)
 def filter_df(job_type, all_types, start_date, end_date, comparison_period):
     """ 1. filters main dataframe depending on user control values
         2. generates visualisations using filtered dataframe """
 
 
-    df_selected = df.copy()
-
-    # filter by seniority level
-    if len(job_type)  > 0:
-        df_selected = df_selected.loc[df_selected['job_type'].isin(job_type)]
-
-    # filter by profession
-    if len(all_types) > 0:
-        df_selected['total'] = df_selected[all_types].sum(axis=1)
-        df_selected = df_selected.loc[df_selected['total'] > 0]
-
-    # filter by publication date
-    start_date = date.fromisoformat(start_date)
-    end_date = date.fromisoformat(end_date)
-    df_selected = df_selected.loc[(df_selected['first_online'].dt.date >= start_date)
-                                  & (df_selected['first_online'].dt.date <= end_date)]
+    sel = Selection(job_type, all_types, start_date, end_date, current())
+    start_date = date.fromisoformat(start_date[:10])
 
     # format dates for comparison period
-    comparison_earliest = df_selected['first_online'].max() - relativedelta(months=comparison_period)
-    all_earliest = max(start_date,
-                       datetime.strptime('10-01-2024', '%d-%m-%Y').date())
-    days_diff_all = df_selected['first_online'].dt.date.max() - all_earliest
+    last_day = sel.last_day()
+    comparison_earliest = last_day - relativedelta(months=comparison_period)
+    all_earliest = max(start_date, ALL_EARLIEST)
+    days_diff_all = last_day.date() - all_earliest
     days_diff_all = days_diff_all.days
 
-    days_diff_recent = df_selected['first_online'].max() - comparison_earliest
+    days_diff_recent = last_day - comparison_earliest
     days_diff_recent = days_diff_recent.days
-    count_without_old = len(df_selected.loc[df_selected['first_online'].dt.date > all_earliest])
-    count_recent = len(df_selected.loc[df_selected['first_online'] >= comparison_earliest])
+
+    # all BANs and figures come from one aggregation of the selection
+    periods = compare_periods(sel, comparison_period,
+                              without_old=all_earliest + timedelta(days=1))
+    count_without_old = periods['without_old'].all('rows')
+    count_recent = periods['recent'].all('rows')
 
     # strings for BANs
-    selected_jobs_string = f"{len(df_selected):,d}"
-    compared_jobs_string = f"{len(df_selected.loc[df_selected['first_online'] >= comparison_earliest]):,d}"
+    selected_jobs_string = f"{periods['all'].all('rows'):,d}"
+    compared_jobs_string = f"{count_recent:,d}"
     per_week = f"{7*count_without_old/days_diff_all:.2f}"
     per_week_compared = f"{7*count_recent/days_diff_recent:.2f}"
     #per_week_compared = "{:.2f}".format(7*count_recent/days_diff_recent)
 
     # plotly visualisations
-    fig_bar = bar_chart_skills(df_selected, time_period=comparison_period)
-    fig_cloud = bar_chart_compare(df_selected, time_period=comparison_period,
+    summary, recent_unique = periods['all'], periods['recent_unique']
+    fig_bar = bar_chart_skills(summary, recent_unique)
+    fig_cloud = bar_chart_compare(summary, recent_unique,
                                 title='Cloud Skills - Comparison', agg_column='cloud_skills')
-    fig_viz = bar_chart_compare(df_selected, time_period=comparison_period,
+    fig_viz = bar_chart_compare(summary, recent_unique,
                                 title='Visualization Skills - Comparison',
                                 agg_column='viz_tools')
-    fig_distr = bar_chart_compare(df_selected, time_period=comparison_period,
+    fig_distr = bar_chart_compare(summary, periods['recent'],
                                   title='Districts - Comparison',
                                   agg_column='district', remove_nonunique=False)
-    fig_sen = bar_chart_compare(df_selected, time_period=comparison_period,
+    fig_sen = bar_chart_compare(summary, recent_unique,
                                 title='Seniority levels - Comparison',
                                 agg_column='job_type')
     return selected_jobs_string, compared_jobs_string, per_week, per_week_compared,\
         fig_bar, fig_cloud, fig_viz, fig_distr, fig_sen
+
+
+# the browser gets patches of the full figures cached and shown in the layout
+dash.callback(
+    [Output(component_id, prop) for component_id, prop in OUTPUTS],
+    [
+        Input("job-type-comp", "value"),
+        Input("all-types-comp", "value"),
+        Input("time-period-all", "start_date"),
+        Input("time-period-all", "end_date"),
+        Input("comparison-period", "value")
+    ],
+    **background.callback_options('compare'),
+)(metrics.instrument_callback('compare', [component_id for component_id, _ in OUTPUTS])(
+    patch_figures(filter_df)))
+
+
+def preset_inputs(data):
+    """ filter values of every time period and comparison period radiobutton
+     without other filters, see warmup.py """
+    return [([], [], start_date, end_date, option['value'])
+            for start_date, end_date in preset_dates(time_period_options_compare, data)
+            for option in comparison_period_options]
+
+
+warmup.register(filter_df, preset_inputs)
@@ -0,0 +1,110 @@
+""" Background chart callbacks with their results stored on disk.
+
+With BACKGROUND_CALLBACKS=1 the chart callbacks of the pages are Dash background
+callbacks: a request starts a job in a process forked from the worker and the browser
+polls for its result every BACKGROUND_POLL_MS. A job is terminated when the browser
+sends newer inputs for the same callback, so stale filter values do not hold the
+workers, and when the user leaves the page. Results are stored in a diskcache folder
+(BACKGROUND_CACHE_DIR, by default in the snapshot folder) shared by all workers and
+keyed by the dataset version, so a filter combination is computed once by any of them.
+Uses the diskcache, multiprocess and psutil packages of requirements.txt, without
+Redis or Celery. """
+import contextlib
+import os
+import threading
+
+from dash import DiskcacheManager
+from dash.dependencies import Input
+
+from pages.functions.dataset import current
+from pages.functions.load_data import SNAPSHOT_DIR
+
+BACKGROUND_CALLBACKS = os.environ.get('BACKGROUND_CALLBACKS', '0') not in ('', '0', 'false')
+BACKGROUND_CACHE_DIR = os.environ.get('BACKGROUND_CACHE_DIR',
+                                      os.path.join(SNAPSHOT_DIR, 'callbacks'))
+# the first poll comes after this delay, results of the figure cache are ready by then
+BACKGROUND_POLL_MS = int(os.environ.get('BACKGROUND_POLL_MS', 200))
+# stored results not read for this long are removed, older dataset versions included
+BACKGROUND_EXPIRE_SECONDS = int(os.environ.get('BACKGROUND_EXPIRE_SECONDS', 24 * 3600))
+
+# location of dash.page_container, its pathname changes when the user leaves a page
+PAGE_LOCATION = Input('_pages_location', 'pathname')
+
+_results = None
+# held by the threads of a worker using the results cache and while a job is forked
+_jobs_lock = threading.RLock()
+
+
+class JobManager(DiskcacheManager):
+    ''' DiskcacheManager forking its jobs while no other thread of the worker uses the
+     results cache. A process forked while another thread runs an SQLite call inherits
+     the locks of that call and could never store its result, so the worker threads use
+     the results cache one at a time and close their connection when they are done '''
+
+    @contextlib.contextmanager
+    def _using_cache(self):
+        with _jobs_lock:
+            try:
+                yield
+            finally:
+                self.handle.close()
+
+    def call_job_fn(self, key, job_fn, args, context):
+        with _jobs_lock:
+            return super().call_job_fn(key, job_fn, args, context)
+
+    def terminate_job(self, job):
+        import psutil  # pylint: disable=import-outside-toplevel
+
+        # the job may exit between the checks of its process and the kill
+        with self._using_cache(), contextlib.suppress(psutil.NoSuchProcess):
+            super().terminate_job(job)
+
+    def job_running(self, job):
+        import psutil  # pylint: disable=import-outside-toplevel
+
+        with contextlib.suppress(psutil.NoSuchProcess):
+            return super().job_running(job)
+        return False
+
+    def get_progress(self, key):
+        with self._using_cache():
+            return super().get_progress(key)
+
+    def result_ready(self, key):
+        with self._using_cache():
+            return super().result_ready(key)
+
+    def get_result(self, key, job):
+        with self._using_cache():
+            return super().get_result(key, job)
+
+    def get_updated_props(self, key):
+        with self._using_cache():
+            return super().get_updated_props(key)
+
+    def clear_cache_entry(self, key):
+        with self._using_cache():
+            super().clear_cache_entry(key)
+
+
+def results_cache():
+    ''' diskcache of the results of all background callbacks, opened on first use '''
+    global _results
+    if _results is None:
+        import diskcache  # pylint: disable=import-outside-toplevel
+
+        _results = diskcache.Cache(BACKGROUND_CACHE_DIR)
+    return _results
+
+
+def callback_options(name):
+    ''' keyword arguments of dash.callback running a chart callback in the background,
+     none when BACKGROUND_CALLBACKS is off. Results are keyed by the callback name as well,
+     dash keys them by the source of the function and the chart callbacks share theirs '''
+    if not BACKGROUND_CALLBACKS:
+        return {}
+    manager = JobManager(results_cache(), cache_by=[lambda: current().version, lambda: name],
+                         expire=BACKGROUND_EXPIRE_SECONDS)
+    return {'background': True, 'manager': manager, 'interval': BACKGROUND_POLL_MS,
+            'cancel': [PAGE_LOCATION]}
@@ -1,17 +1,9 @@
 """ Functions and elements used in both home.py and compare.py """
-import pandas as pd
+from dateutil.relativedelta import relativedelta
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 
-# load and format the main dataframe
-try:
-    df = pd.read_csv('/home/local/to_analysis.csv')
-except:
-    df = pd.read_csv('to_analysis_indeed.csv')
-
-df['first_online'] = pd.to_datetime(df['first_online'])
-df['last_online'] = pd.to_datetime(df['last_online'])
-df['day_diff'] = (df['last_online'] - df['first_online']).dt.days
+from pages.functions.dataset import current
 
 # options for job types
 all_types_options = [{"label": "Data Science Jobs", "value": "type_ds"},
@@ -20,17 +12,6 @@ all_types_options = [{"label": "Data Science Jobs", "value": "type_ds"},
                      {"label": "BI Jobs", "value": "type_bi"},
                      {"label": "AI/ML Jobs", "value": "type_aiml"},]
 
-# list of important skills that may appear on the list of top 15 most commonly mentioned skills
-important_skills = ['A/B Testing', 'AI', 'AWS', 'Apache Airflow', 'Apache Kafka', 'Apache Spark',
-                    'Apache Hadoop', 'Azure', 'Big Data', 'Cloud', 'CI/CD', 'Computer Vision','Cybersecurity',
-                    'Data Pipelines', 'Data Modeling', 'Data WareHousing',
-                    'Data Visualization', 'Deep Learning', 'Docker',
-                    'ETL', 'Financial Analysis', 'GCP', 'Generative AI', 'Kubernetes', 'Looker',
-                    'Large Language Models', 'MS Excel', 'MS Power BI', 'Natural Language Processing',
-                    'NoSQL', 'Machine Learning', 'Pandas',
-                    'PyTorch', 'Snowflake', 'Software Engineering', 'SQL', 'Tableau', 'TensorFlow',
-                    'Programing Language', 'Python', 'Java', 'Scala', 'R']
-
 # time period options for the compare page
 time_period_options_compare = [{'label': 'All time', 'value': 0},
                                {'label': 'Twelve months', 'value': 12},
@@ -44,7 +25,8 @@ time_period_options = [{'label': 'All time', 'value': 0},
                        {'label': 'Custom', 'value': -1}]
 
 def select_job_type(element_id):
-    ''' dropdown to filter jobs by seniority, used on both home and compare pages '''
+    ''' dropdown to filter jobs by seniority, used on both home and compare pages.
+     Options come from the current dataset, so it is created by the page layouts '''
     job_type_div = html.Div(
         children=[
             html.Br(),
@@ -52,7 +34,7 @@ def select_job_type(element_id):
             dcc.Dropdown(
                 id=element_id,
                 placeholder="Select Seniority Level",
-                options=df['job_type'].unique(),
+                options=current().job_types,
                 value=[],
                 multi=True,
             ),
@@ -60,10 +42,6 @@ def select_job_type(element_id):
     )
     return job_type_div
 
-# dropdown objects be imported to pages
-job_type = select_job_type("job-type")
-job_type_compare = select_job_type("job-type-comp")
-
 def select_data_professions(element_id):
     ''' checkbox list to filter jobs by profession, used on both home and compare pages '''
     data_professions_div = html.Div(
@@ -79,13 +57,10 @@ def select_data_professions(element_id):
     )
     return data_professions_div
 
-# checkbox list objects be imported to pages
-data_professions = select_data_professions("all-types")
-data_professions_compare = select_data_professions("all-types-comp")
-
 def select_time_period(element_id_radio, element_id_datepicker, raio_dict):
     ''' radiobuttons and date picker range to filter jobs by publication date,
      used on both home and compare pages '''
+    data = current()
     time_period_div = html.Div([
         dbc.Label("Select Time Period", html_for=element_id_radio),
         dbc.RadioItems(
@@ -97,21 +72,33 @@ def select_time_period(element_id_radio, element_id_datepicker, raio_dict):
             id=element_id_datepicker,
             month_format='D MMM YYYY',
             display_format='D MMM YYYY',
-            min_date_allowed=str(min(df['first_online']).date()),
-            max_date_allowed=str(max(df['first_online']).date()),
-            start_date=str(min(df['first_online']).date()),
-            end_date=str(max(df['first_online']).date()),
+            min_date_allowed=str(data.first_day.date()),
+            max_date_allowed=str(data.last_day.date()),
+            start_date=str(data.first_day.date()),
+            end_date=str(data.last_day.date()),
         ),
+        # bounds of the dataset used by the presets in the browser, see assets/time_period.js
+        dcc.Store(id=f"{element_id_datepicker}-bounds",
+                  data={'first_day': str(data.first_day.date()),
+                        'last_day': str(data.last_day.date())}),
     ])
     return time_period_div
 
-# time period select objects be imported to pages
-time_period = select_time_period("time-period-radio",
-                                        "time-period",
-                                        time_period_options)
-time_period_compare = select_time_period("time-period-all-radio",
-                                        "time-period-all",
-                                        time_period_options_compare)
+def time_period_dates(radio_value, data):
+    ''' start date, end date and disabled state of the date picker for a time period
+     radiobutton: the last months, all time, or a custom period picked by the user.
+     The pages compute them in the browser with assets/time_period.js, keep both in sync '''
+    if radio_value > 0:
+        last_include = data.last_day - relativedelta(months=radio_value)
+        return last_include.date(), data.last_day.date(), True
+    if radio_value == 0:
+        return data.first_day.date(), data.last_day.date(), True
+    return data.first_day.date(), data.last_day.date(), False
+
+def preset_dates(radio_options, data):
+    ''' date picker values of every preset radiobutton, as sent by the browser '''
+    return [tuple(str(day) for day in time_period_dates(option['value'], data)[:2])
+            for option in radio_options if option['value'] >= 0]
 
 def create_ban_card(desc_text, value_str, is_static=False):
     ''' function to create BANs, used multiple times on both home and compare pages '''
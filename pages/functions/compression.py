@@ -0,0 +1,113 @@
+""" Compression and cache headers of the responses of the Flask server.
+
+Callback responses, page layouts and static bundles larger than COMPRESS_MIN_BYTES
+are compressed with brotli when it is installed and accepted by the browser, with gzip
+otherwise. Static files whose url changes with their content (fingerprinted component
+bundles, assets with their modification time in the query) are cached by the browser
+for a year, and their compressed bodies are kept in memory. Set COMPRESS_RESPONSES=0
+to send uncompressed responses, e.g. behind a proxy that compresses them; the cache
+headers are set either way. """
+import gzip
+import os
+import re
+import threading
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_RESPONSES = os.environ.get('COMPRESS_RESPONSES', '1') not in ('', '0', 'false')
+# smaller responses fit in a packet, compressing them costs more than it saves
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+# gzip level, from 1 (fast) to 9 (small); brotli uses the same level, out of 11
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESS_MIMETYPES = {'application/json', 'application/javascript', 'text/javascript',
+                      'text/html', 'text/css', 'text/plain', 'image/svg+xml'}
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# dash component bundles have the package version and a timestamp in their file name
+FINGERPRINT = re.compile(r'\.v[\w-]+m\d{8,}\.')
+
+# compressed bodies of static files by path, query and encoding
+_static_bodies = {}
+_static_lock = threading.Lock()
+
+
+def is_immutable(request):
+    ''' True for static urls that change when their content changes '''
+    path = request.path
+    if '/_dash-component-suites/' in path:
+        return bool(FINGERPRINT.search(path))
+    return '/assets/' in path and 'm' in request.args
+
+
+def accepted_encoding(request):
+    ''' br or gzip when the browser accepts it, None otherwise '''
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding, level=COMPRESS_LEVEL):
+    ''' body compressed with br or gzip '''
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def cache_headers(response):
+    ''' after_request hook, lets the browser keep static files whose url changes with
+     their content '''
+    if response.status_code == 200 and is_immutable(flask.request):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def compress_response(response):
+    ''' after_request hook, compresses the response when it is worth it '''
+    request = flask.request
+    immutable = response.status_code == 200 and is_immutable(request)
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(request)
+    # static files are sent from disk by a file wrapper, other iterables are streams
+    if (encoding is None or response.status_code != 200
+            or (response.is_streamed and not response.direct_passthrough)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.direct_passthrough = False
+    key = (request.path, request.query_string, encoding)
+    with _static_lock:
+        body = _static_bodies.get(key) if immutable else None
+    if body is None:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        body = compress(data, encoding)
+        if immutable:
+            with _static_lock:
+                _static_bodies[key] = body
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        # the browser revalidates with the etag of the compressed body
+        response.set_etag(f"{etag}-{encoding}", weak)
+        response.make_conditional(request)
+    return response
+
+
+def init_app(server):
+    ''' registers the cache headers and the compression of the responses of the Flask
+     server, the cache headers are set with COMPRESS_RESPONSES=0 too '''
+    server.after_request(cache_headers)
+    if COMPRESS_RESPONSES:
+        server.after_request(compress_response)
@@ -0,0 +1,460 @@
+""" Aggregation cube used as the data source of the charts.
+
+Rows are aggregated once at load time into cells of
+seniority level x profession flags x week of first_online x is_unique_text.
+A selection sums the cells of the weeks fully inside its date range and
+aggregates only the rows of the partially covered weeks at its edges.
+Cube.periods does the same for several periods of one selection in a single pass.
+Distinct urls can not be summed over cells, a url can have rows in several of them,
+so they are counted from the selected rows, see distinct_urls. """
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from pages.functions import metrics
+from pages.functions.load_data import TYPE_COLUMNS
+from pages.functions.shared_store import LocalStore
+
+# categorical columns counted per cell
+CUBE_CATEGORIES = ['district', 'cloud_skills', 'viz_tools', 'degree', 'job_type']
+# 0/1 columns summed per cell
+CUBE_FLAGS = ['lang_en', 'lang_he', 'is_direct']
+# attributes of the cells, stored next to their measures
+CELL_ATTRIBUTES = ['unique', 'types', 'job', 'week', 'max_day']
+
+
+def week_start(week_num):
+    ''' first day (Sunday) of a week number from load_data.add_derived_columns '''
+    return np.datetime64(int(week_num)*7 - 4, 'D')
+
+
+def latest_day(days):
+    ''' latest of the days ignoring NaT, NaT when there is none '''
+    days = days[~np.isnat(days)]
+    return days.max() if len(days) else np.datetime64('NaT', 'D')
+
+
+def top_counts(counts, n=None):
+    ''' non-zero counts per category (CubeSummary.counts, Selection.value_counts) in
+     descending order, ties in category order. With n only the n largest are kept,
+     selected with a partial sort instead of ranking every category '''
+    values = counts.to_numpy()
+    positions = np.flatnonzero(values > 0)
+    if n is not None and n < len(positions):
+        # n-th largest count, the categories above it and the first ones equal to it
+        kth = -np.partition(-values[positions], n - 1)[n - 1]
+        above = positions[values[positions] > kth]
+        tied = positions[values[positions] == kth][:n - len(above)]
+        positions = np.sort(np.concatenate([above, tied]))
+    return counts.iloc[positions[np.argsort(-values[positions], kind='stable')]]
+
+
+def distinct_urls(codes, url_codes, n_values):
+    ''' distinct urls per code from 0 to n_values - 1, like groupby(codes).url.nunique().
+     Rows with a missing category or url (code -1) are left out '''
+    codes = np.asarray(codes).astype('int64')
+    url_codes = np.asarray(url_codes).astype('int64')
+    known = (codes >= 0) & (url_codes >= 0)
+    n_urls = int(url_codes.max(initial=0)) + 1
+    pairs = np.unique(codes[known]*n_urls + url_codes[known])
+    return np.bincount(pairs // n_urls, minlength=n_values)
+
+
+def selection_urls(cols, categories, rows, column=None):
+    ''' distinct urls of the given rows of row level columns per category of a column,
+     or in total without a column '''
+    if column is None:
+        return int(distinct_urls(np.zeros(len(rows)), cols['url_code'][rows], 1)[0])
+    return distinct_urls(cols[column][rows], cols['url_code'][rows], len(categories[column]))
+
+
+class CubeSummary:
+    ''' measures summed over a selection, split by is_unique_text. cube gives the
+     categories and skills of the measures, a Cube or a query backend. urls(column,
+     unique_only) counts the distinct urls of the selection, see Cube.distinct_urls '''
+
+    def __init__(self, cube, parts, max_day, urls=None):
+        self.cube = cube
+        self.parts = parts
+        self.max_day = max_day
+        self._urls = urls
+
+    def all(self, measure):
+        ''' measure over all selected rows '''
+        return self.parts[measure].sum(axis=0)
+
+    def unique(self, measure):
+        ''' measure over selected rows with a unique text '''
+        return self.parts[measure][1]
+
+    def urls(self, column=None, unique_only=False):
+        ''' distinct urls of the selected rows per category of a column, or in total '''
+        if self._urls is None:
+            raise ValueError("distinct urls are only counted for a single period")
+        return self._urls(column, unique_only)
+
+    def counts(self, column, unique_only=False, distinct_urls=False):
+        ''' counts per category like value_counts, without categories absent from the selection '''
+        if distinct_urls:
+            values = self.urls(column, unique_only)
+        else:
+            values = (self.unique if unique_only else self.all)(f"rows_{column}")
+        counts = pd.Series(values, index=self.cube.categories[column], name='count')
+        counts.index.name = column
+        return counts[counts > 0]
+
+    def skills(self, unique_only=True):
+        ''' advantage, mandatory and any-mention counts per skill '''
+        select = self.unique if unique_only else self.all
+        advantage, mandatory = select('skill_advantage'), select('skill_mandatory')
+        return pd.DataFrame({'advantage': advantage,
+                             'mandatory': mandatory,
+                             'any': advantage + mandatory},
+                            index=pd.Index(self.cube.skills, name='skill'))
+
+    def last_day(self, unique_only=False):
+        ''' latest publication date in the selection as a timestamp, NaT when empty '''
+        return pd.Timestamp(self.max_day[1] if unique_only else latest_day(self.max_day))
+
+    def mean_experience(self):
+        ''' mean required experience, NaN when no vacancy has it '''
+        count = self.all('exp_count')
+        return self.all('exp_sum') / count if count else float('nan')
+
+
+def period_starts(start_day, end_day, first_days):
+    ''' first days of the periods a date range is split into by the first days of
+     Cube.periods, all of them datetime64[D] '''
+    return sorted({max(day, start_day) for day in first_days
+                   if not np.isnat(day) and day <= end_day} | {start_day})
+
+
+def since_summaries(cube, parts, max_day, starts, end_day, first_days):
+    ''' summaries since each of first_days from the measures and the latest days (as
+     int64 days) of the periods beginning at starts, both split by is_unique_text '''
+    # measures since the start of a period are the sums over the periods after it
+    since = {name: np.cumsum(values[::-1], axis=0)[::-1] for name, values in parts.items()}
+    since_max_day = np.maximum.accumulate(max_day[::-1], axis=0)[::-1].astype('datetime64[D]')
+    empty = CubeSummary(cube, {name: np.zeros_like(values[0]) for name, values in since.items()},
+                        np.full(2, np.datetime64('NaT', 'D')))
+    summaries = []
+    for day in first_days:
+        if np.isnat(day) or day > end_day:
+            summaries.append(empty)
+        else:
+            period = starts.index(max(day, starts[0]))
+            summaries.append(CubeSummary(cube, {name: values[period] for name, values
+                                                in since.items()},
+                                         since_max_day[period]))
+    return summaries
+
+
+def group_measures(cols, categories, skill_counts, rows, groups, n_groups):
+    ''' measures of the given rows of row level columns summed per group, skill_counts
+     is the group_counts of a skill matrix with the same rows '''
+    def group_sum(weights=None):
+        return np.bincount(groups, weights=weights, minlength=n_groups)
+
+    experience = cols['min_experience'][rows]
+    has_experience = ~np.isnan(experience)
+    measures = {'rows': group_sum(),
+                'exp_sum': group_sum(np.where(has_experience, experience, 0)),
+                'exp_count': group_sum(has_experience)}
+    for col in CUBE_FLAGS:
+        measures[col] = group_sum(cols[col][rows])
+
+    for col in CUBE_CATEGORIES:
+        n_values = len(categories[col])
+        codes = cols[col][rows].astype('int64')
+        known = codes >= 0
+        bins = groups[known]*n_values + codes[known]
+        measures[f"rows_{col}"] = np.bincount(
+            bins, minlength=n_groups*n_values).reshape(n_groups, n_values)
+
+    measures['skill_advantage'], measures['skill_mandatory'] = \
+        skill_counts(rows, groups, n_groups)
+    return {name: values if name == 'exp_sum' else values.astype('int64')
+            for name, values in measures.items()}
+
+
+class Cube:
+    ''' per-cell measures of the main dataframe, see the module docstring '''
+
+    def __init__(self, df, filter_index, skill_matrix, store=None, previous=None, weeks=None,
+                 keep=None):
+        ''' with the cube of the previous dataset version, only the cells of the given
+         weeks are built again, see _update_cells, and with the keep mask of
+         load_data.merge_delta only the row level columns of the delta rows are converted '''
+        store = store or LocalStore()
+        self.filter_index = filter_index
+        self.skill_matrix = skill_matrix
+        self.skills = skill_matrix.skills
+        self.categories = {col: list(df[col].cat.categories) for col in CUBE_CATEGORIES}
+        self.job_types = self.categories['job_type']
+
+        # row level columns used for the cells and for the rows at the edges of a selection
+        self.columns = {col: df[col].cat.codes.to_numpy() for col in CUBE_CATEGORIES}
+        for col in CUBE_FLAGS + ['is_unique_text', 'url_code', 'week_num', 'month_num']:
+            self.columns[col] = df[col].to_numpy()
+
+        def row_array(name, convert):
+            # after merge_delta only the appended rows are converted
+            if previous is None or keep is None:
+                return convert(df)
+            return np.concatenate([previous.columns[name][keep],
+                                   convert(df.iloc[int(keep.sum()):])])
+
+        self.columns['min_experience'] = store.array('cube_min_experience', partial(
+            row_array, 'min_experience',
+            lambda rows: rows['min_experience'].to_numpy(dtype='float64')))
+        self.columns['day'] = store.array('cube_day', partial(
+            row_array, 'day',
+            lambda rows: rows['first_online'].to_numpy().astype('datetime64[D]')))
+        self.columns['type_bits'] = store.array('cube_type_bits', partial(
+            row_array, 'type_bits', self._type_bits))
+
+        # cells are built at most once, when one of their arrays is not stored yet
+        built = {}
+
+        def cell_array(name):
+            if not built:
+                if previous is None or previous.skills != self.skills:
+                    built.update(self._build_cells())
+                else:
+                    built.update(self._update_cells(previous, weeks))
+            return built[name]
+
+        for name in CELL_ATTRIBUTES:
+            setattr(self, f"cell_{name}",
+                    store.array(f"cube_cell_{name}", partial(cell_array, f"cell_{name}")))
+        measure_names = self._measures(np.array([], dtype='int64'), np.array([], dtype='int64'), 0)
+        self.cell_measures = {name: store.array(f"cube_{name}", partial(cell_array, name))
+                              for name in measure_names}
+
+    @staticmethod
+    def _type_bits(df):
+        ''' profession flags of every row as bits of one integer '''
+        type_bits = np.zeros(len(df), dtype='int64')
+        for bit, col in enumerate(TYPE_COLUMNS):
+            if col in df:
+                type_bits |= (df[col].to_numpy() > 0).astype('int64') << bit
+        return type_bits
+
+    def _build_cells(self, rows=None):
+        ''' groups rows into cells, returns cell attributes and summed measures by name '''
+        cols = self.columns
+        if rows is None:
+            rows = np.flatnonzero(cols['week_num'] >= 0)
+        job = cols['job_type'][rows].astype('int64') + 1
+        unique = (cols['is_unique_text'][rows] > 0).astype('int64')
+        week = cols['week_num'][rows].astype('int64')
+        key = ((week*(len(self.job_types) + 1) + job) << len(TYPE_COLUMNS)
+               | cols['type_bits'][rows]) << 1 | unique
+        cell_keys, cells = np.unique(key, return_inverse=True)
+
+        cell_job_week = cell_keys >> (len(TYPE_COLUMNS) + 1)
+        cell_max_day = np.full(len(cell_keys), np.iinfo('int64').min)
+        np.maximum.at(cell_max_day, cells, cols['day'][rows].astype('int64'))
+        return {'cell_unique': (cell_keys & 1).astype(bool),
+                'cell_types': (cell_keys >> 1) & ((1 << len(TYPE_COLUMNS)) - 1),
+                'cell_job': cell_job_week % (len(self.job_types) + 1) - 1,
+                'cell_week': cell_job_week // (len(self.job_types) + 1),
+                'cell_max_day': cell_max_day.astype('datetime64[D]'),
+                **self._measures(rows, cells, len(cell_keys))}
+
+    def _update_cells(self, previous, weeks):
+        ''' cells of the previous cube outside the given weeks, followed by the cells of these
+         weeks built again from their rows. Category codes of the previous cells are mapped
+         to the categories of the new dataframe, which include the previous ones '''
+        weeks = np.asarray(weeks, dtype='int64')
+        rows = [self.filter_index.select_days([], [], week_start(week), week_start(week) + 6)
+                for week in weeks]
+        rows = np.sort(np.concatenate(rows)) if rows else np.array([], dtype='int64')
+        cells = self._build_cells(rows)
+
+        kept = ~np.isin(previous.cell_week, weeks)
+        old = {f"cell_{name}": getattr(previous, f"cell_{name}")[kept] for name in CELL_ATTRIBUTES}
+        old.update({name: values[kept] for name, values in previous.cell_measures.items()})
+        for col in CUBE_CATEGORIES:
+            positions = pd.Index(self.categories[col]).get_indexer(previous.categories[col])
+            values = np.zeros((len(old[f"rows_{col}"]), len(self.categories[col])),
+                              dtype='int64')
+            values[:, positions] = old[f"rows_{col}"]
+            old[f"rows_{col}"] = values
+        job_positions = np.append(pd.Index(self.job_types).get_indexer(previous.job_types), -1)
+        old['cell_job'] = job_positions[old['cell_job']]
+        return {name: np.concatenate([old[name], values]) for name, values in cells.items()}
+
+    def _measures(self, rows, groups, n_groups):
+        ''' measures of the given rows summed per group '''
+        return group_measures(self.columns, self.categories, self.skill_matrix.group_counts,
+                              rows, groups, n_groups)
+
+    def _cell_mask(self, job_types, all_types):
+        ''' cells of the selected seniority levels and professions '''
+        mask = np.ones(len(self.cell_unique), dtype=bool)
+        if job_types:
+            codes = [self.job_types.index(value) for value in job_types
+                     if value in self.job_types]
+            mask &= np.isin(self.cell_job, codes)
+        if all_types:
+            bits = sum(1 << TYPE_COLUMNS.index(col) for col in all_types if col in TYPE_COLUMNS)
+            mask &= (self.cell_types & bits) != 0
+        return mask
+
+    @staticmethod
+    def _weeks(start_day, end_day):
+        ''' first and last week fully inside the date range and the date ranges of the
+         partially covered weeks at its edges, start_day and end_day are both inclusive '''
+        first_week = (start_day.astype('int64') + 4 + 6) // 7
+        last_week = (end_day.astype('int64') + 4 + 1) // 7 - 1
+        if first_week > last_week:
+            edges = [(start_day, end_day)]
+        else:
+            edges = [(start_day, week_start(first_week) - 1),
+                     (week_start(last_week + 1), end_day)]
+        return first_week, last_week, [edge for edge in edges if edge[0] <= edge[1]]
+
+    def _select(self, job_types, all_types, start_day, end_day):
+        ''' cells of the weeks fully inside the date range and rows of the partially
+         covered weeks, start_day and end_day are datetime64[D] and both inclusive '''
+        start_day = np.datetime64(start_day, 'D')
+        end_day = np.datetime64(end_day, 'D')
+        first_week, last_week, edges = self._weeks(start_day, end_day)
+        cell_mask = self._cell_mask(job_types, all_types)
+        cell_mask &= (self.cell_week >= first_week) & (self.cell_week <= last_week)
+        edge_rows = [self.filter_index.select_days(job_types, all_types, edge_start, edge_end)
+                     for edge_start, edge_end in edges]
+        edge_rows = np.concatenate(edge_rows) if edge_rows else np.array([], dtype='int64')
+        return cell_mask, edge_rows
+
+    def _max_day(self, cell_mask, edge_rows):
+        ''' latest publication date of the selected cells and rows, split by is_unique_text '''
+        edge_unique = self.columns['is_unique_text'][edge_rows] > 0
+        return np.array([
+            latest_day(np.append(self.cell_max_day[cell_mask & (self.cell_unique == unique)],
+                                 self.columns['day'][edge_rows[edge_unique == unique]]))
+            for unique in (0, 1)])
+
+    def last_days(self, job_types, all_types, start_day, end_day):
+        ''' latest publication date of the rows matching the user controls, split by
+         is_unique_text, without aggregating their measures '''
+        with metrics.stage('filter'):
+            cell_mask, edge_rows = self._select(job_types, all_types, start_day, end_day)
+        return self._max_day(cell_mask, edge_rows)
+
+    def summary(self, job_types, all_types, start_day, end_day, measures=None):
+        ''' measures of the rows matching the user controls, all of them by default '''
+        with metrics.stage('filter'):
+            cell_mask, edge_rows = self._select(job_types, all_types, start_day, end_day)
+        with metrics.stage('aggregate'):
+            edge_unique = (self.columns['is_unique_text'][edge_rows] > 0).astype('int64')
+            edge_measures = self._measures(edge_rows, edge_unique, 2)
+
+            parts = {}
+            for name in measures or self.cell_measures:
+                values = self.cell_measures[name]
+                parts[name] = edge_measures[name] + np.stack(
+                    [values[cell_mask & ~self.cell_unique].sum(axis=0),
+                     values[cell_mask & self.cell_unique].sum(axis=0)])
+            max_day = self._max_day(cell_mask, edge_rows)
+        if 'rows' in parts:
+            metrics.selected_rows.observe(parts['rows'].sum(), callback=metrics.current_callback())
+        return CubeSummary(self, parts, max_day, partial(self.distinct_urls, job_types,
+                                                         all_types, start_day, end_day))
+
+    def _rows(self, job_types, all_types, start_day, end_day, unique_only=False):
+        ''' rows matching the user controls, only the ones with a unique text with unique_only '''
+        with metrics.stage('filter'):
+            rows = self.filter_index.select_days(job_types, all_types,
+                                                 np.datetime64(start_day, 'D'),
+                                                 np.datetime64(end_day, 'D'))
+            if unique_only:
+                rows = rows[self.columns['is_unique_text'][rows] > 0]
+        return rows
+
+    def distinct_urls(self, job_types, all_types, start_day, end_day, column=None,
+                      unique_only=False):
+        ''' distinct urls of the rows matching the user controls per category of a column,
+         or in total, counted from the rows since the cells can share urls '''
+        rows = self._rows(job_types, all_types, start_day, end_day, unique_only)
+        with metrics.stage('aggregate'):
+            return selection_urls(self.columns, self.categories, rows, column)
+
+    def periods(self, job_types, all_types, start_day, end_day, first_days, measures=None):
+        ''' summaries of the rows matching the user controls published since each of
+         first_days, in a single pass: the date range is split into periods starting at the
+         first days, and cells and edge rows are summed per period and is_unique_text.
+         A first day before start_day gives the whole selection, a NaT or later one nothing '''
+        start_day = np.datetime64(start_day, 'D')
+        end_day = np.datetime64(end_day, 'D')
+        first_days = [np.datetime64(day, 'D') for day in first_days]
+        starts = period_starts(start_day, end_day, first_days)
+        ends = [day - 1 for day in starts[1:]] + [end_day]
+        n_groups = 2*len(starts)
+
+        with metrics.stage('filter'):
+            type_mask = self._cell_mask(job_types, all_types)
+            cell_period = np.full(len(self.cell_unique), -1)
+            edge_rows, edge_period = [], []
+            for period, (period_start, period_end) in enumerate(zip(starts, ends)):
+                first_week, last_week, edges = self._weeks(period_start, period_end)
+                cell_period[type_mask & (self.cell_week >= first_week)
+                            & (self.cell_week <= last_week)] = period
+                for edge_start, edge_end in edges:
+                    rows = self.filter_index.select_days(job_types, all_types,
+                                                         edge_start, edge_end)
+                    edge_rows.append(rows)
+                    edge_period.append(np.full(len(rows), period))
+            edge_rows = np.concatenate(edge_rows) if edge_rows else np.array([], dtype='int64')
+            edge_period = np.concatenate(edge_period) if edge_period \
+                else np.array([], dtype='int64')
+        with metrics.stage('aggregate'):
+            # group of a cell or row: period and is_unique_text
+            edge_groups = 2*edge_period + (self.columns['is_unique_text'][edge_rows] > 0)
+            edge_measures = self._measures(edge_rows, edge_groups, n_groups)
+            cells = np.flatnonzero(cell_period >= 0)
+            cell_groups = 2*cell_period[cells] + self.cell_unique[cells]
+            order = np.argsort(cell_groups, kind='stable')
+            cells, cell_groups = cells[order], cell_groups[order]
+            group_sizes = np.bincount(cell_groups, minlength=n_groups)
+            # cells of every non-empty group are contiguous, reduceat sums them in one pass
+            filled = group_sizes > 0
+            group_starts = (np.cumsum(group_sizes) - group_sizes)[filled]
+
+            def group_sums(values, ufunc=np.add, empty=0):
+                sums = np.full((n_groups,) + values.shape[1:], empty, dtype=values.dtype)
+                if len(cells):
+                    sums[filled] = ufunc.reduceat(values[cells], group_starts, axis=0)
+                return sums
+
+            parts = {}
+            for name in measures or self.cell_measures:
+                values = self.cell_measures[name]
+                parts[name] = (edge_measures[name] + group_sums(values)).reshape(
+                    (len(starts), 2) + values.shape[1:])
+            max_day = group_sums(self.cell_max_day.astype('int64'), np.maximum,
+                                 np.iinfo('int64').min)
+            np.maximum.at(max_day, edge_groups,
+                          self.columns['day'][edge_rows].astype('int64'))
+            summaries = since_summaries(self, parts, max_day.reshape(len(starts), 2),
+                                        starts, end_day, first_days)
+        if 'rows' in parts:
+            metrics.selected_rows.observe(parts['rows'].sum(), callback=metrics.current_callback())
+        return summaries
+
+    def weekly(self, job_types, all_types, start_day, end_day):
+        ''' distinct urls and latest publication date per week, for vacancies with a unique
+         text. They are counted from the selected rows, like distinct_urls '''
+        rows = self._rows(job_types, all_types, start_day, end_day, unique_only=True)
+        with metrics.stage('aggregate'):
+            weeks, positions = np.unique(self.columns['week_num'][rows], return_inverse=True)
+            last_day = np.full(len(weeks), np.iinfo('int64').min)
+            np.maximum.at(last_day, positions, self.columns['day'][rows].astype('int64'))
+            return pd.DataFrame(
+                {'jobs_count': distinct_urls(positions, self.columns['url_code'][rows],
+                                             len(weeks)),
+                 'last_day_of_the_week': last_day.astype('datetime64[D]')
+                 .astype('datetime64[ns]')},
+                index=pd.Index(weeks.astype('int64'), name='week_num'))
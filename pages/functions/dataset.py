@@ -0,0 +1,226 @@
+""" Versioned dataset used by the pages, reloaded without restarting the server.
+
+current() returns the dataset the callbacks and layouts should use. reload()
+builds the next version (dataframe, filter index, skill matrix and cube) while
+the pages keep serving the current one, and then swaps a single reference.
+Callbacks take the reference once when they start, so requests in flight finish
+on the version they started with and the old version is freed after them.
+
+A scrape batch is ingested with
+
+    python -m pages.functions.dataset batch.csv
+
+which stores it as a delta of the current csv snapshot. Servers pick it up on their
+next check (or POST /reload-dataset) and update their dataset incrementally: only the
+batch rows are converted and only the cube cells of the weeks it touches are rebuilt.
+
+With a QUERY_BACKEND other than pandas the workers do not load the dataframe: they
+open the copy of the version stored by the backend, which also stores the row count,
+date bounds, seniority levels and skills. Only the worker writing the copy loads it. """
+import logging
+import os
+import sys
+import threading
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from pages.functions.load_data import find_data_file, load_dataset, skill_columns
+from pages.functions.load_data import (SHARED_DATASET, dataset_attrs, dataset_metadata,
+                                       dataset_version, list_deltas, map_shared, merge_delta,
+                                       read_delta, source_key, write_delta)
+from pages.functions.filter_index import FilterIndex
+from pages.functions.skill_engine import SkillMatrix
+from pages.functions.cube import Cube
+from pages.functions.query_backend import backend_class
+from pages.functions.shared_store import store_for
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks of the csv file, 0 disables the watcher
+DATA_RELOAD_INTERVAL = float(os.environ.get('DATA_RELOAD_INTERVAL', 0))
+
+
+class Dataset:
+    ''' main dataframe of one csv version with the indexes derived from it.
+     previous and keep come from with_delta, to reuse the indexes of the previous version.
+     Without df, a stored backend opens the version of attrs (see load_data.dataset_attrs)
+     and load() returns the dataframe when the version is not stored yet '''
+
+    def __init__(self, df=None, previous=None, keep=None, attrs=None, load=None):
+        self.df = df
+        attrs = df.attrs if df is not None else attrs
+        self.version = attrs['version']
+        # csv snapshot key and names of the deltas applied on top of it
+        self.source_key = attrs['source_key']
+        self.deltas = attrs['deltas']
+        self.snapshot_dir = attrs.get('snapshot_dir')
+        self.load = load if df is None else (lambda: df)
+        backend = backend_class()
+        # the sql backends query a database file instead of these indexes
+        self.filter_index = self.skill_matrix = self.cube = None
+        if backend.in_memory:
+            # arrays derived from df are memory-mapped files shared by workers
+            # when SHARED_DATASET is set
+            store = store_for(df)
+            if previous is None:
+                # masks used by the pages to filter the main dataframe
+                self.filter_index = FilterIndex(df, store)
+                # skill columns as a single matrix, used for all skill counts
+                self.skill_matrix = SkillMatrix(df, skill_columns(df.columns), store)
+                # aggregates used as the data source of the charts
+                self.cube = Cube(df, self.filter_index, self.skill_matrix, store)
+            else:
+                # weeks of the replaced and of the appended rows
+                weeks = np.union1d(previous.df['week_num'].to_numpy()[~keep],
+                                   df['week_num'].to_numpy()[int(keep.sum()):])
+                self.filter_index = FilterIndex(df, store, previous.filter_index, keep)
+                self.skill_matrix = SkillMatrix(df, skill_columns(df.columns), store,
+                                                previous.skill_matrix, keep)
+                self.cube = Cube(df, self.filter_index, self.skill_matrix, store,
+                                 previous.cube, weeks[weeks >= 0], keep)
+        # filters and aggregates of the selections, set by QUERY_BACKEND
+        self.backend = backend(self)
+        # size, bounds and options of the user controls
+        metadata = dataset_metadata(df) if df is not None else self.backend.metadata
+        self.n_rows = metadata['rows']
+        self.first_day = pd.Timestamp(metadata['first_day'])
+        self.last_day = pd.Timestamp(metadata['last_day'])
+        self.job_types = metadata['job_types']
+        self.skills = metadata['skills']
+
+    def with_delta(self, name):
+        ''' next dataset version with a delta of load_data.write_delta upserted by url '''
+        delta = read_delta(self.source_key, name, self.snapshot_dir)
+        deltas = self.deltas + (name,)
+        df, keep = merge_delta(self.df, delta)
+        if SHARED_DATASET:
+            df = map_shared(dataset_version(self.source_key, deltas), lambda: df)
+        df.attrs.update(version=dataset_version(self.source_key, deltas),
+                        source_key=self.source_key, deltas=deltas,
+                        snapshot_dir=self.snapshot_dir)
+        return Dataset(df, self, keep)
+
+
+def open_dataset(csv_path):
+    ''' dataset of the csv with its ingested deltas, loading the dataframe only for the
+     pandas backend or to store the version '''
+    if backend_class().in_memory:
+        return Dataset(load_dataset(csv_path))
+    attrs = dataset_attrs(csv_path)
+    return Dataset(attrs=attrs, load=partial(load_dataset, csv_path, shared=False,
+                                             deltas=attrs['deltas']))
+
+
+_current = None
+# stat of the csv the current dataset was loaded from, compared by the watcher
+_source_stat = None
+_reload_lock = threading.Lock()
+# functions called with the new dataset after each swap
+_listeners = []
+
+
+def current():
+    ''' dataset of the latest loaded csv version, loaded on first use '''
+    if _current is None:
+        reload()
+    return _current
+
+
+def on_swap(listener):
+    ''' registers listener(dataset), called after a new version replaced the current one '''
+    _listeners.append(listener)
+
+
+def _stat(csv_path):
+    stat = os.stat(csv_path)
+    return csv_path, stat.st_size, stat.st_mtime_ns
+
+
+def reload(force=False):
+    ''' loads the csv again when it changed since the last load, or applies the deltas
+     ingested since then, and swaps the current dataset. Returns True when a new version
+     was swapped in '''
+    global _source_stat
+    with _reload_lock:
+        csv_path = find_data_file()
+        source_stat = _stat(csv_path)
+        start = time.perf_counter()
+        if _current is not None and source_stat == _source_stat and not force:
+            applied = list(_current.deltas)
+            deltas = list_deltas(_current.source_key)
+            if deltas == applied:
+                return False
+            if deltas[:len(applied)] == applied and _current.df is not None:
+                new = _current
+                for name in deltas[len(applied):]:
+                    new = new.with_delta(name)
+            else:
+                # deltas were removed, or the version is stored by the backend
+                new = open_dataset(csv_path)
+        else:
+            new = open_dataset(csv_path)
+            _source_stat = source_stat
+        if _current is not None and new.version == _current.version:
+            # the file was touched without a content change
+            return False
+        logger.info("dataset %s built in %.3fs", new.version, time.perf_counter() - start)
+        swap(new)
+    return True
+
+
+def swap(new):
+    ''' makes new the current dataset and notifies the listeners '''
+    global _current
+    old_version = _current.version if _current is not None else None
+    _current = new
+    logger.info("dataset %s replaced %s", new.version, old_version)
+    for listener in _listeners:
+        listener(new)
+
+
+def ingest(batch_path):
+    ''' stores a scrape batch as a delta of the snapshot of the current csv,
+     returns the name of the delta '''
+    return write_delta(batch_path, source_key(find_data_file()))
+
+
+def reload_in_background():
+    ''' starts a reload in a daemon thread, returns False when a reload is already running '''
+    if _reload_lock.locked():
+        return False
+    threading.Thread(target=_reload_safely, name='dataset-reload', daemon=True).start()
+    return True
+
+
+def _reload_safely():
+    ''' reload() that keeps serving the current version when the new csv can not be loaded '''
+    try:
+        reload()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("dataset reload failed, keeping version %s",
+                         _current.version if _current is not None else None)
+
+
+def start_watcher(interval=DATA_RELOAD_INTERVAL):
+    ''' checks the csv every interval seconds in a daemon thread and reloads it when it changed.
+     Every server worker runs its own watcher '''
+    if interval <= 0:
+        return None
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            _reload_safely()
+
+    watcher = threading.Thread(target=watch, name='dataset-watcher', daemon=True)
+    watcher.start()
+    return watcher
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    for path in sys.argv[1:]:
+        logger.info("ingested %s as delta %s", path, ingest(path))
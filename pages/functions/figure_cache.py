@@ -0,0 +1,155 @@
+""" LRU cache of serialized callback outputs, keyed by normalized filter values.
+
+Outputs are serialized when they are computed (with orjson, the fastest engine of
+plotly.io, numpy arrays as typed arrays) and stored as json strings, which are small
+and can be written to disk by warmup.py. On a hit the string is decoded to plain json
+values, cheap to patch by figure_patch.py and to encode again by Dash for the response,
+unlike the plotly figures and numpy arrays it replaces (home.cache_hit in the
+benchmarks). """
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+from plotly.io.json import to_json_plotly
+
+from pages.functions.single_flight import flights
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+# number of filter combinations kept per page
+FIGURE_CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE', 256))
+
+# all caches by name, used to report their stats, see register_cache
+caches = {}
+
+
+def register_cache(name, cache):
+    ''' adds a cache to the ones reported by cache_stats and emptied by clear_caches. It has
+     clear() and stats() methods and a _lock replaced in forked processes. Returns it '''
+    caches[name] = cache
+    return cache
+
+
+def canonical_key(args):
+    ''' hashable key of callback inputs: lists are sorted, dates lose their time part '''
+    key = []
+    for value in args:
+        if isinstance(value, (list, tuple)):
+            value = tuple(sorted(value))
+        elif isinstance(value, str) and value[:4].isdigit() and value[4:5] == '-':
+            # other strings, e.g. skill names, are kept whole
+            value = value[:10]
+        key.append(value)
+    return tuple(key)
+
+
+class FigureCache:
+    ''' bounded cache of callback outputs stored as json strings.
+     It clears itself when the dataset version changes '''
+
+    def __init__(self, name, maxsize=FIGURE_CACHE_SIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        register_cache(name, self)
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._items.clear()
+            self.version = version
+
+    def get(self, key, version=None):
+        ''' cached json string or None, counts hits and misses '''
+        with self._lock:
+            self._check_version(version)
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, version=None):
+        ''' cached json string or None, without counting a hit or a miss '''
+        with self._lock:
+            if version != self.version:
+                return None
+            return self._items.get(key)
+
+    def put(self, key, value, version=None):
+        ''' stores a json string, evicting the least recently used one when full '''
+        with self._lock:
+            self._check_version(version)
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        ''' removes all cached outputs '''
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        ''' counters used to size the cache '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._items),
+                    'maxsize': self.maxsize,
+                    'bytes': sum(len(value) for value in self._items.values()),
+                    'version': self.version}
+
+    def memoize(self, get_version):
+        ''' decorator for dash callbacks, get_version returns the current dataset version '''
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                key = canonical_key(args)
+                version = get_version()
+                cached = self.get(key, version)
+                if cached is not None:
+                    return loads(cached)
+                # identical requests running meanwhile wait for this computation
+                encoded = flights.run((self.name, key), lambda: to_json_plotly(func(*args)),
+                                      version)
+                # outputs computed while the dataset was swapped are not stored
+                if self.maxsize > 0 and get_version() == version:
+                    self.put(key, encoded, version)
+                return loads(encoded)
+            # used by warmup.py to persist the outputs
+            wrapper.figure_cache = self
+            return wrapper
+        return decorator
+
+
+def clear_caches(*_):
+    ''' empties all figure caches, called when a new dataset version is loaded '''
+    for cache in caches.values():
+        cache.clear()
+
+
+def cache_stats():
+    ''' stats of all figure caches and of the coalesced computations '''
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    stats['flights'] = flights.stats()
+    return stats
+
+
+def _reset_locks():
+    # a lock held by another thread when the process forked, e.g. for a background
+    # callback job, would never be released in the new process
+    for cache in caches.values():
+        cache._lock = threading.Lock()  # pylint: disable=protected-access
+
+
+os.register_at_fork(after_in_child=_reset_locks)
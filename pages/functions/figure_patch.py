@@ -0,0 +1,43 @@
+""" Partial updates of the figures returned by the page callbacks.
+
+The layout and template of a chart do not depend on the filters, only its traces
+and title do. Callbacks decorated with patch_figures send a dash.Patch replacing
+these, so the template (about 7.6kB of json per figure) is sent once with the page
+layout instead of with every update. The graphs of a page must therefore get a full
+figure in the page layout. Set FIGURE_PATCHES=0 to send full figures. """
+import functools
+import os
+
+import dash
+from plotly import graph_objs as go
+
+FIGURE_PATCHES = os.environ.get('FIGURE_PATCHES', '1') not in ('', '0', 'false')
+
+
+def is_figure(output):
+    ''' True for a plotly figure or its json dict '''
+    return isinstance(output, go.Figure) or (isinstance(output, dict) and 'data' in output
+                                             and 'layout' in output)
+
+
+def figure_patch(figure):
+    ''' Patch replacing the traces and the title of a figure '''
+    if isinstance(figure, go.Figure):
+        figure = figure.to_plotly_json()
+    patch = dash.Patch()
+    patch['data'] = figure['data']
+    title = figure['layout'].get('title')
+    if title is not None:
+        patch['layout']['title'] = title
+    return patch
+
+
+def patch_figures(func):
+    ''' decorator of callbacks returning a list of outputs, figures are sent as patches '''
+    if not FIGURE_PATCHES:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        return [figure_patch(output) if is_figure(output) else output for output in func(*args)]
+    return wrapper
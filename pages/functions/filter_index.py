@@ -0,0 +1,108 @@
+""" Boolean mask index used to filter the main dataframe without copying it """
+import numpy as np
+
+from pages.functions.load_data import TYPE_COLUMNS
+from pages.functions.shared_store import LocalStore
+
+
+class FilterIndex:
+    ''' masks for seniority levels and professions, with rows sorted by publication date.
+     All masks are stored in date order, so a date range is a contiguous slice of them.
+     With the index of the previous dataset version and the keep mask of
+     load_data.merge_delta, only the rows of the delta are sorted and inserted among the
+     kept ones '''
+
+    def __init__(self, df, store=None, previous=None, keep=None):
+        store = store or LocalStore()
+        self.n_rows = len(df)
+        job_types = list(df['job_type'].cat.categories)
+        type_columns = [col for col in TYPE_COLUMNS if col in df]
+        if previous is not None and list(previous.type_masks) != type_columns:
+            previous = None
+        merged = {}
+
+        def merge(name):
+            # kept entries of the previous index with the delta rows inserted in date order
+            if not merged:
+                merged.update(self._merge(df, previous, keep, job_types, type_columns))
+            return merged[name]
+
+        if previous is None:
+            # stable sort keeps the original row order within a day, NaT goes last
+            self.order = store.array('filter_order', lambda: np.argsort(
+                df['first_online'].to_numpy().astype('datetime64[D]'), kind='stable'))
+            self.days = store.array('filter_days', lambda: df['first_online'].to_numpy()
+                                    .astype('datetime64[D]')[self.order])
+            job_type_masks = store.array('filter_job_type', lambda: (
+                df['job_type'].cat.codes.to_numpy()[self.order]
+                == np.arange(len(job_types))[:, None]))
+            type_masks = store.array('filter_types', lambda: np.stack(
+                [df[col].to_numpy()[self.order] > 0 for col in type_columns]))
+        else:
+            self.order = store.array('filter_order', lambda: merge('order'))
+            self.days = store.array('filter_days', lambda: merge('days'))
+            job_type_masks = store.array('filter_job_type', lambda: merge('job_type_masks'))
+            type_masks = store.array('filter_types', lambda: merge('type_masks'))
+        self.job_type_masks = dict(zip(job_types, job_type_masks))
+        self.type_masks = dict(zip(type_columns, type_masks))
+
+    @staticmethod
+    def _merge(df, previous, keep, job_types, type_columns):
+        ''' arrays of the index of df from the previous index and the delta rows, which
+         follow the kept rows in df. A delta row goes after the kept rows of its day, like
+         in the stable sort of all rows '''
+        n_kept = int(keep.sum())
+        kept = keep[previous.order]
+        positions = np.cumsum(keep) - 1
+        delta = df.iloc[n_kept:]
+        delta_days = delta['first_online'].to_numpy().astype('datetime64[D]')
+        delta_order = np.argsort(delta_days, kind='stable')
+        delta_days = delta_days[delta_order]
+        kept_days = previous.days[kept]
+        at = kept_days.searchsorted(delta_days, 'right')
+
+        def insert(old, new):
+            return np.insert(old[..., kept], at, new, axis=-1)
+
+        no_rows = np.zeros(len(previous.order), dtype=bool)
+        codes = delta['job_type'].cat.codes.to_numpy()[delta_order]
+        job_type_masks = insert(
+            np.stack([previous.job_type_masks.get(value, no_rows) for value in job_types]),
+            codes == np.arange(len(job_types))[:, None])
+        type_masks = insert(
+            np.stack([previous.type_masks[col] for col in type_columns]),
+            np.stack([delta[col].to_numpy()[delta_order] > 0 for col in type_columns]))
+        return {'order': insert(positions[previous.order], n_kept + delta_order),
+                'days': np.insert(kept_days, at, delta_days),
+                'job_type_masks': job_type_masks,
+                'type_masks': type_masks}
+
+    def date_slice(self, start_day, end_day):
+        ''' positions in date order of the rows published between the two days, inclusive '''
+        first = self.days.searchsorted(start_day, 'left')
+        return slice(first, max(first, self.days.searchsorted(end_day, 'right')))
+
+    def _any_mask(self, masks, values, date_range):
+        ''' OR of the masks of selected values, None when nothing is selected '''
+        if not values:
+            return None
+        selected = np.zeros(date_range.stop - date_range.start, dtype=bool)
+        for value in values:
+            if value in masks:
+                selected |= masks[value][date_range]
+        return selected
+
+    def select_days(self, job_type_val, all_types, start_day, end_day):
+        ''' row positions in the main dataframe matching the user controls, in original order.
+         The days are datetime64[D] bounds, inclusive '''
+        date_range = self.date_slice(start_day, end_day)
+        mask = None
+        for values, masks in ((job_type_val, self.job_type_masks), (all_types, self.type_masks)):
+            value_mask = self._any_mask(masks, values, date_range)
+            if value_mask is not None:
+                mask = value_mask if mask is None else mask & value_mask
+
+        rows = self.order[date_range]
+        if mask is not None:
+            rows = rows[mask]
+        return np.sort(rows)
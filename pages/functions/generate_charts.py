@@ -1,25 +1,24 @@
 """ Functions used on home page """
+import numpy as np
 import pandas as pd
 import plotly.express as px
+from plotly import graph_objs as go
 
-from pages.functions.common_elements import important_skills
+from pages.functions import metrics
+from pages.functions.cube import top_counts
 
 
-def generate_bar_chart(df_sel):
+@metrics.instrument_chart
+def generate_bar_chart(sel):
     """ bar chart top 15 most commonly mentioned skills """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    total_len = len(df_sel)
-    skill_count = []
-    for skill in important_skills:
-        if skill in df_sel:
-            advantage = len(df_sel.loc[df_sel[skill] == 1])
-            mandatory = len(df_sel.loc[df_sel[skill] > 1])
-            skill_count.append([skill, advantage, 'advantage'])
-            skill_count.append([skill, mandatory, 'mandatory'])
-        else:
-            print(skill + '!!!')
-
-    df_skill = pd.DataFrame(skill_count, columns=['skill', 'count', 'mandatory'])
+    total_len = sel.summary.unique('rows')
+    skills = sel.summary.skills()
+
+    # one row per skill and mention type, advantage first
+    df_skill = pd.DataFrame({
+        'skill': np.repeat(skills.index, 2),
+        'count': skills[['advantage', 'mandatory']].to_numpy().ravel(),
+        'mandatory': ['advantage', 'mandatory']*len(skills)})
     df_skill['percent_dec'] = 100*df_skill['count']/total_len
     df_skill['percent'] = df_skill['percent_dec'].round(1).astype(str) + '%'
     df_skill['total'] = df_skill.groupby('skill')['count'].transform('sum')
@@ -49,17 +48,10 @@ def generate_bar_chart(df_sel):
     )
     return fig
 
-def generate_line_chart(df_sel):
+@metrics.instrument_chart
+def generate_line_chart(sel):
     """ line chart new vacancies per week """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_dates = df_sel.loc[df_sel['first_online'] > '2024-01-14']
-    df_dates['week_num'] = df_dates['first_online'].dt.strftime('%U').astype(int)
-    df_dates.loc[df_dates['first_online'].dt.year == 2025, 'week_num'] += 52
-    df_dates.loc[df_dates['first_online'].dt.year == 2026, 'week_num'] += 104
-    df_dates = df_dates.groupby('week_num').agg(
-        jobs_count = ("url", "nunique"),
-        last_day_of_the_week = ("first_online", "max")
-    )
+    df_dates = sel.since('2024-01-15').weekly()
 
     fig = px.line(df_dates,
                   x="last_day_of_the_week",
@@ -76,18 +68,13 @@ def generate_line_chart(df_sel):
         tickformat="%Y-%m-%d")
     return fig
 
-def generate_line_chart_m(df_sel):
-    """ line chart new vacancies per week """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_dates = df_sel.loc[df_sel['first_online'] > '2024-01-31']
-    df_dates['month_num'] = df_dates['first_online'].dt.strftime('%m').astype(int)
-    df_dates.loc[df_dates['first_online'].dt.year == 2025, 'month_num'] += 12
-    df_dates.loc[df_dates['first_online'].dt.year == 2025, 'month_num'] += 24
-    df_dates = df_dates.groupby('month_num').agg(
-        jobs_count = ("url", "nunique"),
-        month = ("first_online", "min")
-    )
-    df_dates['month'] = df_dates['month'].dt.strftime('%b-%Y')
+@metrics.instrument_chart
+def generate_line_chart_m(sel):
+    """ line chart new vacancies per month """
+    df_dates = sel.since('2024-02-01').time_series('month_num')
+    # month_num counts months since January 1970
+    df_dates['month'] = pd.Series(df_dates.index.to_numpy().astype('datetime64[M]'),
+                                  index=df_dates.index).dt.strftime('%b-%Y')
 
     fig = px.line(df_dates,
                   x="month",
@@ -101,20 +88,23 @@ def generate_line_chart_m(df_sel):
     )
     return fig
 
-def generate_single_bar_en(df_sel):
-    """ single bar chart counting vacancies mentioning English language """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_sel['English'] = 0
-    df_sel.loc[df_sel['languages'].str.contains('English', na=False), 'English'] = 1
-    df_sel['x'] = 'English'
-    fig = px.histogram(df_sel,
-                       y='x',
-                       color='English',
-                       barnorm='percent',
-                       height=75,
-                       category_orders={"English": [0, 1]},
-                       )
+def generate_single_bar(label, counts):
+    """ single bar split into segments, one per category of counts, in percent of the total """
+    total = counts.sum()
+    fig = go.Figure([
+        go.Bar(
+            x=[100*count/total if total else 0],
+            y=[label],
+            name=name,
+            orientation='h',
+            customdata=[count],
+            hovertemplate='<b>%{fullData.name}</b><br>' +
+                          'percent: %{x:.2f}%<br>' +
+                          'absolute: %{customdata}<extra></extra>'
+        ) for name, count in counts.items()])
     fig.update_layout(
+        barmode='stack',
+        height=75,
         yaxis_title=None,
         xaxis_title=None,
         showlegend=False,
@@ -123,78 +113,41 @@ def generate_single_bar_en(df_sel):
     fig.update_layout(margin={"t": 0, "b": 0, "r": 0})
     return fig
 
-def generate_single_bar_he(df_sel):
+@metrics.instrument_chart
+def generate_single_bar_en(sel):
+    """ single bar chart counting vacancies mentioning English language """
+    english = sel.summary.unique('lang_en')
+    counts = pd.Series({'No English': sel.summary.unique('rows') - english, 'English': english})
+    return generate_single_bar('English', counts)
+
+@metrics.instrument_chart
+def generate_single_bar_he(sel):
     """ single bar chart counting vacancies mentioning Hebrew language """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_sel['Hebrew'] = 0
-    df_sel.loc[df_sel['languages'].str.contains('Hebrew', na=False), 'Hebrew'] = 1
-    df_sel['x'] = 'Hebrew'
-    fig = px.histogram(df_sel,
-                       y='x',
-                       color='Hebrew',
-                       barnorm='percent',
-                       height=75,
-                       category_orders={"Hebrew": [0, 1]}
-                       )
-    fig.update_layout(
-        yaxis_title=None,
-        xaxis_title=None,
-        showlegend=False,
-    )
-    fig.update_xaxes(visible=False)
-    fig.update_layout(margin={"t": 0, "b": 0, "r": 0})
-    return fig
+    hebrew = sel.summary.unique('lang_he')
+    counts = pd.Series({'No Hebrew': sel.summary.unique('rows') - hebrew, 'Hebrew': hebrew})
+    return generate_single_bar('Hebrew', counts)
 
-def generate_single_bar_degree(df_sel):
+@metrics.instrument_chart
+def generate_single_bar_degree(sel):
     """ single bar chart counting vacancies mentioning a degree """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_sel['edu'] = 'No Degree Requirements'
-    df_sel.loc[df_sel['education'].str.contains('Ph.D.', na=False), 'edu'] = 'Ph.D.'
-    df_sel.loc[df_sel['education'].str.contains('MBA', na=False), 'edu'] = 'MBA'
-    df_sel.loc[df_sel['education'].str.contains('M.Sc.', na=False), 'edu'] = 'M.Sc.'
-    df_sel.loc[df_sel['education'].str.contains('B.Sc.', na=False), 'edu'] = 'B.Sc.'
-    df_sel['x'] = 'Degree'
-    fig = px.histogram(df_sel,
-                       y='x',
-                       color='edu',
-                       barnorm='percent',
-                       height=75,
-                       category_orders={"edu": ['No Degree Requirements', 'B.Sc.', 'M.Sc.', 'MBA', 'Ph.D.']}
-                       )
-    fig.update_layout(
-        yaxis_title=None,
-        xaxis_title=None,
-        showlegend=False,
-    )
-    fig.update_xaxes(visible=False)
-    fig.update_layout(margin={"t": 0, "b": 0, "r": 0})
-    return fig
+    counts = sel.summary.counts('degree', unique_only=True)
+    counts = counts.reindex(['No Degree Requirements', 'B.Sc.', 'M.Sc.', 'MBA', 'Ph.D.'],
+                            fill_value=0)
+    return generate_single_bar('Degree', counts)
 
-def generate_single_bar_recruter(df_sel):
+@metrics.instrument_chart
+def generate_single_bar_recruter(sel):
     """ single bar chart counting vacancies of recruiter companies """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_sel['recr'] = 'Recruiter Company'
-    df_sel.loc[df_sel['is_direct'] == 1, 'recr'] = 'Direct Employer'
-    df_sel['x'] = 'Is Direct'
-    fig = px.histogram(df_sel,
-                       y='x',
-                       color='recr',
-                       barnorm='percent',
-                       height=75,
-                       )
-    fig.update_layout(
-        yaxis_title=None,
-        xaxis_title=None,
-        showlegend=False,
-    )
-    fig.update_xaxes(visible=False)
-    fig.update_layout(margin={"t": 0, "b": 0, "r": 0})
-    return fig
+    direct = sel.summary.unique('is_direct')
+    counts = pd.Series({'Direct Employer': direct,
+                        'Recruiter Company': sel.summary.unique('rows') - direct})
+    return generate_single_bar('Is Direct', counts)
 
-def generate_pie_cloud(df_sel):
+@metrics.instrument_chart
+def generate_pie_cloud(sel):
     """ pie chart for cloud skills """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_pie = df_sel.groupby('cloud_skills', as_index=False).agg(jobs_count = ("url", "nunique"))
+    df_pie = sel.summary.counts('cloud_skills', unique_only=True, distinct_urls=True)
+    df_pie = df_pie.rename('jobs_count').reset_index()
     fig = px.pie(df_pie,
                  values='jobs_count',
                  names='cloud_skills',
@@ -204,10 +157,11 @@ def generate_pie_cloud(df_sel):
     fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
     return fig
 
-def generate_pie_viz(df_sel):
+@metrics.instrument_chart
+def generate_pie_viz(sel):
     """ pie chart for visualization skills """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_pie = df_sel.groupby('viz_tools', as_index=False).agg(jobs_count = ("url", "nunique"))
+    df_pie = sel.summary.counts('viz_tools', unique_only=True, distinct_urls=True)
+    df_pie = df_pie.rename('jobs_count').reset_index()
     fig = px.pie(df_pie,
                  values='jobs_count',
                  names='viz_tools',
@@ -217,9 +171,11 @@ def generate_pie_viz(df_sel):
     fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
     return fig
 
-def generate_pie_district(df_sel):
+@metrics.instrument_chart
+def generate_pie_district(sel):
     """ pie chart for job locations by district """
-    df_pie = df_sel.groupby('district', as_index=False).agg(jobs_count = ("url", "nunique"))
+    df_pie = sel.summary.counts('district', unique_only=False, distinct_urls=True)
+    df_pie = df_pie.rename('jobs_count').reset_index()
     fig = px.pie(df_pie,
                  values='jobs_count',
                  names='district',
@@ -229,11 +185,13 @@ def generate_pie_district(df_sel):
     fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
     return fig
 
-def generate_bar_chart_companies(df_sel):
+@metrics.instrument_chart
+def generate_bar_chart_companies(sel):
     """ bar chart for largest employer companies """
-    df_sel = df_sel.loc[df_sel['is_unique_text'] > 0]
-    df_sel = df_sel.loc[df_sel['is_direct'] > 0]
-    df_emp = df_sel['company'].value_counts()[:15].reset_index().sort_values('count')
+    counts = top_counts(sel.value_counts('company', 'is_unique_text', 'is_direct'), 15)
+    # the largest bar on top
+    df_emp = counts.iloc[::-1].reset_index()
+    df_emp['company'] = df_emp['company'].astype(str)
     fig = px.bar(df_emp,
                  x='count',
                  y='company',
@@ -245,3 +203,54 @@ def generate_bar_chart_companies(df_sel):
         showlegend=False
     )
     return fig
+
+@metrics.instrument_chart
+def generate_skill_heatmap(sel, mention='any'):
+    """ heatmap of the most mentioned skills, in percent of the vacancies of the row skill
+     mentioning the column skill as well """
+    pairs = sel.cooccurrence(mention)
+    mentions = pd.Series(np.diag(pairs), index=pairs.index)
+    skills = list(top_counts(mentions, 20).index)
+    counts = pairs.loc[skills, skills].to_numpy()
+    percent = 100*counts / np.maximum(counts.diagonal(), 1)[:, None]
+    np.fill_diagonal(percent, np.nan)
+    fig = go.Figure(go.Heatmap(
+        z=percent,
+        x=skills,
+        y=skills,
+        customdata=counts,
+        colorscale='Blues',
+        hovertemplate='<b>%{y}</b> with <b>%{x}</b><br>' +
+                      'percent: %{z:.1f}%<br>' +
+                      'absolute: %{customdata}<extra></extra>'
+        ))
+    fig.update_layout(
+        title='Skills Asked for Together',
+        yaxis={'autorange': 'reversed'},
+        margin={"l": 0, "r": 0},
+    )
+    return fig
+
+@metrics.instrument_chart
+def generate_paired_skills(sel, skill='Snowflake', mention='any'):
+    """ bar chart of the skills mentioned most often together with skill,
+     in percent of its vacancies """
+    pairs = sel.cooccurrence(mention)
+    if skill in pairs.index:
+        counts, total = pairs.loc[skill].drop(skill), pairs.at[skill, skill]
+    else:
+        counts, total = pd.Series(0, index=pairs.columns), 0
+    df_pairs = top_counts(counts.rename('count'), 15).iloc[::-1].reset_index()
+    df_pairs['percent'] = 100*df_pairs['count'] / max(total, 1)
+    fig = px.bar(df_pairs,
+                 x='percent',
+                 y='paired_skill',
+                 hover_data={'count': True},
+                 )
+    fig.update_layout(
+        title=f"Skills Often Paired with {skill}",
+        yaxis_title=None,
+        xaxis_title=None,
+        showlegend=False
+    )
+    return fig
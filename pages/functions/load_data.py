@@ -0,0 +1,315 @@
+""" Typed loader for the main dataframe with an on-disk Parquet snapshot cache.
+
+Scrape batches can be ingested on top of the snapshot without parsing the full csv
+again: each batch is parsed once and stored as a small delta snapshot, and loading
+upserts the deltas into the snapshot by url, see merge_delta. """
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from pages.functions.shared_store import SHARED_DATASET, SharedStore
+
+logger = logging.getLogger(__name__)
+
+# csv files scraped from indeed, the first existing path is used
+DATA_PATHS = ['/home/local/to_analysis.csv', 'to_analysis_indeed.csv']
+
+# folder for parquet snapshots of the parsed csv
+SNAPSHOT_DIR = os.environ.get('DATA_SNAPSHOT_DIR', 'data_snapshots')
+# changes whenever derived columns change, so older snapshots are not reused
+SNAPSHOT_FORMAT = 4
+
+DATE_COLUMNS = ['first_online', 'last_online']
+CATEGORY_COLUMNS = ['job_type', 'district', 'company', 'cloud_skills', 'viz_tools',
+                    'languages', 'education']
+TYPE_COLUMNS = ['type_ds', 'type_da', 'type_de', 'type_bi', 'type_aiml']
+FLAG_COLUMNS = ['is_direct', 'is_unique_text']
+OTHER_COLUMNS = {'url': 'object', 'min_experience': 'float64'}
+
+# csv columns the pages do not use
+UNUSED_COLUMNS = ['extra_text']
+# columns added by parse_csv and add_derived_columns
+DERIVED_COLUMNS = ['day_diff', 'week_num', 'month_num', 'lang_en', 'lang_he', 'degree',
+                   'url_code']
+
+# dtypes used while parsing the csv, int8 columns are converted after parsing
+# because the raw csv may contain missing values
+READ_DTYPES = {**{col: 'category' for col in CATEGORY_COLUMNS},
+               **{col: 'float32' for col in TYPE_COLUMNS + FLAG_COLUMNS},
+               **OTHER_COLUMNS}
+INT8_COLUMNS = TYPE_COLUMNS + FLAG_COLUMNS
+USED_COLUMNS = DATE_COLUMNS + list(READ_DTYPES)
+
+# degree levels, a vacancy gets the last matching level of the list
+DEGREE_LEVELS = ['No Degree Requirements', 'Ph.D.', 'MBA', 'M.Sc.', 'B.Sc.']
+
+# durations of the loading stages of the last load_dataset call, in seconds
+load_timings = {}
+
+
+def find_data_file(paths=None):
+    ''' returns the first existing csv path '''
+    for path in paths or DATA_PATHS:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"none of the data files exist: {paths or DATA_PATHS}")
+
+
+def source_key(csv_path):
+    ''' key of the csv file content, made of its sha1 hash and modification time '''
+    sha = hashlib.sha1()
+    with open(csv_path, 'rb') as csv_file:
+        for chunk in iter(lambda: csv_file.read(1 << 20), b''):
+            sha.update(chunk)
+    return f"{sha.hexdigest()[:16]}-{os.stat(csv_path).st_mtime_ns}"
+
+
+def skill_columns(columns):
+    ''' skill columns among the columns of the csv or of the main dataframe: all the columns
+     not listed above, in their order. A skill is 0 when not mentioned, 1 as an advantage and
+     2 as a requirement, see skill_engine.py '''
+    known = set(USED_COLUMNS + UNUSED_COLUMNS + DERIVED_COLUMNS)
+    return [col for col in columns if col not in known]
+
+
+def parse_csv(csv_path):
+    ''' parses the csv with explicit dtypes, keeping only columns used by the pages '''
+    skills = skill_columns(pd.read_csv(csv_path, nrows=0).columns)
+    df = pd.read_csv(csv_path,
+                     usecols=lambda col: col in USED_COLUMNS or col in skills,
+                     dtype={**READ_DTYPES, **{skill: 'float32' for skill in skills}},
+                     parse_dates=DATE_COLUMNS)
+    for col in INT8_COLUMNS + skills:
+        if col in df:
+            df[col] = df[col].fillna(0).astype('int8')
+    df['day_diff'] = (df['last_online'] - df['first_online']).dt.days
+    add_derived_columns(df)
+    return df
+
+
+def contains(series, pattern):
+    ''' str.contains for a categorical column, evaluated once per category '''
+    matches = series.cat.categories.to_series().str.contains(pattern).to_numpy()
+    codes = series.cat.codes.to_numpy()
+    return (codes >= 0) & matches[codes]
+
+
+def add_derived_columns(df):
+    ''' flags and buckets used by the aggregation cube and the charts '''
+    days = df['first_online'].to_numpy().astype('datetime64[D]')
+    # weeks start on Sunday like strftime('%U'), 1970-01-01 was a Thursday
+    week_num = (days.astype('int64') + 4) // 7
+    df['week_num'] = np.where(np.isnat(days), -1, week_num).astype('int32')
+    # months since January 1970, so the ordinals keep increasing across years
+    month_num = days.astype('datetime64[M]').astype('int64')
+    df['month_num'] = np.where(np.isnat(days), -1, month_num).astype('int32')
+
+    df['lang_en'] = contains(df['languages'], 'English').astype('int8')
+    df['lang_he'] = contains(df['languages'], 'Hebrew').astype('int8')
+    degree = np.zeros(len(df), dtype='int8')
+    for code, level in enumerate(DEGREE_LEVELS[1:], start=1):
+        degree[contains(df['education'], level)] = code
+    df['degree'] = pd.Categorical.from_codes(degree, categories=DEGREE_LEVELS)
+
+    # integer code of the url (-1 when missing), distinct urls are counted by code
+    df['url_code'] = pd.factorize(df['url'])[0].astype('int32')
+    return df
+
+
+def snapshot_path(key, snapshot_dir=None):
+    ''' path of the parquet snapshot for a csv key '''
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR,
+                        f"to_analysis-v{SNAPSHOT_FORMAT}-{key}.parquet")
+
+
+def write_snapshot(df, path):
+    ''' writes the snapshot atomically and removes the snapshots and deltas of the same csv
+     key in other formats. Files of other keys are left alone, other csv files can share
+     the folder and workers may still be serving their versions '''
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    key = os.path.basename(path).removeprefix(f"to_analysis-v{SNAPSHOT_FORMAT}-")
+    key = key.removesuffix('.parquet')
+    for file_name in os.listdir(folder):
+        old_path = os.path.join(folder, file_name)
+        if old_path in (path, delta_folder(key, folder)):
+            continue
+        if file_name.startswith('to_analysis-v') and file_name.endswith(f"-{key}.parquet"):
+            with contextlib.suppress(OSError):
+                os.remove(old_path)
+        elif file_name.startswith('deltas-v') and file_name.endswith(f"-{key}"):
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+def delta_folder(key, snapshot_dir=None):
+    ''' folder of the delta snapshots ingested on top of the snapshot of a csv key '''
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f"deltas-v{SNAPSHOT_FORMAT}-{key}")
+
+
+def list_deltas(key, snapshot_dir=None):
+    ''' names of the delta snapshots of a csv key, in ingestion order '''
+    folder = delta_folder(key, snapshot_dir)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder) if name.endswith('.parquet'))
+
+
+def read_delta(key, name, snapshot_dir=None):
+    ''' delta dataframe stored by write_delta '''
+    return pd.read_parquet(os.path.join(delta_folder(key, snapshot_dir), name))
+
+
+def write_delta(csv_path, key, snapshot_dir=None):
+    ''' parses a scrape batch and stores it after the deltas already ingested for the
+     csv key, returns the name of the delta snapshot '''
+    delta = parse_csv(csv_path)
+    folder = delta_folder(key, snapshot_dir)
+    os.makedirs(folder, exist_ok=True)
+    name = f"delta-{len(list_deltas(key, snapshot_dir)):05d}-{source_key(csv_path)}.parquet"
+    tmp_path = os.path.join(folder, f"{name}.{os.getpid()}.tmp")
+    delta.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, os.path.join(folder, name))
+    return name
+
+
+def dataset_version(key, deltas=()):
+    ''' version of a snapshot with its deltas applied '''
+    if not deltas:
+        return key
+    return f"{key}+{deltas[-1].removesuffix('.parquet')}"
+
+
+def dataset_attrs(csv_path, snapshot_dir=None):
+    ''' version attributes load_dataset sets on the dataframe of the csv with the deltas
+     ingested on top of it, without loading it '''
+    key = source_key(csv_path)
+    deltas = tuple(list_deltas(key, snapshot_dir))
+    return {'version': dataset_version(key, deltas), 'source_key': key, 'deltas': deltas,
+            'snapshot_dir': snapshot_dir or SNAPSHOT_DIR}
+
+
+def dataset_metadata(df):
+    ''' number of rows, publication date bounds (iso strings, None when missing), seniority
+     levels and skill columns of a dataframe, the query backends store them with their copy '''
+    first_day, last_day = df['first_online'].min(), df['first_online'].max()
+    return {'rows': len(df),
+            'first_day': None if pd.isna(first_day) else first_day.isoformat(),
+            'last_day': None if pd.isna(last_day) else last_day.isoformat(),
+            'job_types': list(df['job_type'].unique()),
+            'skills': skill_columns(df.columns)}
+
+
+def merge_delta(df, delta):
+    ''' upserts delta rows into df by url: rows of df with a url present in delta are
+     replaced by the delta rows, other delta rows are appended. Returns the merged dataframe
+     and the mask of the rows of df that were kept, which come first in the merged one '''
+    keep = ~df['url'].isin(delta['url'].dropna()).to_numpy()
+    kept = df.iloc[np.flatnonzero(keep)]
+    kept_columns, added_columns = {}, {}
+    for col in df.columns:
+        kept_col = kept[col]
+        added = delta[col] if col in delta else pd.Series(index=delta.index, dtype='float64')
+        if isinstance(kept_col.dtype, pd.CategoricalDtype):
+            # sorted categories like the ones of a parsed csv, existing codes are remapped
+            categories = kept_col.cat.categories.union(added.dropna().unique())
+            if not categories.equals(kept_col.cat.categories):
+                kept_col = kept_col.cat.set_categories(categories)
+        elif kept_col.dtype == 'int8':
+            added = added.fillna(0)
+        elif col == 'url_code':
+            # the urls of delta are not in kept, their codes follow the codes of df
+            added = added.where(added < 0, added + int(df[col].to_numpy().max(initial=-1)) + 1)
+        kept_columns[col] = kept_col
+        added_columns[col] = added.astype(kept_col.dtype)
+    merged = pd.concat([pd.DataFrame(kept_columns, copy=False), pd.DataFrame(added_columns)],
+                       ignore_index=True)
+    return merged, keep
+
+
+def shared_folder(key, snapshot_dir=None):
+    ''' folder of the memory-mapped files for a csv key '''
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f"shared-v{SNAPSHOT_FORMAT}-{key}")
+
+
+def read_dataset(csv_path, path, use_snapshot=True):
+    ''' reads the parquet snapshot at path, or parses the csv and writes the snapshot '''
+    if use_snapshot and os.path.exists(path):
+        stage_start = time.perf_counter()
+        try:
+            df = pd.read_parquet(path)
+            load_timings['read_snapshot'] = time.perf_counter() - stage_start
+            return df
+        except (ImportError, OSError, ValueError) as err:
+            logger.warning("could not read snapshot %s: %s", path, err)
+
+    stage_start = time.perf_counter()
+    df = parse_csv(csv_path)
+    load_timings['parse_csv'] = time.perf_counter() - stage_start
+    if use_snapshot:
+        stage_start = time.perf_counter()
+        try:
+            write_snapshot(df, path)
+            load_timings['write_snapshot'] = time.perf_counter() - stage_start
+        except (ImportError, OSError) as err:
+            logger.warning("could not write snapshot %s: %s", path, err)
+    return df
+
+
+def map_shared(version, build, snapshot_dir=None):
+    ''' dataframe of a dataset version mapped from the shared folder, build() returns it
+     when no worker wrote the folder yet '''
+    store = SharedStore(shared_folder(version, snapshot_dir))
+    df = store.frame(build)
+    df.attrs['shared_folder'] = store.folder
+    store.remove_other_versions()
+    return df
+
+
+def load_dataset(csv_path=None, snapshot_dir=None, use_snapshot=True, shared=SHARED_DATASET,
+                 deltas=None):
+    ''' loads the main dataframe, reusing the parquet snapshot when the csv did not change
+     and applying the deltas ingested on top of it, or the given ones.
+     With shared=True the dataframe is a read-only view of a memory-mapped file
+     shared by all workers, see shared_store.py '''
+    load_timings.clear()
+    start = time.perf_counter()
+    csv_path = csv_path or find_data_file()
+    key = source_key(csv_path)
+    path = snapshot_path(key, snapshot_dir)
+    if deltas is None:
+        deltas = list_deltas(key, snapshot_dir) if use_snapshot else []
+    version = dataset_version(key, deltas)
+    load_timings['hash'] = time.perf_counter() - start
+
+    def build():
+        df = read_dataset(csv_path, path, use_snapshot)
+        if deltas:
+            stage_start = time.perf_counter()
+            for name in deltas:
+                df, _ = merge_delta(df, read_delta(key, name, snapshot_dir))
+            load_timings['merge_deltas'] = time.perf_counter() - stage_start
+        return df
+
+    if shared:
+        # the first worker also reads the snapshot or the csv to write the shared file
+        stage_start = time.perf_counter()
+        df = map_shared(version, build, snapshot_dir)
+        load_timings['map_shared'] = time.perf_counter() - stage_start
+    else:
+        df = build()
+
+    df.attrs.update(version=version, source_key=key, deltas=tuple(deltas),
+                    snapshot_dir=snapshot_dir or SNAPSHOT_DIR)
+    load_timings['total'] = time.perf_counter() - start
+    logger.info("loaded %s rows from %s in %s", f"{len(df):,d}", csv_path,
+                ", ".join(f"{stage} {sec:.3f}s" for stage, sec in load_timings.items()))
+    return df
@@ -0,0 +1,172 @@
+""" Latency, row count and payload histograms of the page callbacks, served on /metrics.
+
+Callbacks decorated with instrument_callback record their duration and, for a sample
+of the calls, the json size of every output. Inside them, chart functions decorated with instrument_chart record
+their duration, and stage() splits the time into filter, aggregate and figure stages.
+Stage durations are exclusive: time spent in a nested stage is not counted twice.
+Set SLOW_CALLBACK_SECONDS to log the callbacks slower than that with their inputs. """
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import random
+import threading
+import time
+
+from plotly.io.json import to_json_plotly
+
+logger = logging.getLogger(__name__)
+
+# callbacks slower than this are logged with their inputs, 0 disables the log
+SLOW_CALLBACK_SECONDS = float(os.environ.get('SLOW_CALLBACK_SECONDS', 0))
+# share of callback calls whose outputs are serialized to measure their size,
+# serializing all outputs of the home page adds about 8% to its callback
+PAYLOAD_SAMPLE_RATE = float(os.environ.get('METRICS_PAYLOAD_SAMPLE_RATE', 0.1))
+
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+BYTES_BUCKETS = [1_000, 3_000, 10_000, 30_000, 100_000, 300_000, 1_000_000, 3_000_000, 10_000_000]
+ROWS_BUCKETS = [10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+class Histogram:
+    ''' prometheus style histogram, one series of bucket counts per label values '''
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        ''' adds a value to the series of the labels '''
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._series.get(key, ([0]*(len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self):
+        ''' lines of the text exposition format '''
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), total)
+                            for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            labels = ','.join(f'{name}="{value}"' for name, value in key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+callback_seconds = Histogram('dash_callback_seconds', 'Duration of page callbacks.',
+                             SECONDS_BUCKETS)
+stage_seconds = Histogram('dash_stage_seconds',
+                          'Exclusive duration of the filter, aggregate and figure stages.',
+                          SECONDS_BUCKETS)
+chart_seconds = Histogram('dash_chart_seconds', 'Duration of chart functions.', SECONDS_BUCKETS)
+output_bytes = Histogram('dash_output_bytes', 'Json size of callback outputs.', BYTES_BUCKETS)
+selected_rows = Histogram('dash_selected_rows', 'Rows of the aggregated selections.',
+                          ROWS_BUCKETS)
+histograms = [callback_seconds, stage_seconds, chart_seconds, output_bytes, selected_rows]
+
+
+def _reset_locks():
+    # locks held by other threads are never released in a forked process
+    for histogram in histograms:
+        histogram._lock = threading.Lock()  # pylint: disable=protected-access
+
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+# callback and open stages of the current thread
+_context = threading.local()
+
+
+def current_callback():
+    ''' name of the instrumented callback running in this thread, '' outside of callbacks '''
+    return getattr(_context, 'callback', '')
+
+
+@contextlib.contextmanager
+def stage(name):
+    ''' records the time spent in the block, minus the time of nested stages '''
+    stack = getattr(_context, 'stages', None)
+    if stack is None:
+        stack = _context.stages = []
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        stage_seconds.observe(elapsed - nested, callback=current_callback(), stage=name)
+        timings = getattr(_context, 'timings', None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed - nested
+
+
+def instrument_chart(func=None, *, detail=None):
+    ''' decorator of chart functions, times them as a figure stage labelled with the
+     function name and the value of the detail keyword argument when given '''
+    if func is None:
+        return functools.partial(instrument_chart, detail=detail)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        chart = func.__name__ if detail is None else f"{func.__name__}[{kwargs.get(detail)}]"
+        start = time.perf_counter()
+        with stage('figure'):
+            result = func(*args, **kwargs)
+        chart_seconds.observe(time.perf_counter() - start,
+                              callback=current_callback(), chart=chart)
+        return result
+    return wrapper
+
+
+def instrument_callback(name, output_names=()):
+    ''' decorator of dash callbacks, records their duration and the json size of every
+     output, named by output_names, for a sample of the calls. Slow calls are logged
+     with their inputs '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            _context.callback = name
+            _context.timings = {}
+            start = time.perf_counter()
+            try:
+                outputs = func(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                timings = _context.timings
+                _context.callback = ''
+                _context.timings = None
+            callback_seconds.observe(elapsed, callback=name)
+            if random.random() < PAYLOAD_SAMPLE_RATE:
+                for pos, output in enumerate(outputs):
+                    output_name = output_names[pos] if pos < len(output_names) else str(pos)
+                    output_bytes.observe(len(to_json_plotly(output)),
+                                         callback=name, output=output_name)
+            if 0 < SLOW_CALLBACK_SECONDS <= elapsed:
+                logger.warning("slow callback %s took %.3fs, stages %s, inputs %r", name, elapsed,
+                               {key: round(sec, 4) for key, sec in timings.items()}, args)
+            return outputs
+        return wrapper
+    return decorator
+
+
+def render():
+    ''' all histograms in the prometheus text exposition format '''
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
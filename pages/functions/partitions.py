@@ -0,0 +1,161 @@
+""" Monthly partitions of a dataset version, loaded when a query needs them.
+
+A version is stored as one parquet file per month of first_online, with rows sorted
+by publication day, and partitions.json with the metadata of the dataset and the
+month, first and last day, number of rows and seniority levels of every file. The
+dataset is opened from that file alone. Queries skip the partitions whose days are
+outside of their date range or without the selected seniority levels, and read the
+others one at a time through a bounded LRU cache shared by all versions
+(PARTITION_CACHE_SIZE partitions), so a short date range costs the same however long
+the history is, and the memory of a query does not grow with it. """
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from pages.functions.figure_cache import register_cache
+
+# number of loaded partitions kept in memory, about one per month of history
+PARTITION_CACHE_SIZE = int(os.environ.get('PARTITION_CACHE_SIZE', 24))
+METADATA_FILE = 'partitions.json'
+
+
+def write_partitions(table, folder, metadata):
+    ''' writes the rows of a table sorted by day as monthly parquet files in a new folder,
+     with the metadata dictionary of the dataset, which lists the skill columns of the table.
+     Its date bounds are left out, they are the bounds of the partitions '''
+    os.makedirs(folder)
+    months = table['month_num'].to_numpy()
+    bounds = np.flatnonzero(np.diff(months)) + 1
+    partitions = []
+    for start, end in zip(np.append(0, bounds), np.append(bounds, len(table))):
+        if start == end:
+            continue
+        part = table.iloc[start:end]
+        month = str(np.datetime64(int(months[start]), 'M'))
+        file_name = f"month-{month}.parquet"
+        part.to_parquet(os.path.join(folder, file_name), index=False)
+        partitions.append({'month': month, 'file': file_name, 'rows': int(end - start),
+                           'first_day': str(np.datetime64(int(part['day'].iloc[0]), 'D')),
+                           'last_day': str(np.datetime64(int(part['day'].iloc[-1]), 'D')),
+                           'job_types': np.unique(part['job_type']).tolist()})
+    metadata = {name: value for name, value in metadata.items()
+                if name not in ('first_day', 'last_day')}
+    with open(os.path.join(folder, METADATA_FILE), 'w', encoding='utf-8') as metadata_file:
+        json.dump({**metadata, 'partitions': partitions}, metadata_file, indent=1)
+
+
+class PartitionCache:
+    ''' least recently used partitions of all dataset versions, at most maxsize of them '''
+
+    def __init__(self, maxsize=PARTITION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        ''' cached partition of key, load() reads it on a miss '''
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = load()
+        if self.maxsize > 0:
+            with self._lock:
+                self._items[key] = value
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        ''' removes all loaded partitions '''
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        ''' counters used to size the cache '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._items),
+                    'maxsize': self.maxsize,
+                    'bytes': sum(values.nbytes for columns in self._items.values()
+                                 for values in columns.values())}
+
+
+# reported on /cache-stats and emptied after a dataset swap with the figure caches
+partition_cache = register_cache('partitions', PartitionCache())
+
+
+# opened versions, their read locks are replaced in forked processes
+_opened = weakref.WeakSet()
+
+
+class Partitions:
+    ''' partition files of one dataset version. The files are memory-mapped when the
+     version is opened, so they stay readable after a newer version removed them '''
+
+    def __init__(self, folder):
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+        self.folder = folder
+        with open(os.path.join(folder, METADATA_FILE), encoding='utf-8') as metadata_file:
+            metadata = json.load(metadata_file)
+        self.metadata = metadata.pop('partitions')
+        self.skills = metadata['skills']
+        self.first_days = np.array([part['first_day'] for part in self.metadata],
+                                   dtype='datetime64[D]')
+        self.last_days = np.array([part['last_day'] for part in self.metadata],
+                                  dtype='datetime64[D]')
+        # seniority level codes with rows in each partition, -1 for missing values
+        self.job_types = [set(part['job_types']) for part in self.metadata]
+        # metadata of the dataset, see load_data.dataset_metadata
+        self.dataset = {**metadata,
+                        'first_day': str(self.first_days[0]) if self.metadata else None,
+                        'last_day': str(self.last_days[-1]) if self.metadata else None}
+        self._files = [pa.memory_map(os.path.join(folder, part['file']))
+                       for part in self.metadata]
+        self._lock = threading.Lock()
+        _opened.add(self)
+
+    def overlapping(self, start_day, end_day, job_types=None):
+        ''' positions of the partitions with rows published between the two days, and with
+         rows of one of the seniority level codes when they are given '''
+        positions = np.flatnonzero((self.first_days <= end_day) & (self.last_days >= start_day))
+        if job_types is None:
+            return positions
+        return [position for position in positions
+                if not self.job_types[position].isdisjoint(job_types)]
+
+    def load(self, position):
+        ''' columns of a partition as numpy arrays, the skill values as one matrix '''
+        return partition_cache.get((self.folder, position), lambda: self._read(position))
+
+    def _read(self, position):
+        from pyarrow import parquet  # pylint: disable=import-outside-toplevel
+
+        # a memory-mapped file has one read position, reads of a version take turns
+        with self._lock:
+            df = parquet.read_table(self._files[position]).to_pandas()
+        columns = {col: df[col].to_numpy() for col in df.columns if col not in self.skills}
+        columns['min_experience'] = df['min_experience'].to_numpy(dtype='float64',
+                                                                  na_value=np.nan)
+        columns['skills'] = np.ascontiguousarray(df[self.skills].to_numpy(dtype='int8'))
+        return columns
+
+
+def _reset_locks():
+    # a read of another thread holds its lock, never released in a forked process
+    for partitions in _opened:
+        partitions._lock = threading.Lock()  # pylint: disable=protected-access
+
+
+os.register_at_fork(after_in_child=_reset_locks)
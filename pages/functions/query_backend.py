@@ -0,0 +1,589 @@
+""" Query backends computing the aggregates of a Selection.
+
+The pandas backend, the default, answers from the aggregation cube, the filter index
+and the main dataframe kept in the memory of every worker. The duckdb and sqlite
+backends store each dataset version as one table of an embedded database file in
+the snapshot folder, written once by the first worker, and push the filters and
+aggregations of the selections down to it as SQL. The partitions backend stores it as
+monthly parquet files and aggregates only the months overlapping the date range of a
+selection, see partitions.py. Workers using them do not build the cube, filter masks
+and skill matrix, nor load the dataframe: the stored copy also holds the metadata of the
+dataset (see load_data.dataset_metadata). QUERY_BACKEND selects the backend; all of
+them return the same summaries and frames, so the charts show the same numbers. """
+import contextlib
+import json
+import os
+import shutil
+import threading
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from pages.functions import metrics
+from pages.functions.cube import (CUBE_CATEGORIES, CUBE_FLAGS, CubeSummary, distinct_urls,
+                                  group_measures, period_starts, selection_urls, since_summaries)
+from pages.functions.load_data import (SNAPSHOT_DIR, SNAPSHOT_FORMAT, TYPE_COLUMNS,
+                                       dataset_metadata)
+from pages.functions.partitions import Partitions, write_partitions
+from pages.functions.shared_store import file_lock
+from pages.functions.skill_engine import (MENTION_VALUES, cooccurrence, cooccurrence_frame,
+                                          group_counts)
+
+try:
+    import duckdb
+except ImportError:  # only needed with QUERY_BACKEND=duckdb
+    duckdb = None
+
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas')
+
+# categorical columns of the sql table, stored as category codes (-1 for missing values)
+SQL_CATEGORIES = CUBE_CATEGORIES + ['company']
+# integer columns of the sql table, besides the categories and skills
+SQL_INTEGERS = ['week_num', 'month_num', 'is_unique_text', 'url_code'] + CUBE_FLAGS
+# scalar measures of CubeSummary as sql aggregates
+SQL_MEASURES = {'rows': 'count(*)',
+                'exp_sum': 'sum(coalesce(min_experience, 0))',
+                'exp_count': 'count(min_experience)',
+                **{col: f"sum({col})" for col in CUBE_FLAGS}}
+
+
+class PandasBackend:
+    ''' aggregates of the cube, filter index and main dataframe in memory '''
+
+    # the dataset builds its filter index, skill matrix and cube for this backend
+    in_memory = True
+
+    def __init__(self, data):
+        self.data = data
+
+    def summary(self, sel, measures=None):
+        ''' CubeSummary of the selection, with the given measures or all of them '''
+        return self.data.cube.summary(sel.job_types, sel.all_types, sel.start_day,
+                                      sel.end_day, measures)
+
+    def last_days(self, sel):
+        ''' latest publication dates of the selection, split by is_unique_text '''
+        return self.data.cube.last_days(sel.job_types, sel.all_types, sel.start_day,
+                                        sel.end_day)
+
+    def periods(self, sel, first_days, measures=None):
+        ''' CubeSummary of the selection since each of first_days '''
+        return self.data.cube.periods(sel.job_types, sel.all_types, sel.start_day,
+                                      sel.end_day, first_days, measures)
+
+    def weekly(self, sel):
+        ''' unique urls and latest publication date per week '''
+        return self.data.cube.weekly(sel.job_types, sel.all_types, sel.start_day, sel.end_day)
+
+    def time_series(self, sel, bucket_column, unique_only=True):
+        ''' distinct urls, first and last day per bucket of a calendar column '''
+        cols = self.data.cube.columns
+        rows = sel.rows
+        if unique_only:
+            rows = rows[cols['is_unique_text'][rows] > 0]
+        with metrics.stage('aggregate'):
+            return bucket_series(bucket_column, cols[bucket_column][rows],
+                                 cols['url_code'][rows], cols['day'][rows])
+
+    def value_counts(self, sel, column, flags=()):
+        ''' selected rows per category of a column, among the rows with all flags set '''
+        df = self.data.df
+        rows = sel.rows
+        for flag in flags:
+            rows = rows[df[flag].to_numpy()[rows] > 0]
+        with metrics.stage('aggregate'):
+            codes = df[column].cat.codes.to_numpy()[rows]
+            categories = df[column].cat.categories
+            return category_counts(column, categories, np.bincount(
+                codes[codes >= 0].astype('int64'), minlength=len(categories)))
+
+    def cooccurrence(self, sel, mention='any'):
+        ''' vacancies with a unique text mentioning each pair of skills '''
+        rows = sel.rows
+        rows = rows[self.data.cube.columns['is_unique_text'][rows] > 0]
+        with metrics.stage('aggregate'):
+            return self.data.skill_matrix.cooccurrence(rows, mention)
+
+
+def bucket_series(bucket_column, buckets, url_codes, days):
+    ''' frame of Selection.time_series from the bucket, url code and day of the selected
+     rows, urls are counted once per bucket. Rows without a bucket (-1) are left out '''
+    buckets = np.asarray(buckets).astype('int64')
+    known = buckets >= 0
+    buckets, days = buckets[known], np.asarray(days)[known].astype('int64')
+    first_bucket = buckets.min() if len(buckets) else 0
+    positions = buckets - first_bucket
+    n_buckets = positions.max() + 1 if len(positions) else 0
+    first_day = np.full(n_buckets, np.iinfo('int64').max)
+    last_day = np.full(n_buckets, np.iinfo('int64').min)
+    np.minimum.at(first_day, positions, days)
+    np.maximum.at(last_day, positions, days)
+    present = np.bincount(positions, minlength=n_buckets) > 0
+    counts = distinct_urls(positions, np.asarray(url_codes)[known], n_buckets)
+    return time_series_frame(bucket_column, np.flatnonzero(present) + first_bucket,
+                             counts[present], first_day[present], last_day[present])
+
+
+def time_series_frame(bucket_column, buckets, counts, first_days, last_days):
+    ''' frame of Selection.time_series from arrays of buckets and their int64 days '''
+    return pd.DataFrame(
+        {'jobs_count': np.asarray(counts).astype('int64'),
+         'first_day': np.asarray(first_days, dtype='int64').astype('datetime64[D]')
+         .astype('datetime64[ns]'),
+         'last_day': np.asarray(last_days, dtype='int64').astype('datetime64[D]')
+         .astype('datetime64[ns]')},
+        index=pd.Index(np.asarray(buckets, dtype='int64'), name=bucket_column))
+
+
+def category_counts(column, categories, counts):
+    ''' counts of every category in category order, like Series.value_counts before sorting '''
+    return pd.Series(np.asarray(counts, dtype='int64'), index=pd.Index(categories, name=column),
+                     name='count')
+
+
+def quote(name):
+    ''' sql identifier of a column name, skill names have spaces and slashes '''
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_frame(df, categories, skills):
+    ''' rows of the sql table: rows with a publication day, sorted by it, with days since
+     1970, category codes and the skill values of skill_engine.SkillMatrix '''
+    days = df['first_online'].to_numpy().astype('datetime64[D]')
+    rows = np.flatnonzero(~np.isnat(days))
+    rows = rows[np.argsort(days[rows], kind='stable')]
+    table = {'day': days[rows].astype('int64')}
+    for col in categories:
+        table[col] = df[col].cat.codes.to_numpy()[rows].astype('int32')
+    for col in SQL_INTEGERS + [col for col in TYPE_COLUMNS if col in df]:
+        table[col] = df[col].to_numpy()[rows].astype('int32')
+    # nullable, so missing values are stored as NULL and not as NaN
+    table['min_experience'] = pd.array(df['min_experience'].to_numpy(dtype='float64')[rows],
+                                       dtype='Float64')
+    for skill in skills:
+        table[skill] = df[skill].to_numpy(dtype='int8')[rows].clip(0, 2)
+    return pd.DataFrame(table)
+
+
+class StoredBackend:
+    ''' aggregates of a copy of the dataset version stored in the snapshot folder, see
+     table_frame, written by the first worker that needs it with the metadata of the
+     dataset. Subclasses write and open it, and aggregate the measures of a selection per
+     period and is_unique_text '''
+
+    in_memory = False
+    # file name suffix of the stored versions
+    suffix = None
+
+    def __init__(self, data):
+        self.path = os.path.join(data.snapshot_dir or SNAPSHOT_DIR,
+                                 f"jobs-v{SNAPSHOT_FORMAT}-{data.version}.{self.suffix}")
+        self._write_once(data.load)
+        # opened before older versions are removed, to keep this one readable while it is used
+        self._open()
+        self.metadata = self._read_metadata()
+        self.categories = self.metadata['categories']
+        self.job_types = self.categories['job_type']
+        self.skills = self.metadata['skills']
+        self.type_columns = self.metadata['type_columns']
+        self._remove_other_versions()
+
+    def _write(self, table, metadata, path):
+        ''' stores the table and the metadata dictionary at a new path '''
+        raise NotImplementedError
+
+    def _open(self):
+        ''' opens the stored version for the queries of all threads '''
+        raise NotImplementedError
+
+    def _read_metadata(self):
+        ''' metadata dictionary stored with the version '''
+        raise NotImplementedError
+
+    def _aggregate(self, sel, starts, measures):
+        ''' measures of the selection split by period, starting at each of starts, and by
+         is_unique_text, as arrays of 2*len(starts) rows like the cube measures, and the
+         latest day of every group as int64 days '''
+        raise NotImplementedError
+
+    def _write_once(self, load):
+        ''' stores the version unless another worker already did, load() returns its
+         dataframe, which is not kept '''
+        if os.path.exists(self.path):
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with file_lock(f"{self.path}.lock"):
+            if not os.path.exists(self.path):
+                df = load()
+                metadata = {**dataset_metadata(df),
+                            'categories': {col: list(df[col].cat.categories)
+                                           for col in SQL_CATEGORIES},
+                            'type_columns': [col for col in TYPE_COLUMNS if col in df]}
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                self._write(table_frame(df, metadata['categories'], metadata['skills']),
+                            metadata, tmp_path)
+                os.replace(tmp_path, self.path)
+
+    def _remove_other_versions(self):
+        ''' deletes the stored versions of other datasets, workers reading them keep them open '''
+        folder = os.path.dirname(self.path) or '.'
+        name = os.path.basename(self.path)
+        for other in os.listdir(folder):
+            if other.startswith('jobs-') and other.endswith(f".{self.suffix}") and other != name:
+                shutil.rmtree(os.path.join(folder, other), ignore_errors=True)
+                for path in (other, f"{other}.lock"):
+                    with contextlib.suppress(OSError):
+                        os.remove(os.path.join(folder, path))
+
+    def _zeros(self, n_groups, measures):
+        ''' measures of n_groups empty groups '''
+        zeros = {}
+        for name in measures:
+            if name.startswith('rows_'):
+                shape = (n_groups, len(self.categories[name[5:]]))
+            elif name.startswith('skill_'):
+                shape = (n_groups, len(self.skills))
+            else:
+                shape = (n_groups,)
+            zeros[name] = np.zeros(shape, dtype='float64' if name == 'exp_sum' else 'int64')
+        return zeros
+
+    def _measures(self, measures):
+        ''' names of the requested measures, all of them by default '''
+        return list(measures or list(SQL_MEASURES) + ['skill_advantage', 'skill_mandatory'] +
+                    [f"rows_{col}" for col in CUBE_CATEGORIES])
+
+    def summary(self, sel, measures=None):
+        ''' CubeSummary of the selection, with the given measures or all of them '''
+        parts, max_day = self._aggregate(sel, [sel.start_day], self._measures(measures))
+        if 'rows' in parts:
+            metrics.selected_rows.observe(parts['rows'].sum(), callback=metrics.current_callback())
+        return CubeSummary(self, parts, max_day.astype('datetime64[D]'),
+                           partial(self.distinct_urls, sel))
+
+    def last_days(self, sel):
+        ''' latest publication dates of the selection, split by is_unique_text '''
+        _, max_day = self._aggregate(sel, [sel.start_day], [])
+        return max_day.astype('datetime64[D]')
+
+    def periods(self, sel, first_days, measures=None):
+        ''' CubeSummary of the selection since each of first_days, see Cube.periods '''
+        first_days = [np.datetime64(day, 'D') for day in first_days]
+        starts = period_starts(sel.start_day, sel.end_day, first_days)
+        parts, max_day = self._aggregate(sel, starts, self._measures(measures))
+        if 'rows' in parts:
+            metrics.selected_rows.observe(parts['rows'].sum(), callback=metrics.current_callback())
+        parts = {name: values.reshape((len(starts), 2) + values.shape[1:])
+                 for name, values in parts.items()}
+        return since_summaries(self, parts, max_day.reshape(len(starts), 2), starts,
+                               sel.end_day, first_days)
+
+    def distinct_urls(self, sel, column=None, unique_only=False):
+        ''' distinct urls of the selection per category of a column, or in total '''
+        raise NotImplementedError
+
+    def weekly(self, sel):
+        ''' unique urls and latest publication date per week '''
+        weekly = self.time_series(sel, 'week_num')
+        return weekly[['jobs_count', 'last_day']].rename(
+            columns={'last_day': 'last_day_of_the_week'})
+
+
+class SqlBackend(StoredBackend):
+    ''' aggregates pushed down as SQL to the jobs table of the dataset version in an
+     embedded database file. Subclasses open and write the database file '''
+
+    def _connect(self):
+        ''' read-only connection to the database file, usable from all threads '''
+        raise NotImplementedError
+
+    def _open(self):
+        # each server thread queries with a cursor of its own
+        self._connection = self._connect()
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _read_metadata(self):
+        return json.loads(self._query('SELECT value FROM metadata')[0][0])
+
+    def _query(self, sql, params=()):
+        ''' rows of a query on the cursor of the current thread '''
+        if self._pid != os.getpid():
+            # connections are not shared with forked processes, e.g. background callbacks
+            self._open()
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = self._connection.cursor()
+        return cursor.execute(sql, list(params)).fetchall()
+
+    def _where(self, sel, *conditions):
+        ''' where clause and parameters of the user controls of a selection '''
+        clauses = ['day BETWEEN ? AND ?'] + list(conditions)
+        params = [int(sel.start_day.astype('int64')), int(sel.end_day.astype('int64'))]
+        if sel.job_types:
+            codes = [self.job_types.index(value) for value in sel.job_types
+                     if value in self.job_types]
+            clauses.append(f"job_type IN ({', '.join('?'*len(codes))})" if codes else '1 = 0')
+            params.extend(codes)
+        if sel.all_types:
+            types = [quote(col) for col in sel.all_types if col in self.type_columns]
+            clauses.append(f"({' OR '.join(f'{col} > 0' for col in types)})" if types
+                           else '1 = 0')
+        return ' AND '.join(clauses), params
+
+    def _aggregate(self, sel, starts, measures):
+        n_groups = 2*len(starts)
+        # period of a row: number of period starts after the first one up to its day
+        period = ' + '.join(['0'] + ['CAST(day >= ? AS INTEGER)']*(len(starts) - 1))
+        group = f"2*({period}) + CAST(is_unique_text > 0 AS INTEGER)"
+        where, params = self._where(sel)
+        params = [int(day.astype('int64')) for day in starts[1:]] + params
+        scalars = [name for name in measures if name in SQL_MEASURES]
+        columns = [SQL_MEASURES[name] for name in scalars] + ['max(day)']
+        with_skills = 'skill_advantage' in measures or 'skill_mandatory' in measures
+        if with_skills:
+            columns += [f"count(CASE WHEN {quote(skill)} = {value} THEN 1 END)"
+                        for value in (1, 2) for skill in self.skills]
+
+        parts = self._zeros(n_groups, measures)
+        max_day = np.full(n_groups, np.iinfo('int64').min)
+        skills = np.zeros((n_groups, 2*len(self.skills)), dtype='int64')
+        with metrics.stage('aggregate'):
+            for row in self._query(f"SELECT {group} AS grp, {', '.join(columns)} FROM jobs "
+                                   f"WHERE {where} GROUP BY grp", params):
+                for name, value in zip(scalars, row[1:]):
+                    parts[name][row[0]] = value
+                max_day[row[0]] = row[len(scalars) + 1]
+                if with_skills:
+                    skills[row[0]] = row[len(scalars) + 2:]
+            if with_skills:
+                parts['skill_advantage'] = skills[:, :len(self.skills)]
+                parts['skill_mandatory'] = skills[:, len(self.skills):]
+
+            for col in CUBE_CATEGORIES:
+                if f"rows_{col}" not in measures:
+                    continue
+                for grp, code, n_rows in self._query(
+                        f"SELECT {group} AS grp, {col}, count(*) FROM jobs "
+                        f"WHERE {where} AND {col} >= 0 GROUP BY grp, {col}", params):
+                    parts[f"rows_{col}"][grp, code] = n_rows
+        return {name: parts[name] for name in measures}, max_day
+
+    def distinct_urls(self, sel, column=None, unique_only=False):
+        conditions = ['url_code >= 0'] + (['is_unique_text > 0'] if unique_only else [])
+        if column is None:
+            where, params = self._where(sel, *conditions)
+            with metrics.stage('aggregate'):
+                return self._query(f"SELECT count(DISTINCT url_code) FROM jobs WHERE {where}",
+                                   params)[0][0]
+        where, params = self._where(sel, f"{quote(column)} >= 0", *conditions)
+        counts = np.zeros(len(self.categories[column]), dtype='int64')
+        with metrics.stage('aggregate'):
+            for code, count in self._query(f"SELECT {quote(column)} AS code, "
+                                           f"count(DISTINCT url_code) FROM jobs "
+                                           f"WHERE {where} GROUP BY code", params):
+                counts[code] = count
+        return counts
+
+    def time_series(self, sel, bucket_column, unique_only=True):
+        ''' distinct urls, first and last day per bucket of a calendar column '''
+        conditions = [f"{quote(bucket_column)} >= 0"] + (['is_unique_text > 0']
+                                                          if unique_only else [])
+        where, params = self._where(sel, *conditions)
+        with metrics.stage('aggregate'):
+            rows = self._query(f"SELECT {quote(bucket_column)} AS bucket, "
+                               "count(DISTINCT CASE WHEN url_code >= 0 THEN url_code END), "
+                               f"min(day), max(day) FROM jobs WHERE {where} "
+                               f"GROUP BY bucket ORDER BY bucket", params)
+        return time_series_frame(bucket_column, *(zip(*rows) if rows else [[]]*4))
+
+    def value_counts(self, sel, column, flags=()):
+        ''' selected rows per category of a column, among the rows with all flags set '''
+        where, params = self._where(sel, f"{quote(column)} >= 0",
+                                    *(f"{quote(flag)} > 0" for flag in flags))
+        counts = np.zeros(len(self.categories[column]), dtype='int64')
+        with metrics.stage('aggregate'):
+            for code, count in self._query(f"SELECT {quote(column)} AS code, count(*) FROM jobs "
+                                           f"WHERE {where} GROUP BY code", params):
+                counts[code] = count
+        return category_counts(column, self.categories[column], counts)
+
+    def cooccurrence(self, sel, mention='any'):
+        ''' vacancies with a unique text mentioning each pair of skills, one sum per pair '''
+        where, params = self._where(sel, 'is_unique_text > 0')
+        condition = '> 0' if mention == 'any' else f"= {MENTION_VALUES[mention]}"
+        pairs = [(first, second) for first in range(len(self.skills))
+                 for second in range(first, len(self.skills))]
+        columns = [f"count(CASE WHEN {quote(self.skills[first])} {condition} "
+                   f"AND {quote(self.skills[second])} {condition} THEN 1 END)"
+                   for first, second in pairs]
+        counts = np.zeros((len(self.skills), len(self.skills)), dtype='int64')
+        with metrics.stage('aggregate'):
+            row = self._query(f"SELECT {', '.join(columns)} FROM jobs WHERE {where}", params)[0]
+        for (first, second), count in zip(pairs, row):
+            counts[first, second] = counts[second, first] = count
+        return cooccurrence_frame(self.skills, counts)
+
+
+class PartitionedBackend(StoredBackend):
+    ''' aggregates of the monthly partitions overlapping the date range of a selection,
+     loaded through the partition cache, see partitions.py '''
+
+    suffix = 'partitions'
+
+    def _write(self, table, metadata, path):
+        write_partitions(table, path, metadata)
+
+    def _open(self):
+        self.partitions = Partitions(self.path)
+
+    def _read_metadata(self):
+        return self.partitions.dataset
+
+    def _selected(self, sel):
+        ''' columns and selected row positions of every partition overlapping the
+         selection, rows of a partition are sorted by day so its date range is a slice.
+         Partitions are loaded one at a time, as the caller iterates over them '''
+        start_day, end_day = sel.start_day.astype('int64'), sel.end_day.astype('int64')
+        codes = None
+        if sel.job_types:
+            codes = [self.job_types.index(value) for value in sel.job_types
+                     if value in self.job_types]
+        for position in self.partitions.overlapping(sel.start_day, sel.end_day, codes):
+            with metrics.stage('load'):
+                columns = self.partitions.load(position)
+            with metrics.stage('filter'):
+                days = columns['day']
+                rows = np.arange(days.searchsorted(start_day, 'left'),
+                                 days.searchsorted(end_day, 'right'))
+                if codes is not None:
+                    rows = rows[np.isin(columns['job_type'][rows], codes)]
+                if sel.all_types:
+                    mask = np.zeros(len(rows), dtype=bool)
+                    for col in sel.all_types:
+                        if col in self.type_columns:
+                            mask |= columns[col][rows] > 0
+                    rows = rows[mask]
+            yield columns, rows
+
+    def _aggregate(self, sel, starts, measures):
+        n_groups = 2*len(starts)
+        starts = np.array(starts, dtype='datetime64[D]').astype('int64')
+        parts = self._zeros(n_groups, measures)
+        max_day = np.full(n_groups, np.iinfo('int64').min)
+        for columns, rows in self._selected(sel):
+            with metrics.stage('aggregate'):
+                days = columns['day'][rows]
+                groups = 2*(starts.searchsorted(days, 'right') - 1) \
+                    + (columns['is_unique_text'][rows] > 0)
+                np.maximum.at(max_day, groups, days)
+                if measures:
+                    values = group_measures(columns, self.categories,
+                                            partial(group_counts, columns['skills']),
+                                            rows, groups, n_groups)
+                    for name in measures:
+                        parts[name] += values[name]
+        return parts, max_day
+
+    def _concat(self, sel, names, *flags):
+        ''' selected values of some columns over the partitions, among the rows with all
+         flags set '''
+        values = {name: [] for name in names}
+        for columns, rows in self._selected(sel):
+            for flag in flags:
+                rows = rows[columns[flag][rows] > 0]
+            for name in names:
+                values[name].append(columns[name][rows])
+        return {name: np.concatenate(arrays) if arrays else np.array([], dtype='int64')
+                for name, arrays in values.items()}
+
+    def distinct_urls(self, sel, column=None, unique_only=False):
+        # a url can have rows in several partitions, they are counted over all of them
+        names = ['url_code'] + ([column] if column else [])
+        values = self._concat(sel, names, *(['is_unique_text'] if unique_only else []))
+        with metrics.stage('aggregate'):
+            return selection_urls(values, self.categories, np.arange(len(values['url_code'])),
+                                  column)
+
+    def time_series(self, sel, bucket_column, unique_only=True):
+        ''' distinct urls, first and last day per bucket of a calendar column '''
+        values = self._concat(sel, [bucket_column, 'url_code', 'day'],
+                              *(['is_unique_text'] if unique_only else []))
+        with metrics.stage('aggregate'):
+            return bucket_series(bucket_column, values[bucket_column], values['url_code'],
+                                 values['day'])
+
+    def value_counts(self, sel, column, flags=()):
+        ''' selected rows per category of a column, among the rows with all flags set '''
+        codes = self._concat(sel, [column], *flags)[column].astype('int64')
+        with metrics.stage('aggregate'):
+            return category_counts(column, self.categories[column], np.bincount(
+                codes[codes >= 0], minlength=len(self.categories[column])))
+
+    def cooccurrence(self, sel, mention='any'):
+        ''' vacancies with a unique text mentioning each pair of skills '''
+        counts = np.zeros((len(self.skills), len(self.skills)), dtype='int64')
+        for columns, rows in self._selected(sel):
+            with metrics.stage('aggregate'):
+                rows = rows[columns['is_unique_text'][rows] > 0]
+                counts += cooccurrence(columns['skills'], rows, mention)
+        return cooccurrence_frame(self.skills, counts)
+
+
+class DuckDBBackend(SqlBackend):
+    ''' SqlBackend on a DuckDB database file, read by the columns a query uses '''
+
+    suffix = 'duckdb'
+
+    def __init__(self, data):
+        if duckdb is None:
+            raise ImportError("QUERY_BACKEND=duckdb needs the duckdb package")
+        super().__init__(data)
+
+    def _write(self, table, metadata, path):
+        connection = duckdb.connect(path)
+        try:
+            connection.register('table_frame', table)
+            connection.execute('CREATE TABLE jobs AS SELECT * FROM table_frame')
+            connection.execute('CREATE TABLE metadata (value VARCHAR)')
+            connection.execute('INSERT INTO metadata VALUES (?)', [json.dumps(metadata)])
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return duckdb.connect(self.path, read_only=True)
+
+
+class SQLiteBackend(SqlBackend):
+    ''' SqlBackend on a SQLite database file, with an index on the publication day '''
+
+    suffix = 'sqlite'
+
+    def _write(self, table, metadata, path):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+        connection = sqlite3.connect(path)
+        try:
+            table.to_sql('jobs', connection, index=False, chunksize=10_000)
+            connection.execute('CREATE INDEX jobs_day ON jobs (day)')
+            connection.execute('CREATE TABLE metadata (value TEXT)')
+            connection.execute('INSERT INTO metadata VALUES (?)', [json.dumps(metadata)])
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+
+
+BACKENDS = {'pandas': PandasBackend, 'partitions': PartitionedBackend, 'duckdb': DuckDBBackend,
+            'sqlite': SQLiteBackend}
+
+
+def backend_class(name=None):
+    ''' backend class of a QUERY_BACKEND name '''
+    name = name or QUERY_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"unknown QUERY_BACKEND {name!r}, expected one of {list(BACKENDS)}")
+    return BACKENDS[name]
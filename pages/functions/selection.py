@@ -0,0 +1,161 @@
+""" Vacancies matching the user controls, passed to the chart functions """
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from pages.functions import metrics
+from pages.functions.cube import latest_day
+from pages.functions.dataset import current
+from pages.functions.figure_cache import canonical_key
+
+# number of recent user control combinations whose selections are kept
+SELECTION_CACHE_SIZE = int(os.environ.get('SELECTION_CACHE_SIZE', 64))
+
+
+def to_day(value):
+    ''' datetime64[D] of an iso string, date, timestamp or datetime64 value '''
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    elif value is pd.NaT:
+        return np.datetime64('NaT', 'D')
+    return np.datetime64(value, 'D')
+
+
+class Selection:
+    ''' user control values with lazily computed cube aggregates and rows.
+     Dates are inclusive, empty lists mean no filter. A selection keeps the dataset
+     version it was created with, the current one by default.
+     Callbacks running in parallel threads can share a selection, its aggregates
+     are computed once under a lock of the selection. They are computed by the query
+     backend of the dataset, see query_backend.py '''
+
+    def __init__(self, job_types=None, all_types=None, start_date=None, end_date=None,
+                 data=None):
+        self.data = data or current()
+        self.job_types = list(job_types or [])
+        self.all_types = list(all_types or [])
+        self.start_day = to_day(start_date if start_date is not None
+                                else self.data.first_day)
+        self.end_day = to_day(end_date if end_date is not None
+                              else self.data.last_day)
+        self._since = {}
+        self._summary = None
+        self._max_day = None
+        self._rows = None
+        self._cooccurrence = {}
+        self._lock = threading.RLock()
+
+    def since(self, first_day):
+        ''' the same selection without vacancies published before first_day '''
+        first_day = to_day(first_day)
+        if np.isnat(first_day):
+            # nothing is recent in an empty selection
+            first_day = self.end_day + 1
+        with self._lock:
+            if first_day not in self._since:
+                self._since[first_day] = Selection(self.job_types, self.all_types,
+                                                   max(self.start_day, first_day), self.end_day,
+                                                   self.data)
+            return self._since[first_day]
+
+    @property
+    def summary(self):
+        ''' aggregates of the selection, see cube.CubeSummary '''
+        with self._lock:
+            if self._summary is None:
+                self._summary = self.data.backend.summary(self)
+            return self._summary
+
+    def last_day(self, unique_only=False):
+        ''' latest publication date as a timestamp like summary.last_day, NaT when empty.
+         It does not aggregate the measures of the selection '''
+        with self._lock:
+            if self._summary is not None:
+                return self._summary.last_day(unique_only)
+            if self._max_day is None:
+                self._max_day = self.data.backend.last_days(self)
+            return pd.Timestamp(self._max_day[1] if unique_only else latest_day(self._max_day))
+
+    def periods(self, first_days, measures=None):
+        ''' summaries of the selection since each of first_days, aggregated in one pass.
+         Only the given measures are summed, all of them by default '''
+        return self.data.backend.periods(self, [to_day(day) for day in first_days], measures)
+
+    def weekly(self):
+        ''' unique vacancies and latest publication date per week '''
+        return self.data.backend.weekly(self)
+
+    def time_series(self, bucket_column, unique_only=True):
+        ''' distinct urls of the selected rows per bucket of an integer calendar column,
+         week_num or month_num, with the first and last publication day of each bucket.
+         Buckets without selected rows are left out '''
+        return self.data.backend.time_series(self, bucket_column, unique_only)
+
+    def value_counts(self, column, *flags):
+        ''' selected vacancies per category of a column in category order, counting only
+         the rows where all the flag columns are set. Sorted, they match value_counts '''
+        return self.data.backend.value_counts(self, column, flags)
+
+    def cooccurrence(self, mention='any'):
+        ''' vacancies with a unique text mentioning each pair of skills, as a frame of
+         skills by skills with the vacancies of each skill on its diagonal. mention is
+         'any', 'advantage' or 'mandatory' '''
+        with self._lock:
+            if mention not in self._cooccurrence:
+                self._cooccurrence[mention] = self.data.backend.cooccurrence(self, mention)
+            return self._cooccurrence[mention]
+
+    @property
+    def rows(self):
+        ''' positions of the selected rows in the main dataframe, with the pandas backend '''
+        with self._lock:
+            if self._rows is None:
+                with metrics.stage('filter'):
+                    self._rows = self.data.filter_index.select_days(
+                        self.job_types, self.all_types, self.start_day, self.end_day)
+            return self._rows
+
+
+# selection caches of the process, emptied in forked processes, see _forget_selections
+_selection_caches = weakref.WeakSet()
+
+
+class SelectionCache:
+    ''' recently used selections by user control values and dataset version, so the
+     callbacks computing different charts of the same controls share one selection '''
+
+    def __init__(self, maxsize=SELECTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        _selection_caches.add(self)
+
+    def get(self, job_types, all_types, start_date, end_date, data=None):
+        ''' shared selection of the user control values '''
+        data = data or current()
+        key = (data.version,) + canonical_key([job_types, all_types, start_date, end_date])
+        with self._lock:
+            sel = self._items.get(key)
+            if sel is None:
+                sel = self._items[key] = Selection(job_types, all_types,
+                                                   start_date, end_date, data)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+            return sel
+
+
+def _forget_selections():
+    # selections computed by other threads hold their lock, which is never released
+    # in a forked process such as a background callback job
+    for cache in _selection_caches:
+        cache._items = OrderedDict()  # pylint: disable=protected-access
+        cache._lock = threading.Lock()  # pylint: disable=protected-access
+
+
+os.register_at_fork(after_in_child=_forget_selections)
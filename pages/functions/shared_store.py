@@ -0,0 +1,115 @@
+""" Memory-mapped dataset files shared by all server workers.
+
+With SHARED_DATASET=1 the first worker writes the main dataframe as an
+uncompressed Arrow file and every derived array (filter masks, skill matrix,
+cube) as a .npy file into a folder named after the dataset version. All
+workers, including the first one, then map these files read-only, so the
+operating system keeps a single copy of them in the page cache. """
+import contextlib
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, files are then written without a lock
+    fcntl = None
+
+SHARED_DATASET = os.environ.get('SHARED_DATASET', '0') not in ('', '0', 'false')
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    ''' exclusive lock of the file at path between processes '''
+    with open(path, 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class LocalStore:
+    ''' default store, arrays are built and kept in the memory of each worker '''
+
+    def array(self, name, build):
+        ''' returns build() '''
+        return build()
+
+
+class SharedStore:
+    ''' folder of files for one dataset version, written once and mapped by every worker '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def lock(self):
+        ''' exclusive lock between workers, held while a file is written '''
+        return file_lock(f"{self.folder}.lock")
+
+    def _write_once(self, path, write):
+        ''' calls write(tmp_path) unless another worker already wrote the file '''
+        if os.path.exists(path):
+            return
+        with self.lock():
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                write(tmp_path)
+                os.replace(tmp_path, path)
+
+    def frame(self, build):
+        ''' dataframe backed by a read-only memory-mapped arrow file '''
+        import pyarrow as pa
+        from pyarrow import feather
+
+        path = os.path.join(self.folder, 'dataset.arrow')
+
+        def write(tmp_path):
+            df = build()
+            # a single uncompressed record batch can be mapped without copies
+            feather.write_feather(df, tmp_path, compression='uncompressed',
+                                  chunksize=max(len(df), 1))
+
+        self._write_once(path, write)
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        # numeric, datetime and categorical columns are views of the mapped file,
+        # strings stay in arrow buffers
+        return table.to_pandas(split_blocks=True,
+                               types_mapper={pa.string(): pd.ArrowDtype(pa.string()),
+                                             pa.large_string(): pd.ArrowDtype(pa.large_string())
+                                             }.get)
+
+    def array(self, name, build):
+        ''' read-only memory-mapped array, built by the first worker that needs it '''
+        path = os.path.join(self.folder, f"{name}.npy")
+
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as npy_file:
+                np.save(npy_file, build(), allow_pickle=False)
+
+        self._write_once(path, write)
+        return np.load(path, mmap_mode='r')
+
+    def remove_other_versions(self):
+        ''' deletes files of older dataset versions, workers still mapping them keep their pages '''
+        parent = os.path.dirname(self.folder)
+        for name in os.listdir(parent):
+            path = os.path.join(parent, name)
+            if not name.startswith('shared-') or path in (self.folder, f"{self.folder}.lock"):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+
+def store_for(df):
+    ''' store of the arrays derived from df, shared when df was loaded from a shared folder '''
+    folder = df.attrs.get('shared_folder')
+    return SharedStore(folder) if folder else LocalStore()
@@ -0,0 +1,164 @@
+""" Callback outputs computed once for the identical requests running at the same time.
+
+When many visitors open a page at once, e.g. after a data refresh, their browsers send
+the same callback inputs before any output is cached. The first request of a key
+computes the json string of the output and the requests of the same key arriving
+meanwhile wait for it and share it, so the work grows with the number of distinct
+queries instead of the number of visitors. With SINGLE_FLIGHT_WORKERS=1 the workers
+(and background callback jobs) coalesce as well: the computing process holds a lock
+file of the key in SINGLE_FLIGHT_DIR and writes the output next to it, where the
+waiting processes read it. Written outputs are removed after SINGLE_FLIGHT_SECONDS. """
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from pages.functions.load_data import SNAPSHOT_DIR
+from pages.functions.shared_store import file_lock
+
+SINGLE_FLIGHT_WORKERS = os.environ.get('SINGLE_FLIGHT_WORKERS', '0') not in ('', '0', 'false')
+SINGLE_FLIGHT_DIR = os.environ.get('SINGLE_FLIGHT_DIR', os.path.join(SNAPSHOT_DIR, 'flights'))
+SINGLE_FLIGHT_SECONDS = float(os.environ.get('SINGLE_FLIGHT_SECONDS', 60))
+
+
+class Flight:
+    ''' computation in progress, waited for by the requests of the same key '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        ''' value of the computation, or its exception raised again '''
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    ''' computations by key, at most one of each key running at a time in the worker,
+     and in all workers when shared '''
+
+    def __init__(self, shared=SINGLE_FLIGHT_WORKERS, folder=SINGLE_FLIGHT_DIR):
+        self.shared = shared
+        self.folder = folder
+        self.computed = 0
+        self.coalesced = 0
+        self.from_files = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._swept = (None, 0)
+
+    def run(self, key, compute, version=None):
+        ''' string returned by compute(), or by the call of the same key and dataset
+         version already running '''
+        with self._lock:
+            flight = self._flights.get((version, key))
+            if flight is not None:
+                self.coalesced += 1
+            else:
+                self._flights[(version, key)] = leading = Flight()
+        if flight is not None:
+            return flight.wait()
+        try:
+            if self.shared:
+                leading.value = self._run_shared(key, compute, version)
+            else:
+                leading.value = self._compute(compute)
+        except BaseException as error:
+            leading.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[(version, key)]
+            leading.done.set()
+        return leading.value
+
+    def _compute(self, compute):
+        value = compute()
+        with self._lock:
+            self.computed += 1
+        return value
+
+    def _run_shared(self, key, compute, version):
+        ''' compute() in the worker holding the lock file of the key, the workers waiting
+         for the lock read its output '''
+        folder = self._version_folder(version)
+        path = os.path.join(folder, hashlib.sha1(repr(key).encode()).hexdigest())
+        with file_lock(f"{path}.lock"):
+            value = self._read(path)
+            if value is not None:
+                with self._lock:
+                    self.from_files += 1
+                return value
+            value = self._compute(compute)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as output_file:
+                output_file.write(value)
+            os.replace(tmp_path, path)
+        return value
+
+    @staticmethod
+    def _read(path):
+        try:
+            if time.time() - os.path.getmtime(path) > SINGLE_FLIGHT_SECONDS:
+                return None
+            with open(path, encoding='utf-8') as output_file:
+                return output_file.read()
+        except OSError:
+            return None
+
+    def _version_folder(self, version):
+        ''' folder of the outputs of a dataset version, swept from time to time '''
+        folder = os.path.join(self.folder, str(version))
+        # another worker may have removed it as the folder of an older version
+        os.makedirs(folder, exist_ok=True)
+        now = time.time()
+        with self._lock:
+            swept_version, swept_at = self._swept
+            sweep = swept_version != version or now - swept_at > SINGLE_FLIGHT_SECONDS
+            if sweep:
+                self._swept = (version, now)
+        if sweep:
+            self._sweep(folder, now)
+        return folder
+
+    def _sweep(self, folder, now):
+        ''' removes the folders of other dataset versions and the outputs older than
+         SINGLE_FLIGHT_SECONDS, a lock file removed while in use only costs a computation '''
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if path != folder:
+                shutil.rmtree(path, ignore_errors=True)
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            try:
+                if now - os.path.getmtime(path) > SINGLE_FLIGHT_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        ''' counters of computed and shared outputs '''
+        with self._lock:
+            return {'computed': self.computed,
+                    'coalesced': self.coalesced,
+                    'from_files': self.from_files,
+                    'running': len(self._flights),
+                    'workers': self.shared}
+
+
+# used by FigureCache.memoize for the outputs missing from the figure caches
+flights = SingleFlight()
+
+
+def _forget_flights():
+    # flights of other threads never finish in a forked process
+    flights._flights = {}  # pylint: disable=protected-access
+    flights._lock = threading.Lock()  # pylint: disable=protected-access
+
+
+os.register_at_fork(after_in_child=_forget_flights)
@@ -0,0 +1,88 @@
+""" Skill counts for any selection of rows, used on both home and compare pages """
+import logging
+
+import numpy as np
+import pandas as pd
+
+from pages.functions.shared_store import LocalStore
+
+logger = logging.getLogger(__name__)
+
+# skill values of the mention types, 'any' counts both of them, see SkillMatrix
+MENTION_VALUES = {'advantage': 1, 'mandatory': 2}
+# rows multiplied at once by cooccurrence, small enough for their float32 sums to be exact
+COOCCURRENCE_CHUNK = 16384
+
+
+class SkillMatrix:
+    ''' skill columns of the main dataframe as one int8 matrix aligned with the skill list.
+     Values are 0 - not mentioned, 1 - advantage, 2 - mandatory.
+     With the matrix of the previous dataset version and the keep mask of
+     load_data.merge_delta, only the rows of the delta are converted '''
+
+    def __init__(self, df, skills, store=None, previous=None, keep=None):
+        store = store or LocalStore()
+        self.skills = []
+        for skill in skills:
+            if skill in df:
+                self.skills.append(skill)
+            else:
+                logger.warning("skill column %s is missing from the dataset", skill)
+
+        def build():
+            if previous is None or previous.skills != self.skills:
+                return self._to_matrix(df)
+            # after merge_delta only the appended rows are converted
+            return np.concatenate([previous.matrix[keep],
+                                   self._to_matrix(df.iloc[int(keep.sum()):])])
+
+        self.matrix = store.array('skill_matrix', build)
+
+    def _to_matrix(self, df):
+        return np.ascontiguousarray(df[self.skills].to_numpy(dtype='int8').clip(0, 2))
+
+    def cooccurrence(self, rows=None, mention='any'):
+        ''' vacancies mentioning each pair of skills, see cooccurrence '''
+        rows = np.arange(len(self.matrix)) if rows is None else rows
+        return cooccurrence_frame(self.skills, cooccurrence(self.matrix, rows, mention))
+
+    def group_counts(self, rows, groups, n_groups):
+        ''' advantage and mandatory counts of every skill for each group of rows,
+         as two arrays of shape (n_groups, number of skills) '''
+        return group_counts(self.matrix, rows, groups, n_groups)
+
+
+def group_counts(matrix, rows, groups, n_groups):
+    ''' SkillMatrix.group_counts of any matrix of skill values '''
+    advantage = np.zeros((n_groups, matrix.shape[1]), dtype='int64')
+    mandatory = np.zeros((n_groups, matrix.shape[1]), dtype='int64')
+    groups = 3*np.asarray(groups, dtype='int64')
+    for pos in range(matrix.shape[1]):
+        bins = np.bincount(groups + matrix[rows, pos], minlength=n_groups*3)
+        bins = bins.reshape(n_groups, 3)
+        advantage[:, pos] = bins[:, 1]
+        mandatory[:, pos] = bins[:, 2]
+    return advantage, mandatory
+
+
+def cooccurrence(matrix, rows, mention='any'):
+    ''' rows of a matrix of skill values mentioning each pair of skills, as a symmetric
+     int64 array with the rows mentioning each skill on its diagonal. mention is 'any',
+     'advantage' or 'mandatory'. It is the product Xᵀ·X of the 0/1 mention matrix X of
+     the rows, multiplied by chunks of rows in float32 '''
+    counts = np.zeros((matrix.shape[1], matrix.shape[1]), dtype='int64')
+    rows = np.asarray(rows)
+    for start in range(0, len(rows), COOCCURRENCE_CHUNK):
+        values = matrix[rows[start:start + COOCCURRENCE_CHUNK]]
+        if mention == 'any':
+            mentioned = (values > 0).astype('float32')
+        else:
+            mentioned = (values == MENTION_VALUES[mention]).astype('float32')
+        counts += (mentioned.T @ mentioned).astype('int64')
+    return counts
+
+
+def cooccurrence_frame(skills, counts):
+    ''' frame of cooccurrence counts with the skills as index and columns '''
+    return pd.DataFrame(counts, index=pd.Index(skills, name='skill'),
+                        columns=pd.Index(skills, name='paired_skill'))
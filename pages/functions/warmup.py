@@ -0,0 +1,145 @@
+""" Figures of the page defaults and of the time period presets, computed once per dataset version.
+
+Pages register their memoized callbacks with the inputs of their radio presets
+(all vacancies, no other filter). After a dataset version is loaded, warm_up()
+calls them in a background thread to fill the figure caches, and writes the cached
+json strings to figures-{version}-{code}.json in the snapshot folder. Other workers, and
+later starts of the server, read this file instead of computing the figures.
+Set FIGURE_WARMUP=0 to disable it. """
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from pages.functions.dataset import current
+from pages.functions.figure_cache import canonical_key
+from pages.functions.load_data import SNAPSHOT_DIR
+from pages.functions.shared_store import file_lock
+
+logger = logging.getLogger(__name__)
+
+FIGURE_WARMUP = os.environ.get('FIGURE_WARMUP', '1') not in ('', '0', 'false')
+
+# (callback, inputs) pairs, inputs(data) returns the argument tuples of the presets
+_callbacks = []
+# versions already warmed up or being warmed up by this worker
+_versions = set()
+_versions_lock = threading.Lock()
+
+
+def register(callback, inputs):
+    ''' adds a callback decorated with FigureCache.memoize to the warm-up '''
+    _callbacks.append((callback, inputs))
+
+
+def code_key():
+    ''' hash of the sources of the pages, figures saved by other code are not loaded '''
+    pages_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(pages_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.endswith('.py'):
+                with open(os.path.join(root, file_name), 'rb') as source:
+                    digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+
+CODE_KEY = code_key()
+
+
+def figures_path(version, snapshot_dir=None):
+    ''' file of the persisted figures of a dataset version '''
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f"figures-{version}-{CODE_KEY}.json")
+
+
+def _from_json(key):
+    # json turns the tuples of canonical_key into lists
+    return tuple(tuple(value) if isinstance(value, list) else value for value in key)
+
+
+def load(version, snapshot_dir=None):
+    ''' fills the figure caches from the file of the version, False when there is none '''
+    try:
+        with open(figures_path(version, snapshot_dir), encoding='utf-8') as figures_file:
+            figures = json.load(figures_file)
+    except (OSError, ValueError):
+        return False
+    for callback, _ in _callbacks:
+        cache = callback.figure_cache
+        for key, value in figures.get(cache.name, []):
+            cache.put(_from_json(key), value, version)
+    return True
+
+
+def compute(data):
+    ''' calls every callback with the preset inputs, returns their cached outputs by cache name '''
+    figures = {}
+    for callback, inputs in _callbacks:
+        cache = callback.figure_cache
+        for args in inputs(data):
+            callback(*args)
+            value = cache.peek(canonical_key(args), data.version)
+            if value is not None:
+                figures.setdefault(cache.name, []).append([canonical_key(args), value])
+    return figures
+
+
+def save(version, figures, snapshot_dir=None):
+    ''' writes the figures of a version atomically and removes the files of other versions '''
+    path = figures_path(version, snapshot_dir)
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as figures_file:
+        json.dump(figures, figures_file)
+    os.replace(tmp_path, path)
+    for file_name in os.listdir(folder):
+        if file_name.startswith('figures-') and os.path.join(folder, file_name) not in (
+                path, f"{path}.lock"):
+            os.remove(os.path.join(folder, file_name))
+
+
+def warm_up(data=None, snapshot_dir=None):
+    ''' loads the figures of the dataset version or computes and saves them. Only one
+     worker computes them, the others wait for its file '''
+    data = data or current()
+    start = time.perf_counter()
+    source = 'loaded'
+    if not load(data.version, snapshot_dir):
+        with file_lock(f"{figures_path(data.version, snapshot_dir)}.lock"):
+            if not load(data.version, snapshot_dir):
+                figures = compute(data)
+                # figures of a version replaced during the warm-up are not saved
+                if current().version != data.version:
+                    return
+                save(data.version, figures, snapshot_dir)
+                source = 'computed'
+    logger.info("figures of dataset %s %s in %.3fs", data.version, source,
+                time.perf_counter() - start)
+
+
+def _warm_up_safely(data):
+    try:
+        warm_up(data)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("figure warm-up failed, figures are computed on request")
+
+
+def warm_up_in_background(data=None):
+    ''' starts warm_up in a daemon thread, once per dataset version. Without data the
+     current dataset is loaded first, in the thread as well '''
+    if not FIGURE_WARMUP:
+        return
+    if data is None:
+        threading.Thread(target=lambda: warm_up_in_background(current()),
+                         name='dataset-load', daemon=True).start()
+        return
+    with _versions_lock:
+        if data.version in _versions:
+            return
+        _versions.add(data.version)
+    threading.Thread(target=_warm_up_safely, args=(data,), name='figure-warmup',
+                     daemon=True).start()
@@ -1,18 +1,23 @@
 """ This is the main page of the dash application """
 import sys
-from datetime import date
-from dateutil.relativedelta import relativedelta
 
 import pandas as pd
 
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import dash_bootstrap_components as dbc
 
-from pages.functions.common_elements import job_type, data_professions, time_period
-from pages.functions.common_elements import df, create_ban_card
+from pages.functions.common_elements import select_job_type, select_data_professions
+from pages.functions.common_elements import select_time_period, time_period_options
+from pages.functions.common_elements import preset_dates
+from pages.functions.common_elements import create_ban_card
+from pages.functions.dataset import current
 from pages.functions import generate_charts as gen_charts
+from pages.functions import background, metrics, warmup
+from pages.functions.figure_cache import FigureCache
+from pages.functions.figure_patch import patch_figures
+from pages.functions.selection import SelectionCache
 
 
 # Define dash app page
@@ -20,150 +25,228 @@ sys.path.append('/functions')
 dash.register_page(__name__, path='/', title='Data Jobs in Israel 2024-2025')
 pd.options.mode.chained_assignment =  None
 
-# All default visualizations are defined using functions from generate_charts.py
-fig_bar = gen_charts.generate_bar_chart(df)
-fig_line = gen_charts.generate_line_chart(df)
-fig_pie_district = gen_charts.generate_pie_district(df)
-fig_en = gen_charts.generate_single_bar_en(df)
-fig_he = gen_charts.generate_single_bar_he(df)
-fig_edu = gen_charts.generate_single_bar_degree(df)
-fig_recr = gen_charts.generate_single_bar_recruter(df)
-#fig_pie_cloud = generate_pie_cloud(df)
-fig_pie_bi = gen_charts.generate_pie_viz(df)
-fig_bar_companies = gen_charts.generate_bar_chart_companies(df)
-
-# Page layout
-layout = dbc.Row(
-    children = [
-        # Column for user controls
-        dbc.Col(html.Div([
-            html.Div(
-                children=[
-                    job_type,
-                    data_professions,
-                    html.Br(),
-                    time_period
-                ]),
-                html.Br(),
-            ], style={"padding-left" : "4px"},
-        ), style = {"position": "fixed", "background-color": "#f8f9fa",
-                    "top": "4rem", "bottom":0, "width":"20rem"}
-        ),
-        # Column for app graphs and plots
-        dbc.Col(
-            children=[
-                dbc.Row([
-                    create_ban_card("Last Update:", f"{df['first_online'].max():%d %b %Y}", True),
-                    create_ban_card("Total Vacancies: ", f"{len(df):,d}", True),
-                    create_ban_card("Vacancies Selected: ", "total-vacancies"),
-                    create_ban_card("Mean required experience: ", "exp-text")
-                ], style={"text-align": "center"}),
-                dbc.Row(
+# skill of the paired skills chart when the page is opened
+PAIRED_SKILL = 'Snowflake'
+mention_options = [{'label': 'Any mention', 'value': 'any'},
+                   {'label': 'Mandatory', 'value': 'mandatory'},
+                   {'label': 'Advantage', 'value': 'advantage'}]
+
+def default_inputs(data):
+    ''' filter values of the page before any control is changed '''
+    return [], [], str(data.first_day.date()), str(data.last_day.date())
+
+def preset_inputs(data):
+    ''' filter values of every time period radiobutton without other filters, see warmup.py '''
+    return [([], [], start_date, end_date)
+            for start_date, end_date in preset_dates(time_period_options, data)]
+
+def default_figures(data):
+    ''' outputs of the chart callbacks for all vacancies by component id. They are the
+     first requests of every page load as well, so both come from the figure caches '''
+    figures = {}
+    for name, callback in chart_callbacks.items():
+        figures.update(zip(chart_outputs[name],
+                           callback(*default_inputs(data), *chart_defaults[name])))
+    return figures
+
+def layout(**_):
+    ''' page layout, built for every page load from the current dataset version '''
+    data = current()
+    figures = default_figures(data)
+
+    # Page layout
+    return dbc.Row(
+        children = [
+            # Column for user controls
+            dbc.Col(html.Div([
+                html.Div(
                     children=[
-                        dbc.Col([dcc.Graph(id="bar_chart", figure=fig_bar)], width=8),
-                        dbc.Col([dcc.Graph(id="pie_district", figure=fig_pie_district)], width=4)
+                        select_job_type("job-type"),
+                        select_data_professions("all-types"),
+                        html.Br(),
+                        select_time_period("time-period-radio", "time-period",
+                                           time_period_options)
                     ]),
-                dbc.Row(
-                    children=[
-                        dbc.Col(html.Div([dcc.Graph(id="line_chart", figure=fig_line)]), width=8),
-                        dbc.Col([dbc.Card([
-                            html.H6("Language/Degree Requirements, Employer type",
-                                    className="card-title"),
-                            dcc.Graph(id="single_bar_en",
-                                      figure=fig_en,
-                                      config={'displayModeBar': False}),
-                            dcc.Graph(id="single_bar_he",
-                                      figure=fig_he,
-                                      config={'displayModeBar': False}),
-                            dcc.Graph(id="single_bar_degree",
-                                      figure=fig_edu,
-                                      config={'displayModeBar': False}),
-                            dcc.Graph(id="single_bar_recr",
-                                      figure=fig_recr,
-                                      config={'displayModeBar': False}),
-                        ], style={"top": "1rem"})], width=4),
+                    html.Br(),
+                ], style={"padding-left" : "4px"},
+            ), style = {"position": "fixed", "background-color": "#f8f9fa",
+                        "top": "4rem", "bottom":0, "width":"20rem"}
+            ),
+            # Column for app graphs and plots
+            dbc.Col(
+                children=[
+                    dbc.Row([
+                        create_ban_card("Last Update:", f"{data.last_day:%d %b %Y}", True),
+                        create_ban_card("Total Vacancies: ", f"{data.n_rows:,d}", True),
+                        create_ban_card("Vacancies Selected: ", "total-vacancies"),
+                        create_ban_card("Mean required experience: ", "exp-text")
+                    ], style={"text-align": "center"}),
+                    dbc.Row(
+                        children=[
+                            dbc.Col([dcc.Graph(id="bar_chart", figure=figures["bar_chart"])], width=8),
+                            dbc.Col([dcc.Graph(id="pie_district", figure=figures["pie_district"])], width=4)
+                        ]),
+                    dbc.Row(
+                        children=[
+                            dbc.Col(html.Div([dcc.Graph(id="line_chart", figure=figures["line_chart"])]), width=8),
+                            dbc.Col([dbc.Card([
+                                html.H6("Language/Degree Requirements, Employer type",
+                                        className="card-title"),
+                                dcc.Graph(id="single_bar_en",
+                                          figure=figures["single_bar_en"],
+                                          config={'displayModeBar': False}),
+                                dcc.Graph(id="single_bar_he",
+                                          figure=figures["single_bar_he"],
+                                          config={'displayModeBar': False}),
+                                dcc.Graph(id="single_bar_degree",
+                                          figure=figures["single_bar_degree"],
+                                          config={'displayModeBar': False}),
+                                dcc.Graph(id="single_bar_recr",
+                                          figure=figures["single_bar_recr"],
+                                          config={'displayModeBar': False}),
+                            ], style={"top": "1rem"})], width=4),
+                        ]),
+                    dbc.Row(
+                        children=[
+                            dbc.Col(html.Div([dcc.Graph(id="bar_companies", figure=figures["bar_companies"])]), width=8),
+                            dbc.Col([dcc.Graph(id="pie_viz", figure=figures["pie_viz"])], width=4)
                     ]),
-                dbc.Row(
-                    children=[
-                        dbc.Col(html.Div([dcc.Graph(id="bar_companies", figure=fig_bar_companies)]), width=8),
-                        dbc.Col([dcc.Graph(id="pie_viz", figure=fig_pie_bi)], width=4)
-                ]),
-            ], style = {"margin-left": "21rem"}
-        ),
-    ], className='dbc'
-)
+                    dbc.Row(
+                        children=[
+                            dbc.Col([
+                                dbc.RadioItems(id="skill-mention", options=mention_options,
+                                               value='any', inline=True),
+                                dcc.Graph(id="skill_heatmap", figure=figures["skill_heatmap"]),
+                            ], width=7),
+                            dbc.Col([
+                                dcc.Dropdown(id="paired-skill",
+                                             options=data.skills,
+                                             value=PAIRED_SKILL, clearable=False),
+                                dcc.Graph(id="paired_skills", figure=figures["paired_skills"]),
+                            ], width=5),
+                    ]),
+                ], style = {"margin-left": "21rem"}
+            ),
+        ], className='dbc'
+    )
+
 
-@dash.callback(
+# presets are turned into dates in the browser, without a request to the server
+dash.clientside_callback(
+    ClientsideFunction(namespace='time_period', function_name='preset_dates'),
     Output("time-period", "start_date"),
     Output("time-period", "end_date"),
     Output("time-period", "disabled"),
     [
         Input("time-period-radio", "value"),
     ],
+    State("time-period-bounds", "data"),
 )
-def filter_df_radio(radio_value):
-    ''' updates datepicker based on selected radiobutton '''
-    if radio_value > 0:
-        last_include = df['first_online'].max() - relativedelta(months=radio_value)
-        return last_include.date(), df['first_online'].max().date(), True
-    if radio_value == 0:
-        return df['first_online'].min().date(), df['first_online'].max().date(), True
-    return df['first_online'].min().date(), df['first_online'].max().date(), False
-
-@dash.callback(
-    Output("total-vacancies", "children"),
-    Output("bar_chart", "figure"),
-    Output("line_chart", "figure"),
-    Output("pie_district", "figure"),
-    Output("exp-text", "children"),
-    Output("single_bar_en", "figure"),
-    Output("single_bar_he", "figure"),
-    Output("single_bar_degree", "figure"),
-    Output("single_bar_recr", "figure"),
-    Output("bar_companies", "figure"),
-    Output("pie_viz", "figure"),
-    [
-        Input("job-type", "value"),
-        Input("all-types", "value"),
-        Input("time-period", "start_date"),
-        Input("time-period", "end_date")
-    ],
-)
-def filter_df(job_type_val, all_types, start_date, end_date):
-    ''' 1. filters main dataframe depending on user control values
-        2. generates visualisations using filtered dataframe '''
-
-    df_selected = df.copy()
-
-    # filter by seniority level
-    if len(job_type_val)  > 0:
-        df_selected = df_selected.loc[df_selected['job_type'].isin(job_type_val)]
-
-    # filter by profession
-    if len(all_types) > 0:
-        df_selected['total'] = df_selected[all_types].sum(axis=1)
-        df_selected = df_selected.loc[df_selected['total'] > 0]
-
-    # filter by publication date
-    start_date = date.fromisoformat(start_date)
-    end_date = date.fromisoformat(end_date)
-    df_selected = df_selected.loc[
-        (df_selected['first_online'].dt.date >= start_date) &
-        (df_selected['first_online'].dt.date <= end_date)]
-
-    # generate visualisations
-    fig_bar_viz = gen_charts.generate_bar_chart(df_selected)
-    fig_line_viz = gen_charts.generate_line_chart(df_selected)
-    fig_pie_cloud = gen_charts.generate_pie_district(df_selected)
-    fig_en_viz = gen_charts.generate_single_bar_en(df_selected)
-    fig_he_viz = gen_charts.generate_single_bar_he(df_selected)
-    fig_edu_viz = gen_charts.generate_single_bar_degree(df_selected)
-    fig_recr_viz = gen_charts.generate_single_bar_recruter(df_selected)
-    fig_bar_companies_viz = gen_charts.generate_bar_chart_companies(df_selected)
-    fig_pie_bi_viz = gen_charts.generate_pie_viz(df_selected)
-
-    selected_jobs_string = f"{len(df_selected):,d}"
-    exp_text = f"{df_selected['min_experience'].mean():.2f} years"
-
-    return selected_jobs_string, fig_bar_viz, fig_line_viz, fig_pie_cloud, exp_text,\
-        fig_en_viz, fig_he_viz, fig_edu_viz, fig_recr_viz, fig_bar_companies_viz, fig_pie_bi_viz
+
+# filter values shared by all chart callbacks of the page
+FILTER_INPUTS = [
+    Input("job-type", "value"),
+    Input("all-types", "value"),
+    Input("time-period", "start_date"),
+    Input("time-period", "end_date")
+]
+# selections of the latest filter values, shared by the chart callbacks
+selections = SelectionCache()
+# registered chart callbacks and their output ids by group name
+chart_callbacks = {}
+chart_outputs = {}
+# values of the controls of a group when the page is opened, by group name
+chart_defaults = {}
+
+
+def chart_callback(name, outputs, controls=()):
+    ''' registers a callback computing one group of outputs from the shared selection.
+     controls are (Input, default value) pairs of the controls used by this group only,
+     their values are passed to the decorated function after the selection.
+     The browser requests all groups at once, so fast charts are shown first and the
+     groups run in parallel on the server threads or workers, or in background jobs '''
+    figure_cache = FigureCache(f"home.{name}")
+    defaults = tuple(default for _, default in controls)
+
+    def decorator(build):
+        @figure_cache.memoize(lambda: current().version)
+        def callback(job_type_val, all_types, start_date, end_date, *values):
+            # filter by seniority level, profession and publication date
+            sel = selections.get(job_type_val, all_types, start_date, end_date, current())
+            return build(sel, *values)
+        # the browser gets patches of the full figures cached and shown in the layout
+        dash.callback(outputs, FILTER_INPUTS + [control for control, _ in controls],
+                      **background.callback_options(f"home.{name}"))(
+            metrics.instrument_callback(f"home.{name}",
+                                        [output.component_id for output in outputs])(
+                patch_figures(callback)))
+        chart_callbacks[name] = callback
+        chart_outputs[name] = [output.component_id for output in outputs]
+        chart_defaults[name] = defaults
+        warmup.register(callback, lambda data: [args + defaults for args in preset_inputs(data)])
+        return callback
+    return decorator
+
+
+@chart_callback('bans', [Output("total-vacancies", "children"), Output("exp-text", "children")])
+def update_bans(sel):
+    ''' selected vacancies and mean required experience '''
+    selected_jobs_string = f"{sel.summary.all('rows'):,d}"
+    exp_text = f"{sel.summary.mean_experience():.2f} years"
+    return selected_jobs_string, exp_text
+
+
+@chart_callback('skills', [Output("bar_chart", "figure")])
+def update_skills(sel):
+    ''' top skills bar chart '''
+    return [gen_charts.generate_bar_chart(sel)]
+
+
+@chart_callback('weekly', [Output("line_chart", "figure")])
+def update_weekly(sel):
+    ''' new vacancies per week '''
+    return [gen_charts.generate_line_chart(sel)]
+
+
+@chart_callback('district', [Output("pie_district", "figure")])
+def update_district(sel):
+    ''' vacancies by district '''
+    return [gen_charts.generate_pie_district(sel)]
+
+
+@chart_callback('single_bars', [Output("single_bar_en", "figure"),
+                                Output("single_bar_he", "figure"),
+                                Output("single_bar_degree", "figure"),
+                                Output("single_bar_recr", "figure")])
+def update_single_bars(sel):
+    ''' language, degree and employer type bars '''
+    return gen_charts.generate_single_bar_en(sel), gen_charts.generate_single_bar_he(sel),\
+        gen_charts.generate_single_bar_degree(sel), gen_charts.generate_single_bar_recruter(sel)
+
+
+@chart_callback('companies', [Output("bar_companies", "figure")])
+def update_companies(sel):
+    ''' largest employers '''
+    return [gen_charts.generate_bar_chart_companies(sel)]
+
+
+@chart_callback('viz', [Output("pie_viz", "figure")])
+def update_viz(sel):
+    ''' visualization tools pie chart '''
+    return [gen_charts.generate_pie_viz(sel)]
+
+
+@chart_callback('heatmap', [Output("skill_heatmap", "figure")],
+                [(Input("skill-mention", "value"), 'any')])
+def update_heatmap(sel, mention):
+    ''' skills asked for together '''
+    return [gen_charts.generate_skill_heatmap(sel, mention)]
+
+
+@chart_callback('paired', [Output("paired_skills", "figure")],
+                [(Input("skill-mention", "value"), 'any'),
+                 (Input("paired-skill", "value"), PAIRED_SKILL)])
+def update_paired(sel, mention, skill):
+    ''' skills asked for together with the chosen one, sharing the pair counts of the
+     selection with the heatmap '''
+    return [gen_charts.generate_paired_skills(sel, skill, mention)]
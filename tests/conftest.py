@@ -0,0 +1,30 @@
+""" Fixtures of the tests: a small synthetic dataset, see benchmarks/synthetic_data.py,
+with its snapshots and stored backend copies in a temporary folder, and random
+selections of it from benchmarks/check.py. """
+import pytest
+
+from benchmarks.check import random_selections
+from benchmarks.synthetic_data import write_csv
+
+ROWS = 3000
+SEED = 0
+SELECTIONS = 12
+
+
+@pytest.fixture(scope='session')
+def csv_path(tmp_path_factory):
+    return write_csv(ROWS, str(tmp_path_factory.mktemp('data')), SEED)
+
+
+@pytest.fixture(scope='session')
+def data(csv_path, tmp_path_factory):
+    from pages.functions.dataset import Dataset
+    from pages.functions.load_data import load_dataset
+
+    snapshot_dir = str(tmp_path_factory.mktemp('snapshots'))
+    return Dataset(load_dataset(csv_path, snapshot_dir, shared=False))
+
+
+@pytest.fixture(scope='session')
+def selections(data):
+    return list(random_selections(data, SELECTIONS, SEED))
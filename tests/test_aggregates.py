@@ -0,0 +1,25 @@
+""" Aggregates of the filter index, cube and skill matrix against the pandas calls of the
+charts on the filtered dataframe """
+import numpy as np
+
+from benchmarks.check import failed_checks, pandas_checks, selected_frame
+
+
+def controls(sel):
+    return sel.job_types, sel.all_types, sel.start_day, sel.end_day
+
+
+def test_filter_rows_match_pandas(data, selections):
+    for sel in selections:
+        expected = selected_frame(data.df, sel).index.to_numpy()
+        assert np.array_equal(sel.rows, expected), controls(sel)
+
+
+def test_aggregates_match_pandas(data, selections):
+    for sel in selections:
+        assert failed_checks(pandas_checks(sel, data.df)) == [], controls(sel)
+
+
+def test_selections_include_all_and_no_rows(data, selections):
+    assert len(selections[0].rows) == len(data.df)
+    assert len(selections[1].rows) == 0
@@ -0,0 +1,17 @@
+""" Every query backend returns the aggregates of the pandas backend """
+import pytest
+
+from benchmarks.check import backend_datasets, failed_checks, result_checks
+
+
+@pytest.fixture(scope='module')
+def others(data):
+    return backend_datasets(data)
+
+
+@pytest.mark.parametrize('name', ['sqlite', 'duckdb', 'partitions'])
+def test_backend_matches_pandas(name, others, selections):
+    if name == 'duckdb':
+        pytest.importorskip('duckdb')
+    for sel in selections:
+        assert failed_checks(result_checks(sel, others[name], name)) == []
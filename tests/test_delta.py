@@ -0,0 +1,36 @@
+""" A dataset updated with a scrape batch by Dataset.with_delta against pandas and
+against the dataset loaded again with the batch """
+import shutil
+
+import pytest
+
+from benchmarks.check import (delta_datasets, failed_checks, index_checks, pandas_checks,
+                              random_selections, result_checks)
+from conftest import SEED, SELECTIONS
+
+
+@pytest.fixture(scope='module')
+def delta(csv_path):
+    updated, loaded, snapshot_dir = delta_datasets(csv_path, SEED)
+    yield updated, loaded
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+def test_batch_is_upserted_by_url(delta):
+    updated, _ = delta
+    assert updated.deltas and updated.df['district'].eq('Eilat').any()
+    # every url keeps a single code, distinct from the codes of the other urls
+    codes = updated.df.dropna(subset=['url']).groupby('url')['url_code']
+    assert codes.nunique().eq(1).all()
+    assert codes.first().is_unique
+
+
+def test_indexes_match_loaded_dataset(delta):
+    assert failed_checks(index_checks(*delta)) == []
+
+
+def test_aggregates_match_pandas_and_loaded_dataset(delta):
+    updated, loaded = delta
+    for sel in random_selections(updated, SELECTIONS, SEED):
+        assert failed_checks(pandas_checks(sel, updated.df)) == []
+        assert failed_checks(result_checks(sel, loaded, 'delta')) == []
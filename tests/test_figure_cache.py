@@ -0,0 +1,57 @@
+""" Hits, misses, eviction and version changes of FigureCache """
+from pages.functions.figure_cache import FigureCache, cache_stats
+
+
+def memoized(name, maxsize, version):
+    ''' callback memoized by a new cache, with the list of its computed inputs '''
+    cache = FigureCache(name, maxsize)
+    computed = []
+
+    @cache.memoize(lambda: version[0])
+    def callback(*args):
+        computed.append(args)
+        return {'figure': list(args)}
+
+    return cache, callback, computed
+
+
+def test_hits_and_misses():
+    cache, callback, computed = memoized('test-hits', 4, ['v1'])
+    assert callback(['type_ds', 'type_da'], '2025-01-01T00:00:00') == {
+        'figure': [['type_ds', 'type_da'], '2025-01-01T00:00:00']}
+    # the same filter values in another order or with a time part are a hit
+    callback(['type_da', 'type_ds'], '2025-01-01')
+    assert len(computed) == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+    assert cache_stats()['test-hits'] == stats
+
+
+def test_least_recently_used_output_is_evicted():
+    cache, callback, computed = memoized('test-eviction', 2, ['v1'])
+    callback('a')
+    callback('b')
+    callback('a')
+    callback('c')
+    assert cache.stats()['size'] == 2
+    callback('a')
+    assert len(computed) == 3
+    callback('b')
+    assert computed == [('a',), ('b',), ('c',), ('b',)]
+
+
+def test_new_dataset_version_empties_the_cache():
+    version = ['v1']
+    cache, callback, computed = memoized('test-version', 4, version)
+    callback('a')
+    version[0] = 'v2'
+    callback('a')
+    assert len(computed) == 2
+    assert cache.stats()['version'] == 'v2'
+
+
+def test_zero_size_disables_the_cache():
+    cache, callback, computed = memoized('test-disabled', 0, ['v1'])
+    callback('a')
+    callback('a')
+    assert len(computed) == 2 and cache.stats()['size'] == 0